@@ -0,0 +1,123 @@
+"""Накладные расходы маршрутизации одного текстового сообщения
+
+Сравнивается прежняя цепочка обработчиков (команды и регулярные выражения
+плагинов, затем handle_message со словарем кнопок, который строился заново
+на каждое сообщение) и центральный маршрутизатор UpdateRouter.
+Запуск: python -m benchmarks.bench_router
+"""
+import timeit
+from datetime import datetime
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import CommandHandler, MessageHandler, filters
+
+from plugins.currency_data import CONVERSION_RE
+from utils.router import UpdateRouter
+
+
+async def noop(update, context):
+    pass
+
+
+class Bot:
+    """Бот без сети: CommandHandler сверяет только имя бота в команде"""
+    username = "test_bot"
+
+
+MESSAGES = [
+    "Напиши план обучения Python",  # диалог с AI - самый частый случай
+    "📊 На 5 дней",
+    "💡 Примеры запросов",
+    "🏙️ Москва",
+    "100 usd в eur",
+    "/weather Москва",
+]
+
+
+def make_update(text: str) -> Update:
+    entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))] if text.startswith('/') else None
+    message = Message(1, datetime.now(), Chat(1, "private"), from_user=User(1, "user", False), text=text,
+                      entities=entities)
+    message.set_bot(Bot())
+    return Update(1, message=message)
+
+
+def legacy_handlers():
+    """Цепочка обработчиков группы 0 до введения маршрутизатора"""
+    return [
+        CommandHandler("weather", noop),
+        MessageHandler(filters.Regex(r'^(🌤️ Погода|📍 Ввести другой город|🔄 Выбрать другой город|'
+                                     r'🌡️ Сейчас|📅 Сегодня|📆 Завтра|📊 На 5 дней)$'), noop),
+        MessageHandler(filters.Regex(r'^(🏙️ .+|📍 .+)$'), noop),
+        MessageHandler(filters.Regex(r'^◀️ Назад$'), noop),
+        CommandHandler("currency", noop),
+        MessageHandler(filters.Regex(r'^(💱 Курсы валют|💵 Основные валюты|🔄 Конвертер|📊 Все курсы|'
+                                     r'📈 Изменения|🗓 История)$'), noop),
+        MessageHandler(filters.Regex(CONVERSION_RE), noop),
+        MessageHandler(filters.Regex(r'^◀️ Назад$'), noop),
+        CommandHandler("start", noop),
+        CommandHandler("help", noop),
+        CommandHandler("about", noop),
+        CommandHandler("reset", noop),
+        MessageHandler(filters.Document.ALL, noop),
+        MessageHandler(filters.PHOTO, noop),
+        MessageHandler(filters.VOICE, noop),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, noop),
+    ]
+
+
+def legacy_route(handlers, update: Update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if not (check is None or check is False):
+            if handler is handlers[-1]:
+                # handle_message: словарь кнопок с новыми lambda на каждое сообщение
+                button_handlers = {
+                    "❓ Помощь": noop, "ℹ️ О боте": noop, "🔄 Сбросить диалог": noop,
+                    "💡 Примеры запросов": noop, "📊 Анализ файлов": noop,
+                    "📋 Пересказ": lambda u, c: noop(u, c), "🔑 Ключевые пункты": lambda u, c: noop(u, c),
+                    "📊 Подробный анализ": lambda u, c: noop(u, c), "❓ Вопросы и ответы": lambda u, c: noop(u, c)
+                }
+                return button_handlers.get(update.message.text, noop)
+            return handler
+
+
+def current_router() -> UpdateRouter:
+    router = UpdateRouter()
+    router.add_command("weather", noop)
+    router.add_buttons(["🌤️ Погода", "📍 Ввести другой город", "🔄 Выбрать другой город",
+                        "🌡️ Сейчас", "📅 Сегодня", "📆 Завтра", "📊 На 5 дней"], noop)
+    router.add_pattern(r'^(🏙️ .+|📍 .+)$', noop)
+    router.add_command("currency", noop)
+    router.add_buttons(["💱 Курсы валют", "💵 Основные валюты", "🔄 Конвертер", "📊 Все курсы",
+                        "📈 Изменения", "🗓 История"], noop)
+    router.add_pattern(CONVERSION_RE, noop)
+    for command in ("start", "help", "about", "reset"):
+        router.add_command(command, noop)
+    router.add_buttons(["❓ Помощь", "ℹ️ О боте", "🔄 Сбросить диалог", "💡 Примеры запросов", "📊 Анализ файлов",
+                        "📋 Пересказ", "🔑 Ключевые пункты", "📊 Подробный анализ", "❓ Вопросы и ответы",
+                        "◀️ Назад"], noop)
+    router.set_fallback(noop)
+    return router
+
+
+def main(number: int = 20000):
+    updates = [make_update(text) for text in MESSAGES]
+    handlers = legacy_handlers()
+    router = current_router()
+    # Единственный обработчик приложения тоже проверяет обновление
+    entry = MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT, noop)
+
+    def routed(update):
+        entry.check_update(update)
+        return router.resolve(update.message.text, update.effective_user.id)
+
+    for text, update in zip(MESSAGES, updates):
+        legacy = min(timeit.repeat(lambda: legacy_route(handlers, update), number=number, repeat=5))
+        current = min(timeit.repeat(lambda: routed(update), number=number, repeat=5))
+        print(f"{text[:30]:30} legacy {legacy / number * 1e6:6.2f} µs, router {current / number * 1e6:5.2f} µs"
+              f" ({legacy / current:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Время холодного старта и память системы плагинов: ленивая загрузка против немедленной
+
+Каждый вариант запускается в отдельном процессе, чтобы импорт модулей был холодным.
+Запуск: python -m benchmarks.bench_startup
+"""
+import subprocess
+import sys
+
+SNIPPET = """
+import time, tracemalloc
+tracemalloc.start()
+started = time.perf_counter()
+
+import telegram.ext  # импортируется ботом в любом случае
+base_time = time.perf_counter() - started
+base_memory = tracemalloc.get_traced_memory()[0]
+
+from plugins.init import plugin_manager
+
+
+class Application:
+    running = False
+
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append(handler)
+
+
+plugin_manager.discover()
+for manifest in plugin_manager.manifests.values():
+    manifest['lazy'] = {lazy}
+plugin_manager.setup_plugins(Application())
+
+elapsed = time.perf_counter() - started - base_time
+memory = tracemalloc.get_traced_memory()[0] - base_memory
+loaded = sum(1 for name in plugin_manager.manifests if plugin_manager.get_plugin(name))
+print(f"{{elapsed * 1000:.1f}} {{memory / 1024:.0f}} {{loaded}}")
+"""
+
+
+def run(lazy: bool):
+    output = subprocess.run([sys.executable, "-c", SNIPPET.format(lazy=lazy)],
+                            capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), float(output[1]), int(output[2])
+
+
+def main(repeat: int = 5):
+    for lazy in (False, True):
+        results = [run(lazy) for _ in range(repeat)]
+        elapsed = min(result[0] for result in results)
+        memory = min(result[1] for result in results)
+        label = "lazy " if lazy else "eager"
+        print(f"{label} setup_plugins: {elapsed:7.1f} ms, {memory:7.0f} KiB, plugins loaded: {results[0][2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Микробенчмарк нормализации текста в UltraTextFilter
+
+Запуск: python -m benchmarks.bench_text_filter
+"""
+import re
+import timeit
+
+from utils.text_filter import UltraTextFilter
+
+# Типичные сообщения пользователей бота
+MESSAGES = [
+    "Привет! Как дела?",
+    "Напиши план обучения Python",
+    "Объясни теорию относительности простыми словами, пожалуйста",
+    "Помоги с кодом для сортировки списка в Python 3.12",
+    "Какая погода будет завтра в Москве? 🌤️",
+    "hello, can you explain how async/await works in Python?",
+]
+
+# Старая реализация: по одному str.replace на каждую leet-замену + re.sub
+LEGACY_LEET = {
+    'a': ['4', '@'], 'e': ['3'], 'i': ['1', '!'],
+    'o': ['0'], 's': ['5', '$'], 't': ['7'],
+    'b': ['8'], 'g': ['9'], 'l': ['1', '|'],
+    'z': ['2']
+}
+
+
+def legacy_normalize(text: str) -> str:
+    normalized = text.lower()
+    for normal_char, replacements in LEGACY_LEET.items():
+        for replacement in replacements:
+            normalized = normalized.replace(replacement, normal_char)
+    return re.sub(r'[^\w\s]', '', normalized)
+
+
+def main(number: int = 20000):
+    text_filter = UltraTextFilter()
+    uncached_filter = UltraTextFilter(cache_size=0)
+
+    legacy = min(timeit.repeat(lambda: [legacy_normalize(m) for m in MESSAGES], number=number, repeat=5))
+    current = min(timeit.repeat(lambda: [text_filter._normalize_text(m) for m in MESSAGES], number=number, repeat=5))
+
+    per_message = number * len(MESSAGES)
+    print(f"legacy _normalize_text:  {legacy / per_message * 1e6:.2f} µs/msg")
+    print(f"current _normalize_text: {current / per_message * 1e6:.2f} µs/msg")
+    print(f"speedup: {legacy / current:.1f}x")
+
+    full = min(timeit.repeat(lambda: [uncached_filter.filter_text(m) for m in MESSAGES], number=number // 10, repeat=5))
+    print(f"filter_text (no cache):  {full / (per_message // 10) * 1e6:.2f} µs/msg")
+
+    cached = min(timeit.repeat(lambda: [text_filter.filter_text(m) for m in MESSAGES], number=number, repeat=5))
+    print(f"filter_text (repeated):  {cached / per_message * 1e6:.2f} µs/msg")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,42 @@
 import logging
 import asyncio
 import os
+import signal
 import sys
+import time
+import unicodedata
+from functools import partial
 from io import BytesIO
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения ПЕРВЫМ ДЕЛОМ
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Настройка логирования: обработчики только ставят запись в очередь,
+# форматирование, удаление персональных данных и вывод - в отдельном потоке
+from utils.log_setup import setup_logging_from_env
+setup_logging_from_env()
 logger = logging.getLogger(__name__)
 
 print("🚀 Запуск AI Telegram Bot с УЛЬТРА-фильтрацией...")
 
 try:
-    from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-    from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+    from telegram import Update
+    from telegram.ext import Application, MessageHandler, TypeHandler, filters, ContextTypes
     import aiohttp
     from utils.text_filter import text_filter
     from utils.context_manager import ContextManager
     from utils.voice_processor import voice_processor
+    from utils.rate_limiter import rate_limiter
+    from utils.prefetch import prefetcher
+    from utils.router import router
+    from utils.pipeline import MessageJob, MessagePipeline
+    from utils.profiler import profiler, stall_monitor
+    from utils.metrics import metrics, BLOCKED, DEEPSEEK_SECONDS, EXTRACT_SECONDS, OCR_SECONDS, VOICE_SECONDS
+    from utils.response_cache import response_cache
+    from utils.document_analysis import AnalysisOrchestrator, ANALYSIS_TITLES
+    from utils.prompts import ANALYSIS_PROMPTS, chat_messages, history_window, prompt_cache_stats
+    from utils import ui
     
     # Пробуем импортировать плагины
     try:
@@ -43,19 +55,26 @@ except ImportError as e:
 # Инициализация компонентов
 context_manager = ContextManager()
 
+# Администраторы: диагностические команды /profile и /slow
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+class FallbackReply(str):
+    """Текст ошибки вместо ответа AI (не кешируется)"""
+
+
 class DeepSeekAI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.api_url = "https://api.deepseek.com/v1/chat/completions"
 
-    async def generate_response(self, messages: list) -> str:
-        """Генерация ответа через DeepSeek API с retry логикой"""
-        return await self._generate_response_with_retry(messages)
+    async def generate_response(self, messages: list, **options) -> str:
+        """Генерация ответа через DeepSeek API с retry логикой (options - доп. параметры запроса)"""
+        return await self._generate_response_with_retry(messages, **options)
 
-    async def _generate_response_with_retry(self, messages: list) -> str:
+    async def _generate_response_with_retry(self, messages: list, **options) -> str:
         """Версия с retry логикой"""
         if not self.api_key or self.api_key == "your_actual_deepseek_api_key_here":
-            return "❌ API ключ DeepSeek не настроен. Пожалуйста, установите DEEPSEEK_API_KEY в .env файле."
+            return FallbackReply("❌ API ключ DeepSeek не настроен. Пожалуйста, установите DEEPSEEK_API_KEY в .env файле.")
 
         headers = {
             "Content-Type": "application/json",
@@ -69,9 +88,11 @@ class DeepSeekAI:
             "max_tokens": 2000,
             "stream": False
         }
+        payload.update(options)
 
         # Retry логика
         for attempt in range(3):
+            started = time.monotonic()
             try:
                 async with aiohttp.ClientSession() as session:
                     async with session.post(
@@ -83,32 +104,44 @@ class DeepSeekAI:
 
                         if response.status == 200:
                             data = await response.json()
+                            DEEPSEEK_SECONDS.observe(time.monotonic() - started, "200")
+                            prompt_cache_stats.record(data.get("usage"), time.monotonic() - started)
                             return data["choices"][0]["message"]["content"]
                         else:
                             error_text = await response.text()
+                            DEEPSEEK_SECONDS.observe(time.monotonic() - started, str(response.status))
                             logger.error(f"DeepSeek API error (attempt {attempt + 1}): {error_text}")
                             
                             if attempt == 2:  # Последняя попытка
-                                return "Извините, произошла ошибка при обработке запроса."
+                                return FallbackReply("Извините, произошла ошибка при обработке запроса.")
                             await asyncio.sleep(2 ** attempt)  # Экспоненциальная backoff
 
             except asyncio.TimeoutError:
+                DEEPSEEK_SECONDS.observe(time.monotonic() - started, "timeout")
                 logger.error(f"DeepSeek API timeout (attempt {attempt + 1})")
                 if attempt == 2:
-                    return "Извините, время ожидания ответа истекло. Попробуйте еще раз."
+                    return FallbackReply("Извините, время ожидания ответа истекло. Попробуйте еще раз.")
                 await asyncio.sleep(2 ** attempt)
             except Exception as e:
+                DEEPSEEK_SECONDS.observe(time.monotonic() - started, "error")
                 logger.error(f"DeepSeek API exception (attempt {attempt + 1}): {e}")
                 if attempt == 2:
-                    return "Извините, произошла непредвиденная ошибка."
+                    return FallbackReply("Извините, произошла непредвиденная ошибка.")
                 await asyncio.sleep(2 ** attempt)
 
-        return "Извините, не удалось обработать запрос после нескольких попыток."
+        return FallbackReply("Извините, не удалось обработать запрос после нескольких попыток.")
 
 
 # Инициализация AI
 ai_agent = DeepSeekAI(os.getenv("DEEPSEEK_API_KEY"))
 
+# Анализ документов: несколько видов анализа одним запросом к AI
+analysis_orchestrator = AnalysisOrchestrator(
+    ai_agent.generate_response,
+    is_error=lambda response: isinstance(response, FallbackReply),
+    combined=os.getenv("ANALYSIS_COMBINED", "1") != "0"
+)
+
 class FileProcessor:
     """Класс для обработки файлов"""
 
@@ -170,27 +203,8 @@ class FileProcessor:
     @staticmethod
     async def analyze_text_with_ai(text: str, analysis_type: str = "summary") -> str:
         """Анализ текста с помощью AI"""
-        prompts = {
-            "summary": "Сделай краткий пересказ этого текста, выдели основные идеи и ключевые моменты. Будь лаконичным:",
-            "key_points": "Выдели ключевые пункты и основные мысли из этого текста в виде маркированного списка:",
-            "analysis": "Проанализируй этот текст и дай развернутый анализ основных тем и идей:",
-            "qa": "Составь 3-5 самых важных вопросов по содержанию этого текста и дай на них краткие ответы:"
-        }
-
-        prompt = prompts.get(analysis_type, prompts["summary"])
-
-        messages = [
-            {
-                "role": "system",
-                "content": "Ты эксперт по анализу текстов. Ты делаешь качественные анализы, пересказы и выделяешь ключевые моменты. Будь информативным, но лаконичным."
-            },
-            {
-                "role": "user",
-                "content": f"{prompt}\n\nТекст для анализа:\n{text[:15000]}"  # Ограничиваем длину
-            }
-        ]
-
-        return await ai_agent.generate_response(messages)
+        results = await analysis_orchestrator.analyze(text, [analysis_type])
+        return next(iter(results.values()))
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -199,98 +213,20 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_context = context_manager.get_user_context(user.id)
     user_context.user_name = user.first_name
 
-    # Создаем клавиатуру с кнопками (адаптивная в зависимости от доступности плагинов)
-    if PLUGINS_AVAILABLE:
-        keyboard = [
-            [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-            [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-            [KeyboardButton("📊 Анализ файлов"), KeyboardButton("🌤️ Погода"), KeyboardButton("💱 Курсы валют")]
-        ]
-    else:
-        keyboard = [
-            [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-            [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-            [KeyboardButton("📊 Анализ файлов")]
-        ]
-    
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    welcome_text = f"""
-Привет, {user.first_name}! 👋
-
-🤖 Я AI-ассистент с ПРОДВИНУТОЙ системой модерации:
-
-🛡️ АКТИВНАЯ ЗАЩИТА:
-• Детекция нецензурной лексики
-• Блокировка ссылок и контактов  
-• Анти-спам фильтр
-• Защита от мошенничества
-• Контент-фильтрация
-
-📝 Анализ документов:
-• 📄 PDF файлы
-• 📝 DOCX документы  
-• 📃 TXT текстовые файлы
-
-🎤 Новые возможности:
-• Голосовые сообщения
-{f"• Прогноз погоды\n• Курсы валют" if PLUGINS_AVAILABLE else ""}
-
-💬 Безопасное общение гарантировано!
-    """
-
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
-    logger.info(f"User {user.id} started conversation")
+    # Клавиатура и текст собраны заранее (адаптивно в зависимости от доступности плагинов)
+    await update.message.reply_text(ui.greeting(user.first_name, PLUGINS_AVAILABLE),
+                                    reply_markup=ui.main_menu(PLUGINS_AVAILABLE))
+    logger.info("User %s started conversation", user.id)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
-    plugins_text = ""
-    if PLUGINS_AVAILABLE:
-        plugins_text = """• 🌤️ Прогноз погоды (/weather)
-• 💱 Курсы валют (/currency)
-"""
-
-    help_text = f"""
-🤖 Помощь по боту
-
-🛡️ Система безопасности РАБОТАЕТ:
-• Автоматическая блокировка нарушений
-• Умное распознавание контента
-• Мгновенная реакция на спам
-• Защита данных пользователей
-
-Основные функции:
-• 📄 Анализ PDF/DOCX/TXT файлов
-• 🎤 Обработка голосовых сообщений
-{plugins_text}
-• 💬 Умный диалог с AI
-
-Нарушения блокируются автоматически!
-    """
-
-    await update.message.reply_text(help_text)
+    await update.message.reply_text(ui.help_text(PLUGINS_AVAILABLE))
 
 
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /about"""
-    about_text = """
-🤖 AI Telegram Bot с АКТИВНОЙ цензурой
-
-Технологии защиты:
-• Многоуровневый анализ текста
-• Распознавание скрытых нарушений
-• Контекстная оценка содержания
-• Поведенческий анализ
-
-Новые возможности:
-• Retry-логика для надежности API
-• Обработка голосовых сообщений
-
-Гарантируем безопасное общение!
-    """
-
-    await update.message.reply_text(about_text)
+    await update.message.reply_text(ui.ABOUT_TEXT)
 
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -300,144 +236,32 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_context.reset()
 
     await update.message.reply_text("✅ История разговора сброшена. Начнем новый диалог!")
-    logger.info(f"User {user.id} reset conversation")
+    logger.info("User %s reset conversation", user.id)
 
 
 async def show_examples(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать примеры запросов"""
-    plugins_examples = ""
-    if PLUGINS_AVAILABLE:
-        plugins_examples = """Команды:
-• /weather - прогноз погоды
-• /currency - Курсы валют
-• /help - помощь
-"""
-
-    examples_text = f"""
-💡 Примеры РАЗРЕШЕННЫХ запросов:
-
-Для файлов:
-Отправьте PDF/DOCX/TXT файл для анализа
-
-Голосовые сообщения:
-Отправьте голосовое сообщение - я распознаю текст!
-
-{plugins_examples}
-Вопросы к AI:
-• "Напиши план обучения Python"
-• "Объясни теорию относительности" 
-• "Помоги с кодом для сортировки"
-
-🚫 АВТОМАТИЧЕСКИ БЛОКИРУЕТСЯ:
-• Любая нецензурная лексика
-• Ссылки и контактные данные
-• Рекламный и спам-контент
-• Мошеннические схемы
-    """
-    await update.message.reply_text(examples_text, parse_mode='Markdown')
+    await update.message.reply_text(ui.examples_text(PLUGINS_AVAILABLE), parse_mode='Markdown')
 
 
 async def show_file_analysis_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать варианты анализа файлов"""
-    options_text = """
-📊 Анализ документов
-
-Отправьте файл в одном из форматов:
-• 📄 PDF документы
-• 📝 DOCX документы  
-• 📃 TXT текстовые файлы
-
-🛡️ ВСЕ файлы проверяются на нарушения!
-    """
-    await update.message.reply_text(options_text, parse_mode='Markdown')
-
-
-async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик файлов"""
-    user = update.effective_user
-    file = await update.message.document.get_file()
-
-    # Проверка размера файла
-    if file.file_size > 20 * 1024 * 1024:  # 20MB
-        await update.message.reply_text("❌ Файл слишком большой (макс. 20MB)")
-        return
+    await update.message.reply_text(ui.FILE_ANALYSIS_TEXT, parse_mode='Markdown')
 
-    file_name = update.message.document.file_name.lower()
-    file_extension = os.path.splitext(file_name)[1]
 
-    supported_formats = ['.pdf', '.docx', '.txt']
-    if file_extension not in supported_formats:
-        await update.message.reply_text("❌ Неподдерживаемый формат. Используйте PDF, DOCX или TXT")
-        return
-
-    await update.message.reply_text("📥 Загружаю файл...")
-
-    try:
-        # Скачиваем файл
-        file_content = await file.download_as_bytearray()
-
-        # Определяем тип файла и извлекаем текст
-        if file_extension == '.pdf':
-            extracted_text = await FileProcessor.extract_text_from_pdf(file_content)
-            file_type = "PDF"
-        elif file_extension == '.docx':
-            extracted_text = await FileProcessor.extract_text_from_docx(file_content)
-            file_type = "DOCX"
-        elif file_extension == '.txt':
-            extracted_text = await FileProcessor.extract_text_from_txt(file_content)
-            file_type = "TXT"
-
-        if not extracted_text:
-            await update.message.reply_text("❌ Не удалось извлечь текст из файла")
-            return
-
-        # УСИЛЕННАЯ ПРОВЕРКА ТЕКСТА ФАЙЛА
-        filtered_text, error = text_filter.filter_text(extracted_text)
-        if error:
-            error_parts = error.split(": ")
-            if len(error_parts) == 2:
-                error_type, error_detail = error_parts
-            else:
-                error_type, error_detail = "нарушение", error
-
-            await update.message.reply_text(
-                f"🚫 Файл заблокирован\n"
-                f"Причина: {error_detail}\n\n"
-                f"Отправьте другой файл."
-            )
-            logger.warning(f"File blocked for user {user.id}: {error}")
-            return
-
-        # Сохраняем текст в контексте для дальнейшего анализа
-        user_context = context_manager.get_user_context(user.id)
-        user_context.current_file_text = extracted_text
-        user_context.current_file_type = file_type
-
-        # Показываем варианты анализа
-        analysis_keyboard = [
-            [KeyboardButton("📋 Пересказ"), KeyboardButton("🔑 Ключевые пункты")],
-            [KeyboardButton("📊 Подробный анализ"), KeyboardButton("❓ Вопросы и ответы")],
-            [KeyboardButton("◀️ Назад")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(analysis_keyboard, resize_keyboard=True)
-
-        await update.message.reply_text(
-            f"✅ Файл загружен ({file_type})\n"
-            f"📏 Текст: {len(extracted_text)} символов\n"
-            f"🛡️ Проверка: ✅ Безопасно\n\n"
-            f"Выберите тип анализа:",
-            reply_markup=reply_markup
-        )
+async def handle_analysis_request(update: Update, context: ContextTypes.DEFAULT_TYPE, analysis_type: str):
+    """Обработка запроса анализа"""
+    await run_analysis(update, [analysis_type])
 
-        logger.info(f"File {file_name} processed for user {user.id}")
 
-    except Exception as e:
-        logger.error(f"File processing error: {e}")
-        await update.message.reply_text("❌ Ошибка обработки файла")
+async def handle_multi_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Несколько видов анализа за раз: /analyze summary qa или кнопка всех видов анализа"""
+    analysis_types = [arg for arg in (context.args or []) if arg in ANALYSIS_PROMPTS]
+    await run_analysis(update, analysis_types or list(ANALYSIS_PROMPTS))
 
 
-async def handle_analysis_request(update: Update, context: ContextTypes.DEFAULT_TYPE, analysis_type: str):
-    """Обработка запроса анализа"""
+async def run_analysis(update: Update, analysis_types: list):
+    """Анализ загруженного файла; документ отправляется в AI один раз на все виды анализа"""
     user = update.effective_user
     user_context = context_manager.get_user_context(user.id)
 
@@ -449,26 +273,19 @@ async def handle_analysis_request(update: Update, context: ContextTypes.DEFAULT_
     await update.message.chat.send_action(action="typing")
 
     try:
-        analysis_result = await FileProcessor.analyze_text_with_ai(
-            user_context.current_file_text,
-            analysis_type
-        )
-
-        # Добавляем заголовок в зависимости от типа анализа
-        analysis_titles = {
-            "summary": "📋 Краткий пересказ",
-            "key_points": "🔑 Ключевые пункты",
-            "analysis": "📊 Подробный анализ",
-            "qa": "❓ Вопросы и ответы"
-        }
+        results = await analysis_orchestrator.analyze(user_context.current_file_text, analysis_types)
 
-        title = analysis_titles.get(analysis_type, "📊 Результат анализа")
-
-        await update.message.reply_text(f"{title}:\n\n{analysis_result}")
-        logger.info(f"Analysis completed for user {user.id}, type: {analysis_type}")
+        # Каждый вид анализа - отдельным сообщением со своим заголовком
+        for analysis_type, analysis_result in results.items():
+            if isinstance(analysis_result, FallbackReply):
+                await update.message.reply_text(analysis_result)
+                return
+            title = ANALYSIS_TITLES.get(analysis_type, "📊 Результат анализа")
+            await update.message.reply_text(f"{title}:\n\n{analysis_result}")
+        logger.info("Analysis completed for user %s, types: %s", user.id, ",".join(results))
 
     except Exception as e:
-        logger.error(f"Analysis error: {e}")
+        logger.error("Analysis error: %s", e)
         await update.message.reply_text("❌ Ошибка анализа")
 
 
@@ -485,86 +302,221 @@ async def _is_confused_response(response: str) -> bool:
     return any(indicator in response_lower for indicator in confusion_indicators)
 
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """УЛЬТРА-обработчик текстовых сообщений с АКТИВНОЙ фильтрацией"""
-    user = update.effective_user
-    user_message = update.message.text
+async def generate_chat_response(messages: list) -> str:
+    """Ответ AI в диалоге; первый вопрос без истории может быть взят из кеша ответов"""
+    system_prompt, history = messages[0]["content"], messages[1:]
+    first_turn = len(history) == 1
+    if first_turn:
+        cached = response_cache.get(system_prompt, history[0]["content"])
+        if cached is not None:
+            logger.info("AI response taken from cache")
+            return cached
+
+    ai_response = await ai_agent.generate_response(messages)
+    if first_turn and not isinstance(ai_response, FallbackReply) and not await _is_confused_response(ai_response):
+        response_cache.set(system_prompt, history[0]["content"], ai_response)
+    return ai_response
+
+
+async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка возврата в главное меню"""
+    router.cancel_input(update.effective_user.id)
+    await update.message.reply_text("🔙 Возврат в главное меню", reply_markup=ui.main_menu(PLUGINS_AVAILABLE))
+
+
+def setup_routes():
+    """Команды и кнопки основного меню в центральном маршрутизаторе"""
+    router.add_command("start", start_command)
+    router.add_command("help", help_command)
+    router.add_command("about", about_command)
+    router.add_command("reset", reset_command)
+    router.add_command("analyze", handle_multi_analysis)
+    router.add_command("profile", profile_command)
+    router.add_command("slow", slow_command)
+
+    router.add_button("❓ Помощь", help_command)
+    router.add_button("ℹ️ О боте", about_command)
+    router.add_button("🔄 Сбросить диалог", reset_command)
+    router.add_button("💡 Примеры запросов", show_examples)
+    router.add_button("📊 Анализ файлов", show_file_analysis_options)
+    router.add_button("📋 Пересказ", partial(handle_analysis_request, analysis_type="summary"))
+    router.add_button("🔑 Ключевые пункты", partial(handle_analysis_request, analysis_type="key_points"))
+    router.add_button("📊 Подробный анализ", partial(handle_analysis_request, analysis_type="analysis"))
+    router.add_button("❓ Вопросы и ответы", partial(handle_analysis_request, analysis_type="qa"))
+    router.add_button("🧩 Все виды анализа", handle_multi_analysis)
+    router.add_button("◀️ Назад", back_to_main_menu)
+
+    # Все остальные сообщения - фильтрация и диалог с AI
+    router.set_fallback(handle_message)
+
+
+# КРАТКИЕ И ПОНЯТНЫЕ УВЕДОМЛЕНИЯ О БЛОКИРОВКЕ
+BLOCK_MESSAGES = {
+    "нецензурная лексика": "🚫 Обнаружена нецензурная лексика",
+    "ссылки/контакты": "🔗 Запрещены ссылки и контакты",
+    "рекламный спам": "📢 Заблокирован рекламный спам",
+    "мошенничество": "🎭 Обнаружены признаки мошенничества",
+    "взрослый контент": "🔞 Неподходящий контент",
+    "контент о насилии": "⚔️ Заблокирован контент о насилии",
+    "наркотики": "💊 Обнаружены упоминания наркотиков",
+    "разжигание ненависти": "💀 Заблокирован опасный контент",
+    "капслок": "🔊 Сообщение написано капсом",
+    "повторения": "🔄 Слишком много повторений",
+    "пунктуация": "❗ Избыточная пунктуация",
+    "личные данные": "📋 Обнаружены личные данные",
+    "флуд": "💬 Обнаружен флуд",
+    "спецсимволы": "🔣 Слишком много спецсимволов"
+}
+
+SUPPORTED_FILE_FORMATS = {'.pdf': "PDF", '.docx': "DOCX", '.txt': "TXT"}
+
+PHOTO_UNAVAILABLE_TEXT = (
+    "🖼️ Распознавание текста с изображений недоступно.\n\n"
+    "Отправьте текстовые файлы (PDF/DOCX/TXT) или напишите вопрос."
+)
 
-    logger.info(f"Received message from {user.id}: {user_message}")
+# SLO обработки сообщения по источнику (секунды); медленные обновления пишутся в лог slow_updates
+SLOW_UPDATE_SLO = {"text": 10.0, "voice": 20.0, "photo": 20.0, "document": 20.0}
+if os.getenv("SLOW_UPDATE_SECONDS"):
+    SLOW_UPDATE_SLO = dict.fromkeys(SLOW_UPDATE_SLO, float(os.getenv("SLOW_UPDATE_SECONDS")))
 
-    # ПЕРВОЕ: Проверяем, не является ли это вводом города для погоды
-    if PLUGINS_AVAILABLE:
-        try:
-            weather_plugin = plugin_manager.get_plugin("weather")
-            if weather_plugin and weather_plugin.is_initialized():
-                user_data = weather_plugin.get_user_data(user.id)
-                if user_data.get('awaiting_city_input'):
-                    # Проверяем, что введенный текст похож на название города
-                    if (len(user_message) < 50 and 
-                        all(c.isalpha() or c.isspace() or c in '-,.' for c in user_message) and
-                        len(user_message.strip()) > 1):
-                        
-                        logger.info(f"Processing city input in main handler: {user_message}")
-                        await weather_plugin._process_city_input(update, user_message.strip(), user.id)
-                        return
-                    else:
-                        # Если текст не похож на город, сбрасываем флаг и показываем сообщение
-                        user_data['awaiting_city_input'] = False
-                        weather_plugin.set_user_data(user.id, user_data)
-                        await update.message.reply_text(
-                            "❌ Это не похоже на название города. Попробуйте еще раз или выберите город из списка."
-                        )
-                        await weather_plugin._show_city_selection(update)
-                        return
-        except Exception as e:
-            logger.error(f"Error checking weather plugin city input: {e}")
-
-    # Обработка кнопок основного меню (только основные кнопки, не плагины)
-    button_handlers = {
-        "❓ Помощь": help_command,
-        "ℹ️ О боте": about_command,
-        "🔄 Сбросить диалог": reset_command,
-        "💡 Примеры запросов": show_examples,
-        "📊 Анализ файлов": show_file_analysis_options,
-        "📋 Пересказ": lambda u, c: handle_analysis_request(u, c, "summary"),
-        "🔑 Ключевые пункты": lambda u, c: handle_analysis_request(u, c, "key_points"),
-        "📊 Подробный анализ": lambda u, c: handle_analysis_request(u, c, "analysis"),
-        "❓ Вопросы и ответы": lambda u, c: handle_analysis_request(u, c, "qa")
-    }
-
-    # Обработка обычных кнопок меню
-    if user_message in button_handlers:
-        try:
-            await button_handlers[user_message](update, context)
-        except Exception as e:
-            logger.error(f"Error handling button {user_message}: {e}")
-            await update.message.reply_text(
-                "❌ Произошла ошибка при обработке команды. Попробуйте еще раз."
-            )
+# Ответ при непонятном запросе и при ошибке обработки - по источнику сообщения
+CONFUSED_REPLIES = {
+    "text": "🤔 Не совсем понял запрос.\n\nМожете переформулировать?",
+    "voice": "🤔 Не совсем понял ваш голосовой запрос.\n\nМожете переформулировать или написать текст?",
+    "photo": "🤔 Не совсем понял запрос.\n\nМожете переформулировать?"
+}
+ERROR_REPLIES = {
+    "text": "❌ Ошибка обработки запроса. Попробуйте еще раз.",
+    "voice": "❌ Ошибка обработки голосового сообщения.",
+    "photo": "❌ Ошибка обработки изображения.",
+    "document": "❌ Ошибка обработки файла"
+}
+
+
+async def _ingest_text(job: MessageJob):
+    job.text = job.message.text
+    logger.info("Received message from %s: %s", job.user.id, job.text, extra={"user_id": job.user.id})
+
+
+async def _ingest_voice(job: MessageJob):
+    await job.reply("🎤 Обрабатываю голосовое сообщение...")
+    voice_file = await job.message.voice.get_file()
+    voice_content = await voice_file.download_as_bytearray()
+
+    with metrics.time(VOICE_SECONDS):
+        result = await voice_processor.process_voice_message(voice_content)
+    if not result["success"]:
+        await job.reply("❌ Не удалось распознать речь. Попробуйте говорить четче или напишите текст.")
+        job.finish()
         return
 
-    # Кнопка возврата в главное меню
-    if user_message == "◀️ Назад":
-        if PLUGINS_AVAILABLE:
-            keyboard = [
-                [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-                [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-                [KeyboardButton("📊 Анализ файлов"), KeyboardButton("🌤️ Погода"), KeyboardButton("💱 Курсы валют")]
-            ]
+    job.text = result['text']
+    await job.reply(
+        f"🎤 Распознанный текст:\n{job.text}\n\n"
+        f"Теперь обрабатываю ваш запрос..."
+    )
+
+
+async def _ingest_photo(job: MessageJob):
+    try:
+        from utils.ocr_processor import ocr_processor
+        photo_file = await job.message.photo[-1].get_file()
+        photo_content = bytes(await photo_file.download_as_bytearray())
+        with metrics.time(OCR_SECONDS):
+            text = await ocr_processor.extract_text_from_image(photo_content)
+    except Exception as e:
+        logger.warning("OCR unavailable: %s", e)
+        text = ""
+
+    if not text:
+        await job.reply(PHOTO_UNAVAILABLE_TEXT)
+        job.finish()
+        return
+
+    # Подпись к фото - вопрос пользователя к распознанному тексту
+    job.text = f"{job.message.caption}\n\n{text}" if job.message.caption else text
+    await job.reply(f"🖼️ Распознанный текст:\n{text}\n\nТеперь обрабатываю ваш запрос...")
+
+
+async def _ingest_document(job: MessageJob):
+    document = job.message.document
+    file = await document.get_file()
+
+    # Проверка размера файла
+    if file.file_size > 20 * 1024 * 1024:  # 20MB
+        await job.reply("❌ Файл слишком большой (макс. 20MB)")
+        job.finish()
+        return
+
+    file_name = document.file_name.lower()
+    file_type = SUPPORTED_FILE_FORMATS.get(os.path.splitext(file_name)[1])
+    if file_type is None:
+        await job.reply("❌ Неподдерживаемый формат. Используйте PDF, DOCX или TXT")
+        job.finish()
+        return
+
+    await job.reply("📥 Загружаю файл...")
+
+    # Скачиваем файл и извлекаем текст
+    file_content = await file.download_as_bytearray()
+    with metrics.time(EXTRACT_SECONDS, file_type):
+        if file_type == "PDF":
+            job.text = await FileProcessor.extract_text_from_pdf(file_content)
+        elif file_type == "DOCX":
+            job.text = await FileProcessor.extract_text_from_docx(file_content)
         else:
-            keyboard = [
-                [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-                [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-                [KeyboardButton("📊 Анализ файлов")]
-            ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("🔙 Возврат в главное меню", reply_markup=reply_markup)
+            job.text = await FileProcessor.extract_text_from_txt(file_content)
+
+    if not job.text:
+        await job.reply("❌ Не удалось извлечь текст из файла")
+        job.finish()
         return
 
-    # УСИЛЕННАЯ ФИЛЬТРАЦИЯ СООБЩЕНИЯ
-    filtered_message, error = text_filter.filter_text(user_message)
+    job.extra["file_type"] = file_type
+    logger.info("File %s extracted for user %s", file_name, job.user.id, extra={"user_id": job.user.id})
+
+
+_INGESTERS = {
+    "text": _ingest_text,
+    "voice": _ingest_voice,
+    "photo": _ingest_photo,
+    "document": _ingest_document
+}
+
+
+async def stage_ingest(job: MessageJob):
+    """Получение текста сообщения: текст, распознанная речь, OCR или содержимое файла"""
+    await _INGESTERS[job.source](job)
+
+
+async def stage_normalize(job: MessageJob):
+    """Единая форма Unicode и обрезка пробелов"""
+    job.text = unicodedata.normalize("NFC", job.text).strip()
+    if not job.text:
+        job.finish()
+
+
+async def stage_rate_limit(job: MessageJob):
+    """Повторы распознанного текста (текстовые сообщения уже проверены до маршрутизации)"""
+    if job.source not in ("voice", "photo"):
+        return
+    try:
+        reason = await rate_limiter.check_duplicate(job.user.id, job.text)
+    except Exception as e:
+        logger.error("Rate limiter error: %s", e)
+        return
+    if reason:
+        await rate_limiter.notify(job.message, job.user.id, reason)
+        job.finish()
+
+
+async def stage_filter(job: MessageJob):
+    """УСИЛЕННАЯ ФИЛЬТРАЦИЯ текста из любого источника"""
+    filtered_text, error = text_filter.filter_text(job.text)
     if error:
-        logger.warning(f"Message BLOCKED for user {user.id}: {error}")
+        logger.warning("Message BLOCKED for user %s (%s): %s", job.user.id, job.source, error,
+                       extra={"user_id": job.user.id, "source": job.source})
 
         # Разбираем ошибку на тип и детали
         error_parts = error.split(": ")
@@ -572,151 +524,150 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             error_type, error_detail = error_parts
         else:
             error_type, error_detail = "нарушение", error
+        BLOCKED.inc(error_type)
 
-        # КРАТКИЕ И ПОНЯТНЫЕ УВЕДОМЛЕНИЯ О БЛОКИРОВКЕ
-        block_messages = {
-            "нецензурная лексика": "🚫 Обнаружена нецензурная лексика",
-            "ссылки/контакты": "🔗 Запрещены ссылки и контакты",
-            "рекламный спам": "📢 Заблокирован рекламный спам",
-            "мошенничество": "🎭 Обнаружены признаки мошенничества",
-            "взрослый контент": "🔞 Неподходящий контент",
-            "контент о насилии": "⚔️ Заблокирован контент о насилии",
-            "наркотики": "💊 Обнаружены упоминания наркотиков",
-            "разжигание ненависти": "💀 Заблокирован опасный контент",
-            "капслок": "🔊 Сообщение написано капсом",
-            "повторения": "🔄 Слишком много повторений",
-            "пунктуация": "❗ Избыточная пунктуация",
-            "личные данные": "📋 Обнаружены личные данные",
-            "флуд": "💬 Обнаружен флуд",
-            "спецсимволы": "🔣 Слишком много спецсимволов"
-        }
-
-        # Выбираем сообщение об ошибке
-        block_message = block_messages.get(error_type, "🚫 Сообщение нарушает правила")
+        if job.source == "document":
+            await job.reply(
+                f"🚫 Файл заблокирован\n"
+                f"Причина: {error_detail}\n\n"
+                f"Отправьте другой файл."
+            )
+        else:
+            block_message = BLOCK_MESSAGES.get(error_type, "🚫 Сообщение нарушает правила")
+            await job.reply(
+                f"{block_message}\n\n"
+                f"Переформулируйте запрос."
+            )
+        job.finish()
+        return
 
-        await update.message.reply_text(
-            f"{block_message}\n\n"
-            f"Переформулируйте запрос."
-        )
+    if job.source == "document":
+        # Файл анализируется целиком: отфильтрованный текст нужен только для проверки
         return
 
     # Проверка на неясные запросы
-    if text_filter.is_unclear_message(filtered_message):
-        await update.message.reply_text(
+    if text_filter.is_unclear_message(filtered_text):
+        await job.reply(
             "🤔 Не совсем понял ваш запрос.\n\n"
             "Сформулируйте конкретнее или нажмите '💡 Примеры запросов'"
         )
+        job.finish()
         return
+    job.text = filtered_text
 
-    # Обработка РАЗРЕШЕННОГО сообщения
-    user_context = context_manager.get_user_context(user.id)
-    user_context.add_message("user", filtered_message)
-
-    await update.message.chat.send_action(action="typing")
-
-    try:
-        conversation_history = user_context.get_conversation_history()
-
-        system_prompt = {
-            "role": "system",
-            "content": """Ты полезный AI-ассистент в Telegram боте. 
-            Отвечай дружелюбно и информативно. 
-            Если вопрос непонятен - вежливо попроси уточнить.
-            Будь краток, но содержателен. Используй эмодзи где уместно."""
-        }
-
-        messages = [system_prompt] + conversation_history
-
-        ai_response = await ai_agent.generate_response(messages)
-
-        if await _is_confused_response(ai_response):
-            await update.message.reply_text(
-                "🤔 Не совсем понял запрос.\n\n"
-                "Можете переформулировать?"
-            )
-            return
 
-        user_context.add_message("assistant", ai_response)
-        await update.message.reply_text(ai_response)
-        logger.info(f"Sent AI response to {user.id}")
+async def stage_context(job: MessageJob):
+    """Сохранение в контекст пользователя и сборка запроса к AI"""
+    job.user_context = context_manager.get_user_context(job.user.id)
 
-    # В handle_message добавьте:
-    except asyncio.TimeoutError:
-        await update.message.reply_text("⏰ AI сервис временно недоступен. Попробуйте позже.")
-    except Exception as e:
-        logger.error(f"AI processing failed: {e}")
-        await update.message.reply_text("❌ Ошибка обработки запроса. Попробуйте еще раз.")
+    if job.source == "document":
+        # Сохраняем текст в контексте для дальнейшего анализа
+        file_type = job.extra["file_type"]
+        job.user_context.current_file_text = job.text
+        job.user_context.current_file_type = file_type
+        job.response = (
+            f"✅ Файл загружен ({file_type})\n"
+            f"📏 Текст: {len(job.text)} символов\n"
+            f"🛡️ Проверка: ✅ Безопасно\n\n"
+            f"Выберите тип анализа:"
+        )
+        job.reply_markup = ui.FILE_ANALYSIS_MENU
+        return
 
-async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик голосовых сообщений"""
-    await update.message.reply_text("🎤 Обрабатываю голосовое сообщение...")
-    
-    try:
-        voice_file = await update.message.voice.get_file()
-        voice_content = await voice_file.download_as_bytearray()
-        
-        result = await voice_processor.process_voice_message(voice_content)
-        
-        if result["success"]:
-            await update.message.reply_text(
-                f"🎤 Распознанный текст:\n{result['text']}\n\n"
-                f"Теперь обрабатываю ваш запрос..."
-            )
-            
-            # Обрабатываем распознанный текст как обычное сообщение
-            user = update.effective_user
-            user_context = context_manager.get_user_context(user.id)
-            user_context.add_message("user", result['text'])
+    job.user_context.add_message("user", job.text)
+    job.messages = chat_messages(history_window(job.user_context.messages, job.user_context.message_count))
 
-            await update.message.chat.send_action(action="typing")
 
-            try:
-                conversation_history = user_context.get_conversation_history()
+async def stage_ai(job: MessageJob):
+    """Ответ AI (кеш ответов на первые вопросы, повторные попытки API)"""
+    if job.messages is None:
+        return
+    await job.message.chat.send_action(action="typing")
+    job.response = await generate_chat_response(job.messages)
 
-                system_prompt = {
-                    "role": "system",
-                    "content": """Ты полезный AI-ассистент в Telegram боте. 
-                    Отвечай дружелюбно и информативно. 
-                    Если вопрос непонятен - вежливо попроси уточнить.
-                    Будь краток, но содержателен. Используй эмодзи где уместно."""
-                }
 
-                messages = [system_prompt] + conversation_history
+async def stage_postprocess(job: MessageJob):
+    """Проверка ответа AI и запись его в историю диалога"""
+    if job.messages is None:
+        return
+    if await _is_confused_response(job.response):
+        job.response = CONFUSED_REPLIES[job.source]
+        return
+    job.user_context.add_message("assistant", job.response)
 
-                ai_response = await ai_agent.generate_response(messages)
 
-                if await _is_confused_response(ai_response):
-                    await update.message.reply_text(
-                        "🤔 Не совсем понял ваш голосовой запрос.\n\n"
-                        "Можете переформулировать или написать текст?"
-                    )
-                    return
+async def stage_send(job: MessageJob):
+    """Отправка ответа пользователю"""
+    if job.response is None:
+        return
+    await job.reply(job.response, reply_markup=job.reply_markup)
+    logger.info("Sent response to %s (%s)", job.user.id, job.source,
+                extra={"user_id": job.user.id, "source": job.source, "timings": dict(job.timings)})
 
-                user_context.add_message("assistant", ai_response)
-                await update.message.reply_text(ai_response)
-                logger.info(f"Sent AI response to {user.id} (from voice)")
 
-            except Exception as e:
-                logger.error(f"Error processing voice message text: {e}")
-                await update.message.reply_text("❌ Ошибка обработки распознанного текста.")
-            
-        else:
-            await update.message.reply_text(
-                "❌ Не удалось распознать речь. Попробуйте говорить четче или напишите текст."
-            )
-            
-    except Exception as e:
-        logger.error(f"Voice handling error: {e}")
-        logger.exception("Full voice error details:")
-        await update.message.reply_text("❌ Ошибка обработки голосового сообщения.")
+async def _pipeline_error(job: MessageJob, stage: str, error: Exception):
+    """Сообщение пользователю об ошибке на любом этапе"""
+    if isinstance(error, asyncio.TimeoutError):
+        await job.reply("⏰ AI сервис временно недоступен. Попробуйте позже.")
+    else:
+        await job.reply(ERROR_REPLIES[job.source])
+
+
+# Единый конвейер обработки входящих сообщений
+message_pipeline = MessagePipeline([
+    ("ingest", stage_ingest),
+    ("normalize", stage_normalize),
+    ("rate_limit", stage_rate_limit),
+    ("filter", stage_filter),
+    ("context", stage_context),
+    ("ai", stage_ai),
+    ("postprocess", stage_postprocess),
+    ("send", stage_send)
+], on_error=_pipeline_error, slo=SLOW_UPDATE_SLO)
+
+# УЛЬТРА-обработчики: текст с АКТИВНОЙ фильтрацией, голос, изображения и файлы
+handle_message = message_pipeline.handler("text")
+handle_voice = message_pipeline.handler("voice")
+handle_photo = message_pipeline.handler("photo")
+handle_file = message_pipeline.handler("document")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [секунды] - выборочное профилирование event loop (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    try:
+        duration = min(max(float(context.args[0]), 1.0), 120.0) if context.args else 10.0
+    except ValueError:
+        duration = 10.0
+
+    await update.message.reply_text(f"🔬 Профилирование {duration:g} с...")
+    path = await profiler.profile(duration)
+    if path is None:
+        await update.message.reply_text("⏳ Профилирование уже выполняется.")
+        return
+    with open(path, "rb") as f:
+        await update.message.reply_document(f, filename=os.path.basename(path),
+                                            caption="🔥 Свернутые стеки для flamegraph.pl / speedscope")
 
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик изображений"""
-    await update.message.reply_text(
-        "🖼️ Распознавание текста с изображений недоступно.\n\n"
-        "Отправьте текстовые файлы (PDF/DOCX/TXT) или напишите вопрос."
-    )
+async def slow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/slow - последние медленные обновления и блокировки event loop (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    stalls = stall_monitor.get_stats()
+    lines = [
+        f"🐢 Блокировки event loop: {stalls['stalls']} (макс. задержка {stalls['max_lag']:.2f} с, "
+        f"монитор {'включен' if stalls['running'] else 'выключен'})",
+        ""
+    ]
+    for record in list(message_pipeline.slow_updates)[-10:]:
+        stages = ", ".join(f"{name} {elapsed:.2f}" for name, elapsed in record["stages"].items())
+        lines.append(f"• {time.strftime('%H:%M:%S', time.localtime(record['time']))} {record['source']} "
+                     f"{record['total']:.2f} с: {stages}")
+    if len(lines) == 2:
+        lines.append("Медленных обновлений нет.")
+    await update.message.reply_text("\n".join(lines))
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -748,6 +699,73 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+def setup_metrics(application: Application):
+    """Метрики из статистики кешей, очередей и API: читаются только при запросе /metrics"""
+    def cache_requests():
+        ai = response_cache.get_stats()
+        yield ("ai_response", "hit"), ai["hits"]
+        yield ("ai_response", "semantic_hit"), ai["semantic_hits"]
+        yield ("ai_response", "miss"), ai["misses"]
+        for name, stats in text_filter.get_cache_stats().items():
+            yield (f"filter_{name}", "hit"), stats["hits"]
+            yield (f"filter_{name}", "miss"), stats["misses"]
+        prefetch = prefetcher.get_stats()
+        yield ("prefetch", "hit"), prefetch["hits"] + prefetch["coalesced"]
+        yield ("prefetch", "miss"), prefetch["misses"]
+
+    def deepseek_tokens():
+        stats = prompt_cache_stats.get_stats()
+        yield ("prompt",), stats["prompt_tokens"]
+        yield ("completion",), stats["completion_tokens"]
+        yield ("prompt_cache_hit",), stats["prompt_cache_hit_tokens"]
+        yield ("prompt_cache_miss",), stats["prompt_cache_miss_tokens"]
+
+    def queue_depths():
+        yield ("updates",), application.update_queue.qsize()
+
+    def rate_limited():
+        return (((reason,), count) for reason, count in rate_limiter.get_stats().items())
+
+    metrics.register_callback("bot_cache_requests_total", "Cache lookups by cache and result",
+                              cache_requests, ("cache", "result"), type="counter")
+    metrics.register_callback("bot_deepseek_tokens_total", "DeepSeek tokens by kind",
+                              deepseek_tokens, ("kind",), type="counter")
+    metrics.register_callback("bot_queue_depth", "Pending items in internal queues",
+                              queue_depths, ("queue",))
+    metrics.register_callback("bot_rate_limiter_decisions_total", "Rate limiter decisions by result",
+                              rate_limited, ("result",), type="counter")
+
+
+async def post_init(application: Application):
+    """Запуск плагинов после старта приложения (уже внутри event loop)"""
+    if PLUGINS_AVAILABLE:
+        await plugin_manager.startup_plugins(application)
+    if os.getenv("LOOP_STALL_THRESHOLD"):
+        stall_monitor.start()
+    # kill -USR1 <pid> - профилирование без команды в Telegram
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1,
+            lambda: application.create_task(profiler.profile(float(os.getenv("PROFILE_SECONDS", "10"))))
+        )
+    except (AttributeError, NotImplementedError):
+        pass
+    if metrics.enabled:
+        setup_metrics(application)
+        await metrics.start_server(os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT")))
+    # Фоновое обновление популярных данных погоды и курсов
+    prefetcher.start(application)
+
+
+async def post_shutdown(application: Application):
+    """Остановка плагинов: закрытие HTTP-сессий и фоновых задач"""
+    await prefetcher.stop()
+    await metrics.stop_server()
+    await stall_monitor.stop()
+    if PLUGINS_AVAILABLE:
+        await plugin_manager.shutdown_plugins(application)
+
+
 def main():
     """Основная функция запуска бота"""
     bot_token = os.getenv("BOT_TOKEN")
@@ -773,24 +791,24 @@ def main():
     print("🤖 Запуск бота...")
 
     try:
-        application = Application.builder().token(bot_token).build()
+        application = (
+            Application.builder()
+            .token(bot_token)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
+
+        # 0. Ограничение частоты сообщений: отдельная группа, срабатывает раньше всех обработчиков
+        application.add_handler(TypeHandler(Update, rate_limiter.handle_update), group=-1)
 
-         # 1. СНАЧАЛА загружаем плагины (чтобы их обработчики были первыми)
+         # 1. СНАЧАЛА загружаем плагины
         if PLUGINS_AVAILABLE:
             try:
-                # ЯВНО ИМПОРТИРУЕМ ПЛАГИНЫ
-                try:
-                    from plugins.weather_plugin import WeatherPlugin
-                    print("✅ WeatherPlugin imported")
-                except ImportError as e:
-                    print(f"❌ Failed to import WeatherPlugin: {e}")
-                    
-                try:
-                    from plugins.currency_plugin import CurrencyPlugin
-                    print("✅ CurrencyPlugin imported")
-                except ImportError as e:
-                    print(f"❌ Failed to import CurrencyPlugin: {e}")
-                
+                # Плагины описаны в манифесте и импортируются при первом обращении
+                discovered = plugin_manager.discover(os.getenv("PLUGINS_MANIFEST"))
+                print(f"✅ Найдены плагины: {', '.join(discovered)}")
+
                 plugin_manager.setup_plugins(application)
                 print("✅ Плагины успешно загружены")
                 
@@ -798,11 +816,8 @@ def main():
                 print(f"❌ Ошибка при загрузке плагинов: {e}")
                 PLUGINS_AVAILABLE = False
 
-        # 2. ПОТОМ основные обработчики команд
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("about", about_command))
-        application.add_handler(CommandHandler("reset", reset_command))
+        # 2. ПОТОМ основные команды и кнопки меню
+        setup_routes()
 
         # 3. Обработчики файлов и изображений
         application.add_handler(MessageHandler(filters.Document.ALL, handle_file))
@@ -811,16 +826,22 @@ def main():
         # 4. Обработчик голосовых сообщений
         application.add_handler(MessageHandler(filters.VOICE, handle_voice))
 
-        # 5. ОБЩИЙ обработчик текстовых сообщений ДОЛЖЕН БЫТЬ ПОСЛЕДНИМ
-        # Он будет обрабатывать только те сообщения, которые не были обработаны плагинами
+        # 5. ВСЕ текстовые сообщения и команды - один обработчик с таблицей маршрутов
+        # (кнопки и команды плагинов и основного меню, шаблоны, ввод города, диалог с AI)
         application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            handle_message
+            filters.UpdateType.MESSAGE & filters.TEXT,
+            router.dispatch
         ))
 
         # Обработчик ошибок
         application.add_error_handler(error_handler)
 
+        # Горячая перезагрузка правил фильтра при изменении файла
+        rules_reload_interval = float(os.getenv("FILTER_RULES_RELOAD_INTERVAL", "0"))
+        if rules_reload_interval > 0:
+            text_filter.watch_rules(rules_reload_interval)
+            print(f"🛡️  Правила фильтра: {text_filter.rules_version} (автоперезагрузка каждые {rules_reload_interval:g} с)")
+
         # Запуск бота
         logger.info("Bot with ULTRA filtering is starting...")
         print("✅ Бот успешно запущен!")
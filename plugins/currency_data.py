@@ -0,0 +1,120 @@
+import re
+import time
+from array import array
+from typing import Callable, Dict, Optional, Tuple
+
+# Свободные названия валют -> код ISO
+CURRENCY_ALIASES = {
+    'руб': 'RUB', 'рубль': 'RUB', 'рубля': 'RUB', 'рублей': 'RUB', 'р': 'RUB', '₽': 'RUB',
+    'доллар': 'USD', 'доллара': 'USD', 'долларов': 'USD', 'бакс': 'USD', 'баксов': 'USD', '$': 'USD',
+    'евро': 'EUR', '€': 'EUR',
+    'юань': 'CNY', 'юаня': 'CNY', 'юаней': 'CNY', '¥': 'CNY',
+    'фунт': 'GBP', 'фунта': 'GBP', 'фунтов': 'GBP', '£': 'GBP',
+    'иена': 'JPY', 'иен': 'JPY', 'йена': 'JPY', 'йен': 'JPY',
+    'франк': 'CHF', 'франка': 'CHF', 'франков': 'CHF',
+    'лира': 'TRY', 'лиры': 'TRY', 'лир': 'TRY',
+    'тенге': 'KZT',
+}
+
+# Коды валют, которые публикует ЦБ РФ (и рубль); другие трехбуквенные слова - не валюта
+CURRENCY_CODES = frozenset(
+    "RUB AUD AZN GBP AMD BYN BGN BRL HUF VND HKD GEL DKK AED USD EUR EGP INR IDR KZT CAD QAR KGS CNY "
+    "MDL NZD NOK PLN RON XDR SGD TJS THB TRY TMT UZS UAH CZK SEK CHF RSD ZAR KRW JPY".split()
+)
+
+_CURRENCY_TOKEN = '|'.join(
+    [rf'{code}(?![a-zA-Z])' for code in sorted(CURRENCY_CODES)] +
+    [re.escape(alias) for alias in sorted(CURRENCY_ALIASES, key=len, reverse=True)]
+)
+
+# "100 usd в eur", "1 000,5 рублей to USD", "50$ в €"
+CONVERSION_RE = re.compile(
+    rf'^\s*(\d[\d\s]*(?:[.,]\d+)?)\s*({_CURRENCY_TOKEN})\s*(?:в|во|to|in|->|=)?\s*({_CURRENCY_TOKEN})\s*$',
+    re.IGNORECASE
+)
+
+
+def currency_code(token: str) -> str:
+    """Код ISO по коду или названию валюты"""
+    return CURRENCY_ALIASES.get(token.lower(), token.upper())
+
+
+def parse_conversion(text: str) -> Optional[Tuple[float, str, str]]:
+    """Разобрать запрос конвертации: (сумма, из какой валюты, в какую)"""
+    match = CONVERSION_RE.match(text)
+    if not match:
+        return None
+    amount = float(re.sub(r'\s', '', match.group(1)).replace(',', '.'))
+    return amount, currency_code(match.group(2)), currency_code(match.group(3))
+
+
+class RateTable:
+    """Курсы ЦБ РФ, разобранные один раз: компактные массивы и готовые кросс-курсы
+
+    Таблица неизменяема; при обновлении курсов создается новая, вместе
+    с ней сбрасываются и закешированные тексты ответов.
+    """
+
+    def __init__(self, date: str, rates: Dict[str, Tuple[float, int, float, str]]):
+        # rates: код -> (курс за nominal единиц, nominal, предыдущий курс, название)
+        self.date = date
+        self.updated = time.time()
+        self.codes = ('RUB',) + tuple(sorted(rates))
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.names = ('Российский рубль',) + tuple(rates[code][3] for code in self.codes[1:])
+        self.nominal = array('i', [1] + [rates[code][1] for code in self.codes[1:]])
+        # Курсы за одну единицу валюты в рублях
+        self.values = array('d', [1.0] + [rates[code][0] / rates[code][1] for code in self.codes[1:]])
+        self.previous = array('d', [1.0] + [rates[code][2] / rates[code][1] for code in self.codes[1:]])
+
+        # Кросс-курсы: cross[i * n + j] - сколько единиц j за одну единицу i
+        n = len(self.codes)
+        self.cross = array('d', [self.values[i] / self.values[j] for i in range(n) for j in range(n)])
+        self._views: Dict[str, str] = {}
+
+    def touch(self):
+        """Отметить, что ЦБ подтвердил курсы (ответ 304): сдвигается только время обновления"""
+        self.updated = time.time()
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def rate(self, code: str) -> float:
+        """Курс за одну единицу валюты в рублях"""
+        return self.values[self.index[code]]
+
+    def nominal_value(self, code: str) -> Tuple[int, float]:
+        """Курс в котировке ЦБ: (номинал, рублей за номинал)"""
+        i = self.index[code]
+        return self.nominal[i], self.values[i] * self.nominal[i]
+
+    def change(self, code: str) -> Tuple[float, float]:
+        """Изменение курса за номинал: (в рублях, в процентах)"""
+        i = self.index[code]
+        diff = (self.values[i] - self.previous[i]) * self.nominal[i]
+        percent = (self.values[i] - self.previous[i]) / self.previous[i] * 100 if self.previous[i] else 0.0
+        return diff, percent
+
+    def cross_rate(self, from_code: str, to_code: str) -> float:
+        """Сколько единиц to_code за одну единицу from_code"""
+        return self.cross[self.index[from_code] * len(self.codes) + self.index[to_code]]
+
+    def convert(self, amount: float, from_code: str, to_code: str) -> float:
+        """Конвертация суммы по кросс-курсу ЦБ"""
+        return amount * self.cross_rate(from_code, to_code)
+
+    def view(self, name: str, render: Callable[["RateTable"], str]) -> str:
+        """Текст ответа, сформированный один раз для этой версии курсов"""
+        text = self._views.get(name)
+        if text is None:
+            text = self._views[name] = render(self)
+        return text
+
+
+def build_rate_table(data: dict) -> RateTable:
+    """Разобрать ответ cbr-xml-daily.ru (daily_json.js)"""
+    rates = {
+        code: (info['Value'], int(info.get('Nominal', 1)), info.get('Previous', info['Value']), info.get('Name', code))
+        for code, info in data['Valute'].items()
+    }
+    return RateTable(data['Date'][:10], rates)
@@ -0,0 +1,178 @@
+import os
+import asyncio
+import sqlite3
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional
+import logging
+
+import aiohttp
+
+from plugins.currency_data import RateTable, build_rate_table
+
+logger = logging.getLogger(__name__)
+
+CBR_ARCHIVE_URL = "https://www.cbr-xml-daily.ru/archive/{date:%Y/%m/%d}/daily_json.js"
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "currency_history.db")
+
+# Периоды исторических сводок
+PERIODS = {'week': 7, 'month': 30, 'year': 365}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    day TEXT NOT NULL,
+    code TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (code, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested_days (
+    day TEXT PRIMARY KEY,
+    has_rates INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class RateHistory:
+    """Локальный временной ряд курсов ЦБ в SQLite
+
+    Каждая загруженная дата записывается один раз; даты без курсов
+    (выходные и праздники, архив отвечает 404) тоже отмечаются, чтобы не
+    запрашивать их повторно. Последние settle_days дней не отмечаются:
+    архив за них может быть еще не опубликован. Сводки считаются векторно
+    на NumPy. Методы синхронные: из event loop их вызывают через
+    asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH, archive_url: str = CBR_ARCHIVE_URL):
+        self.path = path
+        self.archive_url = archive_url
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.version = self._latest_day() or ""
+
+    def _latest_day(self) -> Optional[str]:
+        row = self._db.execute("SELECT max(day) FROM ingested_days WHERE has_rates = 1").fetchone()
+        return row[0]
+
+    def record(self, table: RateTable):
+        """Сохранить курсы одного дня (повторная запись того же дня ничего не меняет)"""
+        rows = [(table.date, code, value) for code, value in zip(table.codes, table.values) if code != 'RUB']
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO rates (day, code, value) VALUES (?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO ingested_days (day, has_rates) VALUES (?, 1)", (table.date,))
+            self.version = self._latest_day() or ""
+
+    def _mark_missing(self, day: date):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO ingested_days (day, has_rates) VALUES (?, 0)", (day.isoformat(),))
+
+    def known_days(self) -> set:
+        """Даты, которые уже загружены или отмечены как дни без курсов"""
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT day FROM ingested_days")}
+
+    async def backfill(self, days: int = 365, concurrency: int = 4, today: Optional[date] = None,
+                       settle_days: int = 2) -> int:
+        """Догрузить из архива ЦБ недостающие даты за последние days дней; возвращает число загруженных"""
+        today = today or date.today()
+        settled = today - timedelta(days=settle_days)
+        known = await asyncio.to_thread(self.known_days)
+        missing = [
+            day for day in (today - timedelta(days=offset) for offset in range(days))
+            if day.isoformat() not in known
+        ]
+        if not missing:
+            return 0
+
+        logger.info(f"Currency history backfill: {len(missing)} days")
+        semaphore = asyncio.Semaphore(concurrency)
+        loaded = 0
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+            async def load(day: date):
+                nonlocal loaded
+                async with semaphore:
+                    async with session.get(self.archive_url.format(date=day)) as response:
+                        if response.status == 404:
+                            # Выходной или праздник: курсов на эту дату нет
+                            if day <= settled:
+                                await asyncio.to_thread(self._mark_missing, day)
+                            return
+                        if response.status != 200:
+                            raise Exception(f"CBR archive error: {response.status}")
+                        data = await response.json(content_type=None)
+                table = build_rate_table(data)
+                # Архив на нерабочий день отдает курсы ближайшего рабочего дня
+                if table.date != day.isoformat() and day <= settled:
+                    await asyncio.to_thread(self._mark_missing, day)
+                await asyncio.to_thread(self.record, table)
+                loaded += 1
+
+            results = await asyncio.gather(*(load(day) for day in missing), return_exceptions=True)
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logger.warning(f"Currency history backfill: {len(errors)} days failed ({errors[0]})")
+        logger.info(f"✅ Currency history backfill: {loaded} days loaded")
+        return loaded
+
+    def series(self, code: str, start: str, end: str):
+        """Ряд курса валюты за период: (даты datetime64[D], курсы за единицу)"""
+        try:
+            import numpy as np
+        except ImportError:
+            raise Exception("NumPy не установлен. Установите: pip install numpy")
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT day, value FROM rates WHERE code = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (code, start, end)
+            ).fetchall()
+        if not rows:
+            return np.array([], dtype='datetime64[D]'), np.array([], dtype=float)
+        days, values = zip(*rows)
+        return np.array(days, dtype='datetime64[D]'), np.array(values, dtype=float)
+
+    def summary(self, code: str, days: int, end: Optional[str] = None, average_days: int = 7) -> Optional[Dict]:
+        """Сводка за период: изменение, минимум/максимум и среднее за последние average_days календарных дней"""
+        end = end or self.version or date.today().isoformat()
+        start = (date.fromisoformat(end) - timedelta(days=days)).isoformat()
+        dates, values = self.series(code, start, end)
+        if len(values) < 2:
+            return None
+
+        import numpy as np
+
+        low, high = int(np.argmin(values)), int(np.argmax(values))
+        recent = values[dates > dates[-1] - np.timedelta64(average_days, 'D')]
+        return {
+            'code': code,
+            'start': str(dates[0]),
+            'end': str(dates[-1]),
+            'first': float(values[0]),
+            'last': float(values[-1]),
+            'change': float(values[-1] - values[0]),
+            'change_percent': float((values[-1] - values[0]) / values[0] * 100),
+            'min': float(values[low]),
+            'min_date': str(dates[low]),
+            'max': float(values[high]),
+            'max_date': str(dates[high]),
+            'average': float(recent.mean()),
+            'points': int(len(values))
+        }
+
+    def summaries(self, codes: Iterable[str], periods: Dict[str, int] = PERIODS) -> Dict[str, Dict[str, Optional[Dict]]]:
+        """Сводки по нескольким валютам и периодам"""
+        return {code: {name: self.summary(code, days) for name, days in periods.items()} for code in codes}
+
+
+def create_rate_history() -> Optional[RateHistory]:
+    """Открыть хранилище истории курсов по настройкам окружения"""
+    try:
+        return RateHistory(os.getenv("CURRENCY_HISTORY_DB", DEFAULT_HISTORY_PATH))
+    except Exception as e:
+        logger.error(f"❌ Currency history store unavailable: {e}")
+        return None
@@ -1,15 +1,31 @@
 import aiohttp
+import asyncio
 import os
 import json
 from datetime import datetime, timedelta
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, MessageHandler, filters, CommandHandler
+from telegram import Update
+from telegram.ext import ContextTypes
 from plugins.plugin_base import BasePlugin
 from plugins.init import plugin_manager
+from plugins.currency_data import CONVERSION_RE, RateTable, build_rate_table, parse_conversion
+from plugins.currency_history import PERIODS, create_rate_history
+from utils.conditional_fetch import ConditionalFetcher
+from utils.prefetch import prefetcher
+from utils.router import router
+from utils.ui import keyboard
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Кнопки меню валют
+CURRENCY_BUTTONS = ["💱 Курсы валют", "💵 Основные валюты", "🔄 Конвертер", "📊 Все курсы", "📈 Изменения", "🗓 История"]
+
+CURRENCY_MENU = keyboard(
+    ["💵 Основные валюты", "📊 Все курсы"],
+    ["🔄 Конвертер", "📈 Изменения"],
+    ["🗓 История", "◀️ Назад"]
+)
+
 
 @plugin_manager.register_plugin(
     name="currency",
@@ -20,8 +36,16 @@ class CurrencyPlugin(BasePlugin):
     def __init__(self):
         super().__init__("currency", "Курсы валют", "1.2")
         self.cbr_url = "https://www.cbr-xml-daily.ru/daily_json.js"
-        self.cache = {}
         self.cache_timeout = 300  # 5 минут
+        # Курсы читаются из теплого хранилища, которое обновляется в фоне
+        prefetcher.register("cbr", self._fetch_cbr_rates, self.cache_timeout)
+        # Курсы ЦБ меняются раз в день: остальные запросы получают 304 без тела
+        self._http = ConditionalFetcher(maxsize=4)
+        # История курсов хранится локально и пополняется при каждой загрузке
+        self.history = create_rate_history()
+        self.history_days = int(os.getenv("CURRENCY_HISTORY_DAYS", "365"))
+        self._history_views = {}  # версия истории -> текст
+        self._backfill_task = None
 
     def initialize(self):
         """Инициализация плагина валют"""
@@ -31,23 +55,31 @@ class CurrencyPlugin(BasePlugin):
         except Exception as e:
             logger.error(f"❌ Failed to initialize currency plugin: {e}")
             raise
+
+    async def startup(self, application):
+        """Догрузка архива курсов в фоне"""
+        if self.history and self.history_days > 0:
+            self._backfill_task = asyncio.create_task(self._backfill_history())
+
+    async def shutdown(self, application):
+        if self._backfill_task:
+            self._backfill_task.cancel()
+            self._backfill_task = None
+
+    async def _backfill_history(self):
+        try:
+            await self.history.backfill(self.history_days)
+        except Exception as e:
+            logger.error(f"Currency history backfill error: {e}")
     
     def setup_handlers(self, application):
         """Настройка обработчиков для плагина валют"""
-        # Обработчик команды /currency
-        application.add_handler(CommandHandler("currency", self.currency_command))
-        
-        # Обработчик кнопок валют
-        application.add_handler(MessageHandler(
-            filters.Regex(r'^(💱 Курсы валют|💵 Основные валюты|🔄 Конвертер|📊 Все курсы|📈 Изменения)$'),
-            self.handle_currency_messages
-        ))
-        
-        # Обработчик кнопки "Назад" в контексте валют
-        application.add_handler(MessageHandler(
-            filters.Regex(r'^◀️ Назад$'),
-            self.handle_back_button
-        ))
+        # Команда /currency и кнопки валют
+        router.add_command("currency", self.currency_command)
+        router.add_buttons(CURRENCY_BUTTONS, self.handle_currency_messages)
+
+        # Конвертер: запросы вида "100 usd в eur"
+        router.add_pattern(CONVERSION_RE, self.handle_conversion)
         
         logger.info("✅ Currency plugin handlers setup completed")
 
@@ -73,8 +105,9 @@ class CurrencyPlugin(BasePlugin):
             await update.message.reply_text(
                 "💱 Конвертер валют\n\n"
                 "Введите запрос в формате:\n"
-                "`100 USD to RUB`\n"
-                "`1000 RUB to EUR`\n\n"
+                "`100 USD в RUB`\n"
+                "`1000 рублей в евро`\n"
+                "`50 usd to cny`\n\n"
                 "Или выберите из меню выше ⬆️",
                 parse_mode='Markdown'
             )
@@ -88,29 +121,44 @@ class CurrencyPlugin(BasePlugin):
             await self._show_changes(update)
             return
 
-    async def handle_back_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик кнопки Назад для плагина валют"""
-        logger.info("Currency plugin handling back button")
-        await self._show_main_menu_back(update)
+        if user_message == "🗓 История":
+            await self._show_history(update)
+            return
+
+    async def handle_conversion(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Конвертация валют по курсу ЦБ"""
+        query = parse_conversion(update.message.text)
+        if not query:
+            return
+        amount, from_code, to_code = query
+        logger.info(f"Currency conversion: {amount} {from_code} -> {to_code}")
+
+        table = await self._get_cbr_rates()
+        unknown = [code for code in (from_code, to_code) if code not in table]
+        if unknown:
+            await update.message.reply_text(f"❌ Неизвестная валюта: {', '.join(unknown)}")
+            return
+
+        result = table.convert(amount, from_code, to_code)
+        await update.message.reply_text(
+            f"💱 *{amount:,.2f} {from_code} = {result:,.2f} {to_code}*\n\n"
+            f"📊 Курс: 1 {from_code} = {table.cross_rate(from_code, to_code):,.4f} {to_code}\n"
+            f"📅 *Курс ЦБ РФ на:* {table.date}",
+            parse_mode='Markdown'
+        )
 
     async def _show_main_menu(self, update: Update):
         """Показать главное меню валют"""
         logger.info("Showing currency main menu")
-        keyboard = [
-            [KeyboardButton("💵 Основные валюты"), KeyboardButton("📊 Все курсы")],
-            [KeyboardButton("🔄 Конвертер"), KeyboardButton("📈 Изменения")],
-            [KeyboardButton("◀️ Назад")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
         await update.message.reply_text(
             "💱 *Курсы валют*\n\n"
             "• 💵 *Основные валюты* - USD, EUR, CNY, GBP\n"
             "• 🔄 *Конвертер* - перевод между валютами\n"
             "• 📊 *Все курсы* - полный список\n"
-            "• 📈 *Изменения* - динамика за сутки\n\n"
+            "• 📈 *Изменения* - динамика за сутки\n"
+            "• 🗓 *История* - неделя, месяц, год\n\n"
             "Выберите опцию:",
-            reply_markup=reply_markup,
+            reply_markup=CURRENCY_MENU,
             parse_mode='Markdown'
         )
 
@@ -120,32 +168,9 @@ class CurrencyPlugin(BasePlugin):
         await update.message.reply_text("💵 Получаю курсы валют...")
 
         try:
-            rates_data = await self._get_cbr_rates()
-            logger.info(f"Rates data received: {bool(rates_data)}")
-            
-            if not rates_data:
-                await update.message.reply_text("❌ Не удалось получить данные о валютах")
-                return
-
-            usd_rate = rates_data.get('USD', {})
-            eur_rate = rates_data.get('EUR', {})
-            cny_rate = rates_data.get('CNY', {})
-            gbp_rate = rates_data.get('GBP', {})
-
-            response = (
-                "💵 *Курсы ЦБ РФ на сегодня*\n\n"
-                f"🇺🇸 *USD:* {usd_rate.get('value', 'N/A'):.2f} ₽ "
-                f"({usd_rate.get('change', 0):+.2f})\n"
-                f"🇪🇺 *EUR:* {eur_rate.get('value', 'N/A'):.2f} ₽ "
-                f"({eur_rate.get('change', 0):+.2f})\n"
-                f"🇨🇳 *CNY:* {cny_rate.get('value', 'N/A'):.2f} ₽ "
-                f"({cny_rate.get('change', 0):+.2f})\n"
-                f"🇬🇧 *GBP:* {gbp_rate.get('value', 'N/A'):.2f} ₽ "
-                f"({gbp_rate.get('change', 0):+.2f})\n\n"
-                f"🕐 *Обновлено:* {datetime.now().strftime('%H:%M')}\n"
-                f"📅 *Дата:* {rates_data.get('date', 'N/A')}"
-            )
-
+            rates = await self._get_cbr_rates()
+            # Текст формируется один раз на версию курсов
+            response = rates.view("fiat", self._format_fiat_rates)
             await update.message.reply_text(response, parse_mode='Markdown')
             logger.info("Fiat rates displayed successfully")
 
@@ -161,24 +186,8 @@ class CurrencyPlugin(BasePlugin):
         await update.message.reply_text("📊 Получаю все курсы...")
 
         try:
-            rates_data = await self._get_cbr_rates()
-            if not rates_data:
-                await update.message.reply_text("❌ Не удалось получить данные")
-                return
-
-            # Основные валюты
-            main_currencies = ['USD', 'EUR', 'CNY', 'GBP', 'JPY', 'CHF', 'TRY', 'KZT']
-            
-            response = "📊 *Все курсы ЦБ РФ*\n\n"
-            
-            for currency in main_currencies:
-                if currency in rates_data:
-                    rate_data = rates_data[currency]
-                    response += f"• {self._get_currency_flag(currency)} *{currency}:* {rate_data.get('value', 'N/A'):.2f} ₽\n"
-
-            response += f"\n🕐 *Обновлено:* {datetime.now().strftime('%H:%M')}"
-            response += f"\n📅 *Дата:* {rates_data.get('date', 'N/A')}"
-
+            rates = await self._get_cbr_rates()
+            response = rates.view("all", self._format_all_rates)
             await update.message.reply_text(response, parse_mode='Markdown')
             logger.info("All rates displayed successfully")
 
@@ -194,30 +203,8 @@ class CurrencyPlugin(BasePlugin):
         await update.message.reply_text("📈 Анализирую изменения...")
 
         try:
-            rates_data = await self._get_cbr_rates()
-            if not rates_data:
-                await update.message.reply_text("❌ Не удалось получить данные")
-                return
-
-            response = "📈 *Изменения курсов за сутки*\n\n"
-            
-            for currency in ['USD', 'EUR', 'CNY']:
-                if currency in rates_data:
-                    rate_data = rates_data[currency]
-                    change = rate_data.get('change', 0)
-                    change_percent = rate_data.get('change_percent', 0)
-                    
-                    if change > 0:
-                        trend = "📈"
-                    elif change < 0:
-                        trend = "📉"
-                    else:
-                        trend = "➡️"
-                    
-                    response += f"{trend} {self._get_currency_flag(currency)} *{currency}:* {change:+.2f} ₽ ({change_percent:+.1f}%)\n"
-
-            response += f"\n🕐 *Обновлено:* {datetime.now().strftime('%H:%M')}"
-
+            rates = await self._get_cbr_rates()
+            response = rates.view("changes", self._format_changes)
             await update.message.reply_text(response, parse_mode='Markdown')
             logger.info("Currency changes displayed successfully")
 
@@ -227,58 +214,156 @@ class CurrencyPlugin(BasePlugin):
                 "❌ Ошибка анализа изменений. Попробуйте позже."
             )
 
-    async def _get_cbr_rates(self):
-        """Получить курсы валют от ЦБ РФ"""
-        cache_key = "cbr_rates"
-        if cache_key in self.cache:
-            cache_time, data = self.cache[cache_key]
-            if datetime.now().timestamp() - cache_time < self.cache_timeout:
-                logger.info("Using cached currency rates")
-                return data
+    async def _show_history(self, update: Update):
+        """Показать динамику курсов за неделю, месяц и год"""
+        logger.info("Showing currency history")
+        if not self.history:
+            await update.message.reply_text("❌ История курсов недоступна.")
+            return
+
+        try:
+            # Сводка считается один раз на каждую новую дату в истории
+            version = self.history.version
+            response = self._history_views.get(version)
+            if response is None:
+                summaries = await asyncio.to_thread(self.history.summaries, ['USD', 'EUR', 'CNY'])
+                response = self._format_history(summaries)
+                self._history_views = {version: response}
+            await update.message.reply_text(response, parse_mode='Markdown')
+            logger.info("Currency history displayed successfully")
 
+        except Exception as e:
+            logger.error(f"History error: {e}")
+            await update.message.reply_text(
+                "❌ Ошибка получения истории курсов. Попробуйте позже."
+            )
+
+    def _format_history(self, summaries: dict) -> str:
+        """Форматирование исторической сводки"""
+        labels = {'week': 'Неделя', 'month': 'Месяц', 'year': 'Год'}
+        response = "🗓 *История курсов ЦБ РФ*\n"
+        end = None
+
+        for currency, periods in summaries.items():
+            lines = []
+            for name in PERIODS:
+                summary = periods.get(name)
+                if not summary:
+                    continue
+                end = end or summary['end']
+                trend = "📈" if summary['change'] > 0 else "📉" if summary['change'] < 0 else "➡️"
+                lines.append(
+                    f"{trend} {labels[name]}: {summary['change']:+.2f} ₽ ({summary['change_percent']:+.1f}%), "
+                    f"мин {summary['min']:.2f}, макс {summary['max']:.2f}"
+                )
+            if not lines:
+                continue
+            average = periods['week']['average'] if periods.get('week') else None
+            response += f"\n{self._get_currency_flag(currency)} *{currency}*"
+            response += f" (среднее за 7 дней: {average:.2f} ₽)\n" if average else "\n"
+            response += "\n".join(lines) + "\n"
+
+        if end is None:
+            return "🗓 История курсов еще загружается. Попробуйте позже."
+        return response + f"\n📅 *Данные по:* {end}"
+
+    def _format_rate_line(self, rates: RateTable, currency: str) -> str:
+        """Строка курса в котировке ЦБ (для валют с номиналом больше 1 он указывается)"""
+        nominal, value = rates.nominal_value(currency)
+        label = f"{currency} ({nominal})" if nominal > 1 else currency
+        return f"{self._get_currency_flag(currency)} *{label}:* {value:.2f} ₽"
+
+    def _format_updated(self, rates: RateTable) -> str:
+        return (
+            f"🕐 *Обновлено:* {datetime.fromtimestamp(rates.updated).strftime('%H:%M')}\n"
+            f"📅 *Дата:* {rates.date}"
+        )
+
+    def _format_fiat_rates(self, rates: RateTable) -> str:
+        """Форматирование курсов основных валют"""
+        response = "💵 *Курсы ЦБ РФ на сегодня*\n\n"
+        for currency in ['USD', 'EUR', 'CNY', 'GBP']:
+            if currency in rates:
+                change, _ = rates.change(currency)
+                response += f"{self._format_rate_line(rates, currency)} ({change:+.2f})\n"
+        return response + "\n" + self._format_updated(rates)
+
+    def _format_all_rates(self, rates: RateTable) -> str:
+        """Форматирование всех курсов"""
+        # Основные валюты
+        main_currencies = ['USD', 'EUR', 'CNY', 'GBP', 'JPY', 'CHF', 'TRY', 'KZT']
+
+        response = "📊 *Все курсы ЦБ РФ*\n\n"
+        for currency in main_currencies:
+            if currency in rates:
+                response += f"• {self._format_rate_line(rates, currency)}\n"
+        return response + "\n" + self._format_updated(rates)
+
+    def _format_changes(self, rates: RateTable) -> str:
+        """Форматирование изменений курсов"""
+        response = "📈 *Изменения курсов за сутки*\n\n"
+
+        for currency in ['USD', 'EUR', 'CNY']:
+            if currency in rates:
+                change, change_percent = rates.change(currency)
+
+                if change > 0:
+                    trend = "📈"
+                elif change < 0:
+                    trend = "📉"
+                else:
+                    trend = "➡️"
+
+                response += f"{trend} {self._get_currency_flag(currency)} *{currency}:* {change:+.2f} ₽ ({change_percent:+.1f}%)\n"
+
+        return response + "\n" + self._format_updated(rates)
+
+    async def _get_cbr_rates(self) -> RateTable:
+        """Получить курсы валют от ЦБ РФ"""
         try:
-            logger.info("Fetching fresh currency rates from CBR")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.cbr_url, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        logger.info("Successfully fetched currency rates from CBR")
-                        
-                        rates = {}
-                        for currency, rate_info in data['Valute'].items():
-                            rates[currency] = {
-                                'value': rate_info['Value'],
-                                'previous': rate_info['Previous'],
-                                'change': rate_info['Value'] - rate_info['Previous'],
-                                'change_percent': ((rate_info['Value'] - rate_info['Previous']) / rate_info['Previous']) * 100
-                            }
-                        
-                        rates['date'] = data['Date'][:10]
-                        
-                        # Кешируем данные
-                        self.cache[cache_key] = (datetime.now().timestamp(), rates)
-                        return rates
-                    else:
-                        logger.error(f"CBR API error: {response.status}")
-                        return self._get_mock_rates()
+            return await prefetcher.get("cbr", "daily")
         except Exception as e:
             logger.error(f"CBR API request failed: {e}")
             return self._get_mock_rates()
 
-    def _get_mock_rates(self):
+    async def _fetch_cbr_rates(self, key: str = "daily") -> RateTable:
+        """Загрузить курсы валют от ЦБ РФ; при ошибке выбрасывает исключение
+
+        Если курсы не изменились (304), возвращается та же таблица с новым
+        временем обновления, и теплое хранилище только продлевает ей срок жизни.
+        """
+        logger.info("Fetching fresh currency rates from CBR")
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            table = await self._http.get(session, self.cbr_url, self._parse_cbr_rates, error="CBR API error",
+                                         touch=RateTable.touch)
+
+        # Новая дата записывается в историю вне event loop
+        if self.history and table.date > self.history.version:
+            try:
+                await asyncio.to_thread(self.history.record, table)
+            except Exception as e:
+                logger.error(f"Currency history write failed: {e}")
+        return table
+
+    def _parse_cbr_rates(self, data: dict) -> RateTable:
+        """Разобрать новый ответ ЦБ"""
+        logger.info("Successfully fetched currency rates from CBR")
+        return build_rate_table(data)
+
+    def _get_mock_rates(self) -> RateTable:
         """Мок-данные для валют (если API недоступно)"""
         logger.info("Using mock currency rates")
-        return {
-            'USD': {'value': 91.5, 'previous': 90.8, 'change': 0.7, 'change_percent': 0.77},
-            'EUR': {'value': 99.2, 'previous': 98.5, 'change': 0.7, 'change_percent': 0.71},
-            'CNY': {'value': 12.8, 'previous': 12.7, 'change': 0.1, 'change_percent': 0.79},
-            'GBP': {'value': 115.3, 'previous': 114.9, 'change': 0.4, 'change_percent': 0.35},
-            'JPY': {'value': 0.61, 'previous': 0.60, 'change': 0.01, 'change_percent': 1.67},
-            'CHF': {'value': 105.2, 'previous': 104.8, 'change': 0.4, 'change_percent': 0.38},
-            'TRY': {'value': 2.8, 'previous': 2.7, 'change': 0.1, 'change_percent': 3.70},
-            'KZT': {'value': 0.19, 'previous': 0.19, 'change': 0.0, 'change_percent': 0.0},
-            'date': datetime.now().strftime('%Y-%m-%d')
+        mock = {
+            'USD': (91.5, 1, 90.8), 'EUR': (99.2, 1, 98.5), 'CNY': (12.8, 1, 12.7), 'GBP': (115.3, 1, 114.9),
+            'JPY': (61.0, 100, 60.0), 'CHF': (105.2, 1, 104.8), 'TRY': (28.0, 10, 27.0), 'KZT': (19.0, 100, 19.0)
         }
+        return build_rate_table({
+            'Date': datetime.now().strftime('%Y-%m-%d'),
+            'Valute': {
+                code: {'Value': value, 'Nominal': nominal, 'Previous': previous, 'Name': code}
+                for code, (value, nominal, previous) in mock.items()
+            }
+        })
 
     def _get_currency_flag(self, currency: str) -> str:
         """Получить флаг валюты"""
@@ -293,15 +378,4 @@ class CurrencyPlugin(BasePlugin):
             'KZT': '🇰🇿',
             'RUB': '🇷🇺'
         }
-        return flags.get(currency, '💱')
-
-    async def _show_main_menu_back(self, update: Update):
-        """Вернуться в главное меню бота"""
-        logger.info("Returning to main menu from currency")
-        keyboard = [
-            [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-            [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-            [KeyboardButton("📊 Анализ файлов"), KeyboardButton("🌤️ Погода"), KeyboardButton("💱 Курсы валют")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("🔙 Возврат в главное меню", reply_markup=reply_markup)
\ No newline at end of file
+        return flags.get(currency, '💱')
\ No newline at end of file
@@ -1,17 +1,24 @@
-import inspect
-from typing import Dict, Callable, Any
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
+import os
+import json
+import time
+import importlib
+from typing import Dict, Callable, Any, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Манифест плагинов: модуль, команды, кнопки и шаблоны, по которым плагин загружается
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifest.json")
+
 
 class PluginManager:
     def __init__(self):
         self.plugins: Dict[str, Dict[str, Any]] = {}
+        self.manifests: Dict[str, dict] = {}
         self.command_handlers = {}
         self.message_handlers = {}
+        self._stubs: Dict[str, Callable] = {}
+        self._failed = set()
 
     def register_plugin(self, name: str, description: str, version: str = "1.0"):
         """Декоратор для регистрации плагинов"""
@@ -48,8 +55,26 @@ class PluginManager:
             return func
         return decorator
 
+    def discover(self, path: Optional[str] = None) -> List[str]:
+        """Прочитать манифест плагинов (модули при этом не импортируются)"""
+        path = path or DEFAULT_MANIFEST_PATH
+        with open(path, encoding='utf-8') as file:
+            for manifest in json.load(file):
+                self.manifests[manifest['name']] = manifest
+                logger.info(f"✅ Plugin discovered: {manifest['name']} v{manifest.get('version', '1.0')}")
+        return list(self.manifests)
+
     def setup_plugins(self, application):
-        """Настройка всех плагинов в приложении"""
+        """Настройка всех плагинов в приложении
+
+        Плагины из манифеста подключаются заглушками маршрутизатора и загружаются
+        при первом подходящем сообщении (или сразу, если в манифесте указано "lazy": false).
+        Плагины с фоновой работой (регистрация источников prefetcher, прогрев
+        кеша в startup) должны быть "lazy": false, иначе она начнется только
+        после первого сообщения. Плагины, импортированные напрямую, инициализируются сразу.
+        """
+        from telegram.ext import CommandHandler
+
         # Регистрируем команды
         for command, data in self.command_handlers.items():
             # Для команд создаем обертку, которая передает self
@@ -57,8 +82,24 @@ class PluginManager:
             application.add_handler(CommandHandler(command, handler_func))
             logger.info(f"✅ Command registered: /{command}")
 
-        # Инициализируем плагины
+        # Плагины из манифеста: их кнопки, команды и шаблоны ведут в заглушку загрузки
+        if self.manifests:
+            from utils.router import router
+
+        for name, manifest in self.manifests.items():
+            stub = self._stubs[name] = self._loading_route(name, application)
+            router.add_buttons(manifest.get('buttons', []), stub)
+            for command in manifest.get('commands', []):
+                router.add_command(command, stub)
+            for pattern in manifest.get('patterns', []):
+                router.add_pattern(pattern, stub)
+            if not manifest.get('lazy', True):
+                self.load_plugin(name, application)
+
+        # Инициализируем плагины, импортированные напрямую
         for name, plugin_data in self.plugins.items():
+            if name in self.manifests:
+                continue
             try:
                 plugin_class = plugin_data['class']
                 plugin_instance = plugin_class()
@@ -79,6 +120,74 @@ class PluginManager:
                 logger.error(f"❌ Failed to initialize plugin {name}: {e}")
                 plugin_data['initialized'] = False
 
+    def _loading_route(self, name: str, application) -> Callable:
+        """Маршрут-заглушка: загрузить плагин и заново маршрутизировать сообщение"""
+        async def route(update, context):
+            from utils.router import router
+
+            self.load_plugin(name, application)
+            return await router.dispatch(update, context)
+        return route
+
+    def load_plugin(self, name: str, application) -> bool:
+        """Импортировать и инициализировать плагин из манифеста"""
+        if self.is_plugin_initialized(name):
+            return True
+        if name in self._failed:
+            return False
+
+        from utils.router import router
+
+        # Маршруты манифеста заменяются настоящими маршрутами плагина
+        router.remove_callback(self._stubs.pop(name, None))
+
+        started = time.perf_counter()
+        try:
+            manifest = self.manifests[name]
+            plugin_class = getattr(importlib.import_module(manifest['module']), manifest['class'])
+            plugin_instance = plugin_class()
+            plugin_instance.setup_handlers(application)
+            plugin_instance.initialize()
+        except Exception as e:
+            logger.error(f"❌ Failed to load plugin {name}: {e}")
+            self._failed.add(name)
+            return False
+
+        plugin_data = self.plugins.setdefault(name, {
+            'description': manifest.get('description', ''),
+            'version': manifest.get('version', '1.0')
+        })
+        plugin_data.update({'class': plugin_class, 'instance': plugin_instance, 'initialized': True})
+        logger.info(f"✅ Plugin loaded: {name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+        # Приложение уже работает: асинхронный запуск плагина в фоне
+        if getattr(application, 'running', False):
+            application.create_task(self._start_plugin(name, plugin_instance, application))
+        return True
+
+    async def _start_plugin(self, name: str, plugin_instance, application):
+        try:
+            await plugin_instance.startup(application)
+        except Exception as e:
+            logger.error(f"❌ Failed to start plugin {name}: {e}")
+
+    async def startup_plugins(self, application):
+        """Асинхронный запуск инициализированных плагинов (post_init приложения)"""
+        for name, plugin_data in self.plugins.items():
+            plugin_instance = plugin_data['instance']
+            if plugin_data['initialized'] and hasattr(plugin_instance, 'startup'):
+                await self._start_plugin(name, plugin_instance, application)
+
+    async def shutdown_plugins(self, application):
+        """Остановка плагинов (post_shutdown приложения)"""
+        for name, plugin_data in self.plugins.items():
+            plugin_instance = plugin_data['instance']
+            if plugin_data['initialized'] and hasattr(plugin_instance, 'shutdown'):
+                try:
+                    await plugin_instance.shutdown(application)
+                except Exception as e:
+                    logger.error(f"❌ Failed to stop plugin {name}: {e}")
+
     def get_plugin(self, name: str):
         """Получить экземпляр плагина"""
         plugin_data = self.plugins.get(name, {})
@@ -1,7 +1,10 @@
+import os
 from abc import ABC, abstractmethod
 import logging
 from typing import Optional, Dict, Any
 
+from utils.user_state import UserStateStore, state_backend
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,7 +16,13 @@ class BasePlugin(ABC):
         self.description = description
         self.version = version
         self.initialized = False
-        self.user_data: Dict[int, Any] = {}  # Хранение данных пользователей
+        # Данные пользователей: ограничены по числу и времени жизни, пространство имен - имя плагина
+        self.user_data = UserStateStore(
+            name,
+            maxsize=int(os.getenv("PLUGIN_STATE_MAX_USERS", "10000")),
+            ttl=float(os.getenv("PLUGIN_STATE_TTL", str(30 * 86400))),
+            backend=state_backend
+        )
 
     @abstractmethod
     def setup_handlers(self, application):
@@ -34,19 +43,25 @@ class BasePlugin(ABC):
         """Внутренний метод инициализации, может быть переопределен"""
         pass
 
-    def get_user_data(self, user_id: int) -> Dict:
-        """Получить данные пользователя"""
-        if user_id not in self.user_data:
-            self.user_data[user_id] = {}
-        return self.user_data[user_id]
+    async def startup(self, application):
+        """Вызывается после запуска приложения (внутри event loop), может быть переопределен"""
+        pass
+
+    async def shutdown(self, application):
+        """Вызывается при остановке приложения, может быть переопределен"""
+        pass
+
+    async def get_user_data(self, user_id: int) -> Dict:
+        """Получить данные пользователя (изменения сохраняются через set_user_data)"""
+        return await self.user_data.get(user_id)
 
-    def set_user_data(self, user_id: int, data: Dict):
+    async def set_user_data(self, user_id: int, data: Dict):
         """Установить данные пользователя"""
-        self.user_data[user_id] = data
+        await self.user_data.set(user_id, data)
 
-    def cleanup_user_data(self, user_id: int):
+    async def cleanup_user_data(self, user_id: int):
         """Очистить данные пользователя"""
-        self.user_data.pop(user_id, None)
+        await self.user_data.delete(user_id)
 
     def is_initialized(self) -> bool:
         """Проверка инициализации"""
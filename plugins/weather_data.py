@@ -0,0 +1,217 @@
+import os
+import re
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from dataclasses import dataclass, field
+
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+# Встроенный справочник городов (id совпадают с id городов OpenWeatherMap)
+DEFAULT_CITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.json")
+
+_CITY_SEPARATORS_RE = re.compile(r'[\s\-‐–—_.,]+')
+
+# Транслитерация для автоматических латинских вариантов русских названий
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh',
+    'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+
+class ForecastEntry(NamedTuple):
+    time: str  # местное время города, ЧЧ:ММ
+    temp: float
+    feels_like: float
+    description: str
+    humidity: int
+    wind_speed: float
+
+
+class DayForecast(NamedTuple):
+    date: str  # местная дата города, ГГГГ-ММ-ДД
+    label: str  # "Пн 01.01"
+    entries: Tuple[ForecastEntry, ...]
+    temp_min: float
+    temp_max: float
+    representative: ForecastEntry  # дневной прогноз для краткого вида
+
+
+@dataclass
+class ForecastIndex:
+    """Прогноз, разобранный один раз при загрузке: записи по местным датам города"""
+    city: str
+    tz_offset: int  # смещение от UTC в секундах (city.timezone)
+    days: Dict[str, DayForecast]
+    dates: List[str]
+    raw: dict = field(repr=False)
+
+    def local_date(self, days_ahead: int = 0, now: Optional[datetime] = None) -> str:
+        """Местная дата города (сегодня + days_ahead), а не дата сервера"""
+        now = now or datetime.now(timezone.utc)
+        return (now + timedelta(seconds=self.tz_offset, days=days_ahead)).strftime('%Y-%m-%d')
+
+    def day(self, days_ahead: int = 0, now: Optional[datetime] = None) -> Optional[DayForecast]:
+        """Прогноз на местный день города"""
+        return self.days.get(self.local_date(days_ahead, now))
+
+    def next_days(self, count: int = 5, now: Optional[datetime] = None) -> List[DayForecast]:
+        """Следующие дни после сегодняшнего"""
+        today = self.local_date(now=now)
+        start = 1 if self.dates and self.dates[0] <= today else 0
+        return [self.days[date] for date in self.dates[start:start + count]]
+
+
+def build_forecast_index(data: dict) -> ForecastIndex:
+    """Разобрать ответ /forecast OpenWeatherMap в ForecastIndex"""
+    city = data.get('city', {})
+    tz_offset = int(city.get('timezone', 0))
+    tz = timezone(timedelta(seconds=tz_offset))
+
+    buckets: Dict[str, List[ForecastEntry]] = {}
+    for item in data.get('list', []):
+        if 'dt' in item:
+            local = datetime.fromtimestamp(item['dt'], tz)
+        else:
+            # dt_txt задан в UTC
+            local = datetime.strptime(item['dt_txt'], '%Y-%m-%d %H:%M:%S') + timedelta(seconds=tz_offset)
+
+        main = item['main']
+        entry = ForecastEntry(
+            local.strftime('%H:%M'),
+            main['temp'],
+            main.get('feels_like', main['temp']),
+            item['weather'][0]['description'],
+            main.get('humidity', 0),
+            item.get('wind', {}).get('speed', 0)
+        )
+        buckets.setdefault(local.strftime('%Y-%m-%d'), []).append(entry)
+
+    days = {}
+    for date, entries in buckets.items():
+        day_date = datetime.strptime(date, '%Y-%m-%d')
+        temps = [entry.temp for entry in entries]
+        days[date] = DayForecast(
+            date,
+            f"{WEEKDAYS[day_date.weekday()]} {day_date.strftime('%d.%m')}",
+            tuple(entries),
+            min(temps),
+            max(temps),
+            entries[len(entries) // 2] if len(entries) > 2 else entries[0]
+        )
+
+    return ForecastIndex(city.get('name', ''), tz_offset, days, sorted(days), data)
+
+
+class City(NamedTuple):
+    id: int
+    name: str
+    name_en: str
+    country: str
+
+
+def normalize_city_name(name: str) -> str:
+    """Ключ поиска города: без регистра, ё -> е, дефисы и пробелы как один пробел"""
+    return _CITY_SEPARATORS_RE.sub(' ', name.casefold().replace('ё', 'е')).strip()
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна с ранним выходом, если оно больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class CityIndex:
+    """Локальный индекс городов: точный поиск по названиям и псевдонимам, нечеткие подсказки по триграммам"""
+
+    def __init__(self, cities: List[dict], max_learned: int = 5000):
+        self.cities: Dict[int, City] = {}
+        self._names: Dict[str, int] = {}  # нормализованное название -> id города
+        self._trigrams: Dict[str, Set[str]] = {}  # триграмма -> названия с ней
+        self.max_learned = max_learned
+        self.learned = 0
+
+        for item in cities:
+            city = City(int(item['id']), item['name'], item.get('name_en', item['name']), item.get('country', ''))
+            self._add(city, item.get('aliases', ()))
+
+    def _add(self, city: City, aliases=()):
+        self.cities.setdefault(city.id, city)
+        names = [city.name, city.name_en, *aliases]
+        names.append(''.join(TRANSLIT.get(char, char) for char in city.name.casefold()))
+        for name in names:
+            key = normalize_city_name(name)
+            # Первый город с таким названием считается основным (справочник упорядочен по значимости)
+            if key and key not in self._names:
+                self._names[key] = city.id
+                for trigram in self._key_trigrams(key):
+                    self._trigrams.setdefault(trigram, set()).add(key)
+
+    def learn(self, city: City, query: str) -> City:
+        """Запомнить город, найденный API по названию query (не больше max_learned городов)
+
+        Название запроса сохраняется псевдонимом только для нового города:
+        варианты названий уже известного города (опечатки и т.п.) в индекс
+        не добавляются, иначе его можно было бы раздувать без ограничений.
+        """
+        known = self.cities.get(city.id)
+        if known is not None:
+            return known
+        if self.learned >= self.max_learned:
+            return city
+        self.learned += 1
+        self._add(city, (query,))
+        return city
+
+    @staticmethod
+    def _key_trigrams(key: str) -> Set[str]:
+        padded = f"  {key} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def resolve(self, text: str) -> Optional[City]:
+        """Город по точному названию или псевдониму (кириллица или латиница)"""
+        city_id = self._names.get(normalize_city_name(text))
+        return self.cities[city_id] if city_id is not None else None
+
+    def suggest(self, text: str, limit: int = 3) -> List[City]:
+        """Похожие города для названия с опечатками"""
+        key = normalize_city_name(text)
+        if not key:
+            return []
+        max_distance = 1 if len(key) <= 5 else 2
+
+        # Кандидаты - названия, разделяющие с запросом хотя бы треть триграмм
+        trigrams = self._key_trigrams(key)
+        shared: Dict[str, int] = {}
+        for trigram in trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        scored: Dict[int, int] = {}
+        for candidate, count in shared.items():
+            if count * 3 < len(trigrams):
+                continue
+            distance = edit_distance(key, candidate, max_distance)
+            if distance <= max_distance:
+                city_id = self._names[candidate]
+                scored[city_id] = min(distance, scored.get(city_id, distance))
+
+        ranked = sorted(scored, key=lambda city_id: scored[city_id])
+        return [self.cities[city_id] for city_id in ranked[:limit]]
+
+
+def load_city_index(path: str = DEFAULT_CITIES_PATH) -> CityIndex:
+    """Загрузить справочник городов (формат встроенного файла или city.list.json OpenWeatherMap)"""
+    with open(path, encoding='utf-8') as file:
+        return CityIndex(json.load(file))
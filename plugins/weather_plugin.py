@@ -1,15 +1,68 @@
 import aiohttp
+import asyncio
+from functools import lru_cache
 import os
 import json
-from datetime import datetime, timedelta
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, MessageHandler, filters, CommandHandler
+from datetime import datetime, timedelta, timezone
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
 from plugins.plugin_base import BasePlugin
 from plugins.init import plugin_manager
+from plugins.weather_data import DEFAULT_CITIES_PATH, City, ForecastIndex, build_forecast_index, load_city_index
+from utils.conditional_fetch import ConditionalFetcher
+from utils.prefetch import prefetcher
+from utils.router import router
+from utils.ui import keyboard
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Города из меню выбора: их данные прогреваются при запуске
+PRESET_CITIES = ["Москва", "Санкт-Петербург", "Казань", "Сочи", "Новосибирск", "Екатеринбург"]
+
+# Кнопки меню погоды
+WEATHER_BUTTONS = ["🌤️ Погода", "📍 Ввести другой город", "🔄 Выбрать другой город",
+                   "🌡️ Сейчас", "📅 Сегодня", "📆 Завтра", "📊 На 5 дней"]
+
+# Клавиатуры собираются один раз; меню выбора города зависит только от сохраненного города
+_CITY_ROWS = tuple(PRESET_CITIES[i:i + 2] for i in range(0, len(PRESET_CITIES), 2))
+CITY_SELECTION_MENU = keyboard(*[[f"🏙️ {city}" for city in row] for row in _CITY_ROWS],
+                               ["📍 Ввести другой город"], ["◀️ Назад"])
+FORECAST_MENU = keyboard(
+    ["🌡️ Сейчас", "📅 Сегодня"],
+    ["📆 Завтра", "📊 На 5 дней"],
+    ["🔄 Выбрать другой город", "◀️ Назад"]
+)
+WEATHER_START_MENU = keyboard(["🌤️ Погода"])
+
+
+@lru_cache(maxsize=256)
+def city_selection_menu(saved_city: str = None):
+    """Меню выбора города с кнопкой сохраненного города (названия берутся из справочника)"""
+    if not saved_city:
+        return CITY_SELECTION_MENU
+    return keyboard([f"📍 {saved_city} (мой город)"], *[[f"🏙️ {city}" for city in row] for row in _CITY_ROWS],
+                    ["📍 Ввести другой город"], ["◀️ Назад"])
+
+
+@lru_cache(maxsize=256)
+def suggestions_menu(cities: tuple):
+    """Подсказки для города с опечаткой"""
+    return keyboard(*[[f"🏙️ {city}"] for city in cities], ["📍 Ввести другой город", "◀️ Назад"])
+
+
+# Максимум городов в одном запросе сравнения
+MAX_COMPARE_CITIES = 10
+
+WEATHER_EMOJIS = {
+    'ясно': '☀️',
+    'облачно': '⛅',
+    'дождь': '🌧️',
+    'снег': '❄️',
+    'туман': '🌫️'
+}
+
 
 @plugin_manager.register_plugin(
     name="weather",
@@ -20,7 +73,21 @@ class WeatherPlugin(BasePlugin):
     def __init__(self):
         super().__init__("weather", "Плагин для получения прогноза погоды", "1.0")
         self.api_key = os.getenv("WEATHER_API_KEY")
-        self.base_url = "http://api.openweathermap.org/data/2.5"
+        self.base_url = os.getenv("WEATHER_API_URL", "http://api.openweathermap.org/data/2.5")
+
+        # Ответы API живут в теплом хранилище: текущая погода меняется быстрее прогноза
+        self.current_ttl = int(os.getenv("WEATHER_CURRENT_TTL", "600"))
+        self.forecast_ttl = int(os.getenv("WEATHER_FORECAST_TTL", "3600"))
+        prefetcher.register("weather", lambda city: self._fetch("weather", city), self.current_ttl)
+        prefetcher.register("forecast", self._fetch_forecast, self.forecast_ttl)
+        self._session = None
+        # Валидаторы ответов (ETag/Last-Modified): неизменившиеся данные не скачиваются и не разбираются
+        self._http = ConditionalFetcher()
+        # Локальный справочник городов - быстрый путь; остальные названия проверяются запросом к API
+        self.cities = load_city_index(os.getenv("WEATHER_CITIES_PATH", DEFAULT_CITIES_PATH))
+        # Ограничение одновременных запросов к API (например, при сравнении городов)
+        self._api_semaphore = asyncio.Semaphore(int(os.getenv("WEATHER_MAX_CONCURRENCY", "5")))
+        self._prewarm_task = None
         
         if not self.api_key or self.api_key == "your_weather_api_key_here":
             logger.warning("❌ Weather API key not configured. Using mock data.")
@@ -45,32 +112,78 @@ class WeatherPlugin(BasePlugin):
             logger.error(f"❌ Failed to initialize weather plugin: {e}")
             raise
     
+    async def startup(self, application):
+        """Запуск вместе с приложением: прогрев кеша для городов из меню"""
+        if not self.use_mock_data:
+            self._prewarm_task = asyncio.create_task(self.prewarm())
+
+    async def shutdown(self, application):
+        """Остановка приложения: закрыть HTTP-сессию"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def prewarm(self, cities=PRESET_CITIES):
+        """Загрузить текущую погоду и прогноз для списка городов"""
+        requests = [self._get_current_weather(city) for city in cities] + [self._get_forecast(city) for city in cities]
+        await asyncio.gather(*requests, return_exceptions=True)
+        logger.info(f"✅ Weather cache prewarmed for {len(cities)} cities")
+
     def setup_handlers(self, application):
         """Настройка обработчиков для плагина погоды"""
-        # Обработчик команды /weather
-        application.add_handler(CommandHandler("weather", self.weather_command))
-        
-        # Обработчик кнопок погоды
-        application.add_handler(MessageHandler(
-            filters.Regex(r'^(🌤️ Погода|📍 Ввести другой город|🔄 Выбрать другой город|🌡️ Сейчас|📅 Сегодня|📆 Завтра|📊 На 5 дней)$'),
-            self.handle_weather_messages
-        ))
-        
-        # Обработчик выбора города из кнопок
-        application.add_handler(MessageHandler(
-            filters.Regex(r'^(🏙️ .+|📍 .+)$'),
-            self.handle_city_selection
-        ))
-        
-        # Обработчик кнопки "Назад" в контексте погоды
-        application.add_handler(MessageHandler(
-            filters.Regex(r'^◀️ Назад$'),
-            self.handle_back_button
-        ))
+        # Команда /weather и кнопки погоды
+        router.add_command("weather", self.weather_command)
+        router.add_buttons(WEATHER_BUTTONS, self.handle_weather_messages)
+
+        # Выбор города из кнопок
+        router.add_pattern(r'^(🏙️ .+|📍 .+)$', self.handle_city_selection)
 
     async def weather_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /weather"""
-        await self._show_city_selection(update)
+        """Обработчик команды /weather (/weather Москва, Казань, Сочи - сравнение городов)"""
+        cities = self._parse_city_list(' '.join(context.args or []))
+
+        if len(cities) > 1:
+            await self._show_cities_comparison(update, cities)
+        elif cities:
+            await self._process_city_input(update, cities[0], update.effective_user.id)
+        else:
+            await self._show_city_selection(update)
+
+    @staticmethod
+    def _parse_city_list(text: str) -> list:
+        """Список городов через запятую без пустых значений и повторов"""
+        cities = []
+        seen = set()
+        for city in text.split(','):
+            city = ' '.join(city.split())
+            if city and city.casefold() not in seen:
+                seen.add(city.casefold())
+                cities.append(city)
+        return cities
+
+    async def _show_cities_comparison(self, update: Update, cities: list):
+        """Сравнение текущей погоды в нескольких городах одним сообщением"""
+        if len(cities) > MAX_COMPARE_CITIES:
+            await update.message.reply_text(f"❌ Можно сравнить не больше {MAX_COMPARE_CITIES} городов за раз.")
+            return
+
+        found = await asyncio.gather(*[self._find_city(city) for city in cities])
+        unknown = [city for city, match in zip(cities, found) if not match]
+        known = list(dict.fromkeys(match.name for match in found if match))
+        if not known:
+            await update.message.reply_text("❌ Ни один из городов не найден. Проверьте названия.")
+            return
+
+        await update.message.reply_text(f"🌤️ Получаю погоду для {len(known)} городов...")
+        results = await self._get_cities_weather(known)
+        response = self._format_cities_comparison(results)
+        if unknown:
+            response += f"\n❓ Не найдены: {escape_markdown(', '.join(unknown))}"
+        await update.message.reply_text(response, parse_mode='Markdown')
+
+    async def _get_cities_weather(self, cities: list) -> list:
+        """Текущая погода для нескольких городов параллельно: [(город, данные), ...]"""
+        results = await asyncio.gather(*[self._get_current_weather(city) for city in cities])
+        return list(zip(cities, results))
 
     async def handle_weather_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик сообщений для плагина погоды"""
@@ -84,10 +197,9 @@ class WeatherPlugin(BasePlugin):
             return
 
         if user_message == "📍 Ввести другой город" or user_message == "🔄 Выбрать другой город":
-            user_data = self.get_user_data(user_id)
-            user_data['awaiting_city_input'] = True
-            self.set_user_data(user_id, user_data)
-            
+            # Следующее текстовое сообщение пользователя - название города
+            router.expect_input(user_id, self.handle_city_text)
+
             await update.message.reply_text(
                 "🏙️ Введите название города:\n\n"
                 "Пример: *Лондон*, *Париж*, *Токио*",
@@ -112,54 +224,30 @@ class WeatherPlugin(BasePlugin):
         else:
             city = city_input
         
-        # Сохраняем город для пользователя
-        user_data = self.get_user_data(user_id)
-        user_data['city'] = city
-        user_data['awaiting_city_input'] = False
-        self.set_user_data(user_id, user_data)
-        
-        # Показываем варианты прогноза
-        keyboard = [
-            [KeyboardButton("🌡️ Сейчас"), KeyboardButton("📅 Сегодня")],
-            [KeyboardButton("📆 Завтра"), KeyboardButton("📊 На 5 дней")],
-            [KeyboardButton("🔄 Выбрать другой город"), KeyboardButton("◀️ Назад")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
+        await self._process_city_input(update, city, user_id)
+
+    async def handle_city_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Название города, введенное текстом после кнопки «📍 Ввести другой город»"""
+        user_id = update.effective_user.id
+        city = update.message.text.strip()
+
+        if 1 < len(city) < 50:
+            logger.info(f"Processing city input: {city}")
+            await self._process_city_input(update, city, user_id)
+            return
+
         await update.message.reply_text(
-            f"🏙️ Выбран город: {city}\n\n"
-            "Выберите тип прогноза:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
+            "❌ Это не похоже на название города. Попробуйте еще раз или выберите город из списка."
         )
-
-    async def handle_back_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик кнопки Назад для плагина погоды"""
-        logger.info("Weather plugin handling back button")
-        await self._show_main_menu(update)
+        await self._show_city_selection(update)
 
     async def _show_city_selection(self, update: Update):
         """Показать выбор города"""
         user_id = update.effective_user.id
-        user_data = self.get_user_data(user_id)
-        saved_city = user_data.get('city')
-        
-        # Сбрасываем флаг ожидания ввода при показе меню
-        user_data['awaiting_city_input'] = False
-        self.set_user_data(user_id, user_data)
-        
-        keyboard = [
-            [KeyboardButton("🏙️ Москва"), KeyboardButton("🏙️ Санкт-Петербург")],
-            [KeyboardButton("🏙️ Казань"), KeyboardButton("🏙️ Сочи")],
-            [KeyboardButton("🏙️ Новосибирск"), KeyboardButton("🏙️ Екатеринбург")],
-            [KeyboardButton("📍 Ввести другой город")],
-            [KeyboardButton("◀️ Назад")]
-        ]
-        
-        if saved_city:
-            keyboard.insert(0, [KeyboardButton(f"📍 {saved_city} (мой город)")])
-        
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        saved_city = (await self.get_user_data(user_id)).get('city')
+
+        # Сбрасываем ожидание ввода при показе меню
+        router.cancel_input(user_id)
         
         message_text = "🌤️ Прогноз погоды\n\n"
         if saved_city:
@@ -169,44 +257,60 @@ class WeatherPlugin(BasePlugin):
         
         await update.message.reply_text(
             message_text,
-            reply_markup=reply_markup,
+            reply_markup=city_selection_menu(saved_city),
             parse_mode='Markdown'
         )
 
     async def _process_city_input(self, update: Update, city: str, user_id: int):
         """Обработка ввода города текстом"""
         logger.info(f"Processing city input: {city} for user {user_id}")
+
+        found = await self._find_city(city)
+        if not found:
+            await self._reject_unknown_city(update, city, user_id)
+            return
+        city = found.name
         
-        # Сохраняем город для пользователя и сбрасываем флаг ожидания
-        user_data = self.get_user_data(user_id)
+        # Сохраняем город для пользователя и сбрасываем ожидание ввода
+        user_data = await self.get_user_data(user_id)
         user_data['city'] = city
-        user_data['awaiting_city_input'] = False
-        self.set_user_data(user_id, user_data)
+        await self.set_user_data(user_id, user_data)
+        router.cancel_input(user_id)
         
         # Показываем варианты прогноза
-        keyboard = [
-            [KeyboardButton("🌡️ Сейчас"), KeyboardButton("📅 Сегодня")],
-            [KeyboardButton("📆 Завтра"), KeyboardButton("📊 На 5 дней")],
-            [KeyboardButton("🔄 Выбрать другой город"), KeyboardButton("◀️ Назад")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
         await update.message.reply_text(
             f"🏙️ Выбран город: {city}\n\n"
             "Выберите тип прогноза:",
-            reply_markup=reply_markup,
+            reply_markup=FORECAST_MENU,
             parse_mode='Markdown'
         )
 
+    async def _reject_unknown_city(self, update: Update, city: str, user_id: int):
+        """Город не найден: предложить похожие или вернуть к выбору города"""
+        router.cancel_input(user_id)
+
+        suggestions = self.cities.suggest(city)
+        if not suggestions:
+            await update.message.reply_text(
+                "❌ Город не найден. Попробуйте еще раз или выберите город из списка."
+            )
+            await self._show_city_selection(update)
+            return
+
+        await update.message.reply_text(
+            f"🤔 Город «{city}» не найден. Возможно, вы имели в виду:",
+            reply_markup=suggestions_menu(tuple(suggestion.name for suggestion in suggestions))
+        )
+
     async def _process_forecast_request(self, update: Update, forecast_type: str, user_id: int):
         """Обработка запроса прогноза"""
-        user_data = self.get_user_data(user_id)
+        user_data = await self.get_user_data(user_id)
         city = user_data.get('city')
         
         if not city:
             await update.message.reply_text(
                 "❌ Сначала выберите город.",
-                reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🌤️ Погода")]], resize_keyboard=True)
+                reply_markup=WEATHER_START_MENU
             )
             return
 
@@ -236,35 +340,61 @@ class WeatherPlugin(BasePlugin):
                 "❌ Не удалось получить данные о погоде. "
                 "Проверьте название города или попробуйте позже."
             )
-    async def _process_city_selection(self, update: Update, city_input: str, user_id: int):
-        """Обработка выбора города из кнопки"""
-        if city_input.startswith("🏙️ "):
-            city = city_input[3:]
-        elif city_input.startswith("📍 "):
-            city = city_input[2:].replace(" (мой город)", "")
-        else:
-            city = city_input
-        
-        # Сохраняем город для пользователя и сбрасываем флаг ожидания
-        user_data = self.get_user_data(user_id)
-        user_data['city'] = city
-        user_data['awaiting_city_input'] = False  # Сбрасываем флаг
-        self.set_user_data(user_id, user_data)
-        
-        # Показываем варианты прогноза
-        keyboard = [
-            [KeyboardButton("🌡️ Сейчас"), KeyboardButton("📅 Сегодня")],
-            [KeyboardButton("📆 Завтра"), KeyboardButton("📊 На 5 дней")],
-            [KeyboardButton("🔄 Выбрать другой город"), KeyboardButton("◀️ Назад")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        await update.message.reply_text(
-            f"🏙️ Выбран город: {city}\n\n"
-            "Выберите тип прогноза:",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
+
+    async def _find_city(self, name: str):
+        """Город из локального справочника; если его там нет, название проверяется запросом к API
+
+        Найденный API город запоминается в справочнике, поэтому повторные
+        запросы того же названия снова идут по быстрому пути. С мок-данными
+        доступен только справочник.
+        """
+        found = self.cities.resolve(name)
+        if found or self.use_mock_data:
+            return found
+        try:
+            data = await self._fetch("weather", name)
+            api_name = data.get('name') or name
+            city = City(int(data['id']), api_name, api_name, data.get('sys', {}).get('country', ''))
+        except Exception as e:
+            logger.info(f"City not found by API: {name} ({e})")
+            return None
+        # Ответ по названию - это уже текущая погода: повторно запрашивать ее по id не нужно
+        prefetcher.put("weather", city.id, data)
+        return self.cities.learn(city, name)
+
+    async def _city_key(self, city: str) -> int:
+        """Ключ хранилища и запроса к API: id города"""
+        found = await self._find_city(city)
+        if found is None:
+            raise Exception(f"Unknown city: {city}")
+        return found.id
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Общая HTTP-сессия плагина (создается при первом запросе)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self._session
+
+    async def _fetch(self, endpoint: str, city, parse=lambda data: data):
+        """Запрос к OpenWeatherMap по id города или названию; при ошибке выбрасывает исключение
+
+        Запрос условный: если ответ не изменился (304), возвращается уже разобранный объект.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        params = {
+            'id' if isinstance(city, int) else 'q': city,
+            'appid': self.api_key,
+            'units': 'metric',
+            'lang': 'ru'
+        }
+
+        async with self._api_semaphore:
+            logger.info(f"Making API request to: {url} ({city})")
+            return await self._http.get(self._get_session(), url, parse, params=params, error="Weather API error")
+
+    async def _fetch_forecast(self, city) -> ForecastIndex:
+        """Загрузить прогноз и сразу разобрать его по местным датам города"""
+        return await self._fetch("forecast", city, build_forecast_index)
 
     async def _get_current_weather(self, city: str):
         """Получить текущую погоду"""
@@ -273,65 +403,29 @@ class WeatherPlugin(BasePlugin):
         if self.use_mock_data:
             logger.info("Using mock weather data")
             return self._get_mock_weather_data(city)
-        
-        url = f"{self.base_url}/weather"
-        params = {
-            'q': city,
-            'appid': self.api_key,
-            'units': 'metric',
-            'lang': 'ru'
-        }
-        
-        logger.info(f"Making API request to: {url}")
-        
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=10) as response:
-                    logger.info(f"Weather API response status: {response.status}")
-                    if response.status == 200:
-                        data = await response.json()
-                        logger.info(f"Weather API success for {city}")
-                        return data
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Weather API error: {response.status} - {error_text}")
-                        # При ошибке API используем мок-данные
-                        return self._get_mock_weather_data(city)
+            return await prefetcher.get("weather", await self._city_key(city))
         except Exception as e:
             logger.error(f"Weather API request failed: {e}")
-            # При ошибке сети используем мок-данные
+            # При ошибке API или сети используем мок-данные (в кеш они не попадают)
             return self._get_mock_weather_data(city)
 
-    async def _get_forecast(self, city: str):
+    async def _get_forecast(self, city: str) -> ForecastIndex:
         """Получить прогноз погоды"""
         logger.info(f"Getting forecast for: {city}")
         
         if self.use_mock_data:
             logger.info("Using mock forecast data")
-            return self._get_mock_forecast_data(city)
-        
-        url = f"{self.base_url}/forecast"
-        params = {
-            'q': city,
-            'appid': self.api_key,
-            'units': 'metric',
-            'lang': 'ru'
-        }
-        
+            return build_forecast_index(self._get_mock_forecast_data(city))
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=10) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Weather API error: {response.status} - {error_text}")
-                        # При ошибке API используем мок-данные
-                        return self._get_mock_forecast_data(city)
+            # Один ответ /forecast обслуживает кнопки "Сегодня", "Завтра" и "На 5 дней"
+            return await prefetcher.get("forecast", await self._city_key(city))
         except Exception as e:
             logger.error(f"Weather API request failed: {e}")
-            # При ошибке сети используем мок-данные
-            return self._get_mock_forecast_data(city)
+            # При ошибке API или сети используем мок-данные (в кеш они не попадают)
+            return build_forecast_index(self._get_mock_forecast_data(city))
 
     def _get_mock_weather_data(self, city: str):
         """Мок-данные для демонстрации (только если API ключ не настроен)"""
@@ -373,10 +467,11 @@ class WeatherPlugin(BasePlugin):
         """Мок-данные прогноза"""
         forecasts = []
         for i in range(40):  # 5 дней * 8 прогнозов
-            forecast_time = datetime.now() + timedelta(hours=i*3)
+            forecast_time = datetime.now(timezone.utc) + timedelta(hours=i*3)
             temp = 15 + i % 10 - 5  # Колебания температуры
             
             forecasts.append({
+                'dt': int(forecast_time.timestamp()),
                 'dt_txt': forecast_time.strftime('%Y-%m-%d %H:%M:%S'),
                 'main': {
                     'temp': temp,
@@ -391,7 +486,7 @@ class WeatherPlugin(BasePlugin):
             })
         
         return {
-            'city': {'name': city},
+            'city': {'name': city, 'timezone': 10800},
             'list': forecasts
         }
 
@@ -400,15 +495,7 @@ class WeatherPlugin(BasePlugin):
         main = data['main']
         weather = data['weather'][0]
         
-        weather_emojis = {
-            'ясно': '☀️',
-            'облачно': '⛅',
-            'дождь': '🌧️',
-            'снег': '❄️',
-            'туман': '🌫️'
-        }
-        
-        emoji = weather_emojis.get(weather['description'], '🌤️')
+        emoji = WEATHER_EMOJIS.get(weather['description'], '🌤️')
         
         return (
             f"{emoji} Погода в {city}\n\n"
@@ -421,94 +508,70 @@ class WeatherPlugin(BasePlugin):
             f"🕐 *Обновлено: {datetime.now().strftime('%H:%M')}*"
         )
 
-    def _format_today_forecast(self, data, city: str) -> str:
+    def _format_cities_comparison(self, results: list) -> str:
+        """Форматирование сравнения погоды в нескольких городах"""
+        result = "🌍 *Погода в городах*\n\n"
+
+        for city, data in results:
+            weather = data['weather'][0]
+            emoji = WEATHER_EMOJIS.get(weather['description'], '🌤️')
+            result += (
+                f"{emoji} *{city}:* {data['main']['temp']:.0f}°C, {weather['description']}, "
+                f"💨 {data['wind']['speed']} м/с\n"
+            )
+
+        warmest = max(results, key=lambda item: item[1]['main']['temp'])
+        coldest = min(results, key=lambda item: item[1]['main']['temp'])
+        result += (
+            f"\n🔥 Теплее всего: {warmest[0]} ({warmest[1]['main']['temp']:.0f}°C)\n"
+            f"🧊 Холоднее всего: {coldest[0]} ({coldest[1]['main']['temp']:.0f}°C)\n"
+            f"\n🕐 *Обновлено: {datetime.now().strftime('%H:%M')}*"
+        )
+        return result
+
+    def _format_today_forecast(self, forecast: ForecastIndex, city: str) -> str:
         """Форматирование прогноза на сегодня"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_forecasts = [item for item in data['list'] if item['dt_txt'].startswith(today)]
+        today = forecast.day(0)
         
-        if not today_forecasts:
+        if not today:
             return f"❌ Нет данных на сегодня для {city}"
         
         result = f"📅 Прогноз на сегодня для {city}\n\n"
         
-        for forecast in today_forecasts[:4]:  # Первые 4 прогноза
-            time_str = datetime.strptime(forecast['dt_txt'], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')
-            temp = forecast['main']['temp']
-            desc = forecast['weather'][0]['description']
-            
-            result += f"🕐 {time_str}: {desc}, {temp:.1f}°C\n"
+        for entry in today.entries[:4]:  # Первые 4 прогноза
+            result += f"🕐 {entry.time}: {entry.description}, {entry.temp:.1f}°C\n"
         
         return result
 
-    def _format_tomorrow_forecast(self, data, city: str) -> str:
+    def _format_tomorrow_forecast(self, forecast: ForecastIndex, city: str) -> str:
         """Форматирование прогноза на завтра"""
-        tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-        tomorrow_forecasts = [item for item in data['list'] if item['dt_txt'].startswith(tomorrow)]
+        tomorrow = forecast.day(1)
         
-        if not tomorrow_forecasts:
+        if not tomorrow:
             return f"❌ Нет данных на завтра для {city}"
         
         # Берем дневной прогноз (около 12:00)
-        day_forecast = tomorrow_forecasts[len(tomorrow_forecasts)//2] if len(tomorrow_forecasts) > 2 else tomorrow_forecasts[0]
-        
-        main = day_forecast['main']
-        weather = day_forecast['weather'][0]
+        day_forecast = tomorrow.representative
         
         return (
             f"📆 Прогноз на завтра для {city}\n\n"
-            f"{weather['description'].title()}\n"
-            f"🌡️ Температура: {main['temp']:.1f}°C\n"
-            f"💧 Влажность: {main['humidity']}%\n"
-            f"💨 Ветер: {day_forecast['wind']['speed']} м/с"
+            f"{day_forecast.description.title()}\n"
+            f"🌡️ Температура: {day_forecast.temp:.1f}°C "
+            f"(от {tomorrow.temp_min:.0f} до {tomorrow.temp_max:.0f}°C)\n"
+            f"💧 Влажность: {day_forecast.humidity}%\n"
+            f"💨 Ветер: {day_forecast.wind_speed} м/с"
         )
 
-    def _format_5days_forecast(self, data, city: str) -> str:
+    def _format_5days_forecast(self, forecast: ForecastIndex, city: str) -> str:
         """Форматирование прогноза на 5 дней"""
-        forecasts_by_day = {}
-        
-        for item in data['list']:
-            date = item['dt_txt'].split()[0]
-            if date not in forecasts_by_day:
-                forecasts_by_day[date] = []
-            forecasts_by_day[date].append(item)
-        
-        # Берем следующие 5 дней (исключая сегодня)
-        next_5_days = sorted(forecasts_by_day.keys())[1:6]
-        
         result = f"📊 Прогноз на 5 дней для {city}\n\n"
         
-        for date in next_5_days:
-            day_forecasts = forecasts_by_day[date]
-            # Берем дневной прогноз
-            day_forecast = day_forecasts[len(day_forecasts)//2]
-            
-            main = day_forecast['main']
-            weather = day_forecast['weather'][0]
-            
-            # Форматируем дату
-            forecast_date = datetime.strptime(date, '%Y-%m-%d')
-            date_str = forecast_date.strftime('%d.%m')
-            day_name = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'][forecast_date.weekday()]
+        # Следующие 5 дней (исключая сегодня по местному времени города)
+        for day in forecast.next_days(5):
+            day_forecast = day.representative
+            emoji = WEATHER_EMOJIS.get(day_forecast.description, '🌤️')
             
-            weather_emojis = {
-                'ясно': '☀️',
-                'облачно': '⛅',
-                'дождь': '🌧️',
-                'снег': '❄️'
-            }
-            emoji = weather_emojis.get(weather['description'], '🌤️')
-            
-            result += f"{emoji} {day_name} {date_str}: {weather['description']}, {main['temp']:.0f}°C\n"
+            result += f"{emoji} {day.label}: {day_forecast.description}, {day_forecast.temp:.0f}°C\n"
         
         result += f"\n💡 *Обновлено: {datetime.now().strftime('%H:%M')}*"
-        return result
-
-    async def _show_main_menu(self, update: Update):
-        """Показать главное меню"""
-        keyboard = [
-            [KeyboardButton("❓ Помощь"), KeyboardButton("ℹ️ О боте")],
-            [KeyboardButton("🔄 Сбросить диалог"), KeyboardButton("💡 Примеры запросов")],
-            [KeyboardButton("📊 Анализ файлов"), KeyboardButton("🌤️ Погода"), KeyboardButton("💱 Курсы валют")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text("🔙 Возврат в главное меню", reply_markup=reply_markup)
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -1,5 +1,6 @@
 import pytest
 import asyncio
+import json
 from unittest.mock import AsyncMock, Mock, patch
 
 # Импортируем правильные классы из вашего кода
@@ -46,6 +47,99 @@ class TestTextFilter:
         assert result == text
         assert error == ""
 
+    def test_normalize_leet_and_homoglyphs(self):
+        """Тестирование нормализации leet-замен и омоглифов за один проход"""
+        assert self.filter._normalize_text("Sh1t.") == "shit"
+        # '1' всегда означает 'i', независимо от порядка замен
+        assert self.filter._normalize_text("1") == "i"
+        # Кириллические и латинские омоглифы сворачиваются в одни и те же символы
+        assert self.filter._normalize_text("хуй") == self.filter._normalize_text("xyй")
+        # Эмодзи и пунктуация удаляются
+        assert self.filter._normalize_text("Привет, 👋 мир.") == self.filter._normalize_text("привет  мир")
+
+    def test_tokenize_offsets(self):
+        """Тестирование общей токенизации со смещениями"""
+        text = "Привет, МИР бот"
+        tokenized = self.filter.tokenize(text)
+        assert tokenized.words == ["привет", "мир", "бот"]
+        assert [text[t.start:t.end] for t in tokenized.tokens] == ["Привет", "МИР", "бот"]
+        assert tokenized.normalized_words == self.filter._normalize_text(text).split()
+
+    def test_context_phrase_triggers(self):
+        """Тестирование многословных контекстных триггеров"""
+        result, error = self.filter.filter_text("быстрый доход и легкие деньги, прибыль")
+        assert result == ""
+        assert "мошенничество" in error
+
+    def test_verdict_cache(self):
+        """Тестирование кеша вердиктов для повторяющихся сообщений"""
+        for _ in range(3):
+            result, error = self.filter.filter_text("спасибо за помощь")
+            assert result == "спасибо за помощь"
+            assert error == ""
+
+        stats = self.filter.get_cache_stats()['filter']
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+
+    def test_verdict_cache_invalidated_on_rules_change(self):
+        """Тестирование сброса кеша при изменении словарей"""
+        text = "это запрещенкаслово"
+        assert self.filter.filter_text(text) == (text, "")
+
+        self.filter.update_rules(base_profanity=self.filter.rule_pack["base_profanity"] + ["запрещенкаслово"])
+        result, error = self.filter.filter_text(text)
+        assert result == ""
+        assert "нецензурная" in error
+
+    def test_mixed_script_profanity(self):
+        """Тестирование мата, набранного вперемешку латиницей и кириллицей"""
+        for text in ["xуйня какая", "это пи3дец", "ПИ3ДЕЦ", "е6ать", "хуj", "pизда", "pi3da", "пи3d"]:
+            result, error = self.filter.filter_text(text)
+            assert result == ""
+            assert "нецензурная" in error
+
+        # Маска '3' для 'з' не сливается с leet-заменой '3' -> 'e': обычные слова не блокируются
+        for text in ["пиедестал памятника", "Пиедестал", "бетон 3 марки", "в 1983 году", "pizza and pie", "rapid deploy"]:
+            assert self.filter.filter_text(text) == (text, "")
+
+    def test_rule_pack_background_reload(self, tmp_path):
+        """Тестирование фоновой перезагрузки набора правил из файла"""
+        pack = dict(self.filter.rule_pack, version="2.0")
+        pack["base_profanity"] = pack["base_profanity"] + ["запрещенкаслово"]
+        rules_path = tmp_path / "rules.json"
+        rules_path.write_text(json.dumps(pack, ensure_ascii=False), encoding="utf-8")
+
+        text = "это запрещенкаслово"
+        assert self.filter.filter_text(text) == (text, "")
+
+        self.filter.reload_rules(str(rules_path)).join()
+        assert self.filter.rules_version == "default v2.0"
+        assert self.filter.filter_text(text)[0] == ""
+
+    def test_rule_pack_disk_cache(self, tmp_path):
+        """Тестирование дискового кеша скомпилированных правил"""
+        cache_dir = tmp_path / "rules"
+        first = UltraTextFilter(cache_dir=str(cache_dir))
+        assert cache_dir.stat().st_mode & 0o777 == 0o700
+        cached_files = list(cache_dir.glob("*.pickle"))
+        assert len(cached_files) == 1
+
+        second = UltraTextFilter(cache_dir=str(cache_dir))
+        assert list(cache_dir.glob("*.pickle")) == cached_files
+        assert second.filter_text("xуйня какая")[0] == ""
+        assert second.filter_text("Это нормальное сообщение") == first.filter_text("Это нормальное сообщение")
+
+        # Каталог, доступный другим пользователям, не используется: pickle из него не загружается
+        shared = tmp_path / "shared"
+        shared.mkdir()
+        shared.chmod(0o777)
+        (shared / cached_files[0].name).write_bytes(cached_files[0].read_bytes())
+        with patch("utils.text_filter.pickle.load") as load:
+            third = UltraTextFilter(cache_dir=str(shared))
+        load.assert_not_called()
+        assert third.filter_text("xуйня какая")[0] == ""
+
 class TestContextManager:
     def setup_method(self):
         self.manager = ContextManager()
@@ -137,5 +231,789 @@ def test_link_detection():
     print(f"Testing '@username': result='{result}', error='{error}'")
     # @username без домена может проходить фильтр - это нормально
 
+def test_filter_batch_structured_verdicts():
+    """Тестирование пакетной проверки со структурированными вердиктами"""
+    from utils.batch_filter import filter_batch
+
+    texts = ["Это нормальное сообщение", "посетите сайт https://example.com", "это пи3дец"]
+    for workers in (1, 2):
+        verdicts = filter_batch(texts, workers=workers, chunk_size=2)
+        assert [v.index for v in verdicts] == [0, 1, 2]
+        assert not verdicts[0].blocked
+        assert verdicts[1].rule_id == "links.urls"
+        start, end = verdicts[1].offsets[0]
+        assert texts[1][start:end] == "https://example.com"
+        assert verdicts[2].category == "profanity"
+        start, end = verdicts[2].offsets[0]
+        assert texts[2][start:end] == "пи3дец"
+
+@pytest.mark.asyncio
+async def test_rate_limiter_buckets_and_duplicates():
+    """Тестирование корзин токенов и детектора повторяющихся сообщений"""
+    from utils.rate_limiter import RateLimiter
+
+    limiter = RateLimiter(user_rate=1.0, user_burst=3, duplicate_window=60, duplicate_limit=2)
+    results = [await limiter.check(1, 1, f"сообщение {i}", now=100.0) for i in range(4)]
+    assert results == ["", "", "", "user"]
+
+    # Через секунду корзина пополнилась на один токен
+    assert await limiter.check(1, 1, "еще одно", now=101.0) == ""
+
+    # Одинаковые сообщения режутся даже при свободной корзине
+    limiter = RateLimiter(user_rate=100.0, user_burst=100, duplicate_window=60, duplicate_limit=2)
+    results = [await limiter.check(2, 2, "Купи  СЛОНА", now=200.0 + i) for i in range(3)]
+    assert results == ["", "", "duplicate"]
+    assert await limiter.check(2, 2, "купи слона", now=300.0) == ""
+
+    # Повторные нажатия кнопок и команды не считаются повторами, свободный текст - считается
+    from telegram.ext import ApplicationHandlerStop
+    from utils.router import router
+
+    button = AsyncMock()
+    router.add_button("💱 Курсы валют", button)
+    router.add_command("currency", button)
+    try:
+        def update(text):
+            message = Mock(text=text, chat_id=3, reply_text=AsyncMock())
+            return Mock(message=message, effective_message=message, effective_user=Mock(id=3))
+
+        for text in ["💱 Курсы валют"] * 4 + ["/currency"] * 4:
+            await limiter.handle_update(update(text), Mock())
+        # Отредактированные сообщения и callback-запросы лимит не расходуют
+        for _ in range(3):
+            edited = update("купи слона")
+            edited.message = None
+            await limiter.handle_update(edited, Mock())
+        for _ in range(2):
+            await limiter.handle_update(update("купи слона"), Mock())
+        with pytest.raises(ApplicationHandlerStop):
+            await limiter.handle_update(update("купи слона"), Mock())
+    finally:
+        router.remove_callback(button)
+
+@pytest.mark.asyncio
+async def test_weather_cache_with_local_stub():
+    """Тестирование кеша погоды на локальной заглушке OpenWeatherMap"""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from plugins.weather_plugin import WeatherPlugin
+
+    calls = {"weather": 0, "forecast": 0}
+
+    async def weather(request):
+        calls["weather"] += 1
+        return web.json_response({"name": "Казань", "main": {"temp": 1}})
+
+    async def forecast(request):
+        calls["forecast"] += 1
+        # Города из справочника запрашиваются по id
+        assert request.query["id"] == "524901"
+        await asyncio.sleep(0.05)
+        return web.json_response({"city": {"name": "Москва"}, "list": []})
+
+    app = web.Application()
+    app.router.add_get("/weather", weather)
+    app.router.add_get("/forecast", forecast)
+
+    async with TestServer(app) as server:
+        plugin = WeatherPlugin()
+        plugin.api_key = "test"
+        plugin.use_mock_data = False
+        plugin.base_url = str(server.make_url("")).rstrip("/")
+
+        # Одновременные запросы одного города объединяются в один
+        results = await asyncio.gather(*[plugin._get_forecast(city) for city in ["Москва", " москва ", "МОСКВА"]])
+        assert calls["forecast"] == 1
+        assert all(result.city.casefold() == "москва" for result in results)
+
+        await plugin._get_current_weather("Казань")
+        await plugin._get_current_weather("казань")
+        await plugin._get_forecast("Москва")
+        assert calls == {"weather": 1, "forecast": 1}
+
+        await plugin.shutdown(None)
+
+@pytest.mark.asyncio
+async def test_prefetch_refreshes_popular_keys_and_backs_off():
+    """Тестирование фонового обновления популярных ключей и паузы при ошибках"""
+    from utils.prefetch import PrefetchScheduler
+
+    calls = []
+    failing = False
+
+    async def loader(key):
+        calls.append(key)
+        if failing:
+            raise Exception("upstream down")
+        return f"value-{key}-{len(calls)}"
+
+    scheduler = PrefetchScheduler(interval=60, top_n=1)
+    scheduler.register("src", loader, ttl=30)
+
+    for _ in range(3):
+        await scheduler.get("src", "popular")
+    await scheduler.get("src", "rare")
+    assert calls == ["popular", "rare"]
+    assert scheduler.popular_keys() == [("src", "popular")]
+
+    # TTL меньше интервала: популярный ключ обновляется заранее, редкий - нет
+    await scheduler.refresh()
+    assert calls == ["popular", "rare", "popular"]
+    assert await scheduler.get("src", "popular") == "value-popular-3"
+
+    failing = True
+    scheduler.store.clear()
+    await scheduler.refresh()
+    await scheduler.refresh()
+    assert calls.count("popular") == 3
+    assert scheduler.get_stats()["refresh_errors"] == 1
+
+def test_forecast_index_uses_city_timezone():
+    """Тестирование разбора прогноза по местным датам города"""
+    from datetime import datetime, timezone
+    from plugins.weather_data import build_forecast_index
+
+    start = int(datetime(2024, 1, 1, 18, 0, tzinfo=timezone.utc).timestamp())
+    data = {
+        "city": {"name": "Новосибирск", "timezone": 7 * 3600},
+        "list": [
+            {"dt": start + i * 3 * 3600, "main": {"temp": float(i)},
+             "weather": [{"description": "ясно"}], "wind": {"speed": 1}}
+            for i in range(8)
+        ]
+    }
+    forecast = build_forecast_index(data)
+
+    # 18:00 UTC - это уже 01:00 следующего дня в Новосибирске
+    assert forecast.dates == ["2024-01-02"]
+    day = forecast.day(0, now=datetime(2024, 1, 1, 20, 0, tzinfo=timezone.utc))
+    assert day.entries[0].time == "01:00"
+    assert (day.temp_min, day.temp_max) == (0.0, 7.0)
+    assert day.representative.temp == 4.0
+    assert forecast.day(1, now=datetime(2024, 1, 1, 20, 0, tzinfo=timezone.utc)) is None
+
+@pytest.mark.asyncio
+async def test_weather_multi_city_concurrent():
+    """Тестирование параллельного запроса погоды для нескольких городов"""
+    import time
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from plugins.weather_plugin import WeatherPlugin
+
+    temps = {"480060": 5, "499099": 12, "511196": 1, "538560": 7}  # Тверь, Самара, Пермь, Курск
+    requests = []
+
+    async def weather(request):
+        requests.append(dict(request.query))
+        await asyncio.sleep(0.2)
+        if "q" in request.query:
+            # Города вне справочника API ищет по названию
+            if request.query["q"] == "без id":
+                return web.json_response({"name": "без id"})
+            if request.query["q"] not in ("курск", "kursk"):
+                raise web.HTTPNotFound(text='{"cod": "404", "message": "city not found"}')
+            city = "538560"
+        else:
+            city = request.query["id"]
+        return web.json_response({
+            "id": int(city), "name": "Курск" if city == "538560" else city, "sys": {"country": "RU"},
+            "main": {"temp": temps[city]}, "weather": [{"description": "ясно"}], "wind": {"speed": 3}
+        })
+
+    app = web.Application()
+    app.router.add_get("/weather", weather)
+
+    async with TestServer(app) as server:
+        plugin = WeatherPlugin()
+        plugin.api_key = "test"
+        plugin.use_mock_data = False
+        plugin.base_url = str(server.make_url("")).rstrip("/")
+
+        cities = plugin._parse_city_list("Тверь,  Самара , пермь, тверь")
+        assert cities == ["Тверь", "Самара", "пермь"]
+
+        started = time.perf_counter()
+        results = await plugin._get_cities_weather(cities)
+        # Запросы идут параллельно: время близко к одному запросу, а не к сумме
+        assert time.perf_counter() - started < 0.5
+
+        message = plugin._format_cities_comparison(results)
+        assert "Теплее всего: Самара" in message
+        assert "Холоднее всего: пермь" in message
+
+        # Неизвестное справочнику название проверяется по API и запоминается,
+        # а не найденные названия экранируются для Markdown
+        assert plugin.cities.resolve("Курск") is None
+        update = Mock()
+        update.message.reply_text = AsyncMock()
+        await plugin._show_cities_comparison(update, ["Тверь", "курск", "abc_def*"])
+        response = update.message.reply_text.await_args.args[0]
+        assert "Курск" in response and "Не найдены: abc\\_def\\*" in response
+        assert plugin.cities.resolve("курск").id == 538560
+        # Ответ поиска по названию переиспользуется: запроса по id для Курска нет
+        assert not any(r.get("id") == "538560" for r in requests)
+
+        # Другое написание известного города не раздувает справочник,
+        # а ответ без id означает, что город не найден
+        names = len(plugin.cities._names)
+        assert (await plugin._find_city("kursk")).id == 538560
+        assert len(plugin.cities._names) == names
+        assert await plugin._find_city("без id") is None
+
+        await plugin.shutdown(None)
+
+def test_city_index_resolve_and_suggest():
+    """Тестирование локального справочника городов"""
+    from plugins.weather_data import load_city_index
+
+    cities = load_city_index()
+    moscow = cities.resolve("Москва")
+    assert moscow.id == 524901
+    for name in ["moscow", "  МОСКВА ", "moskva", "мск"]:
+        assert cities.resolve(name) == moscow
+    assert cities.resolve("санкт петербург") == cities.resolve("Питер")
+
+    # Опечатки не находятся точно, но дают подсказки
+    assert cities.resolve("Казнь") is None
+    assert [city.name for city in cities.suggest("Казнь")] == ["Казань"]
+    assert cities.suggest("абырвалг") == []
+
+def test_currency_rate_table_and_converter():
+    """Тестирование таблицы курсов, кросс-курсов и разбора запросов конвертера"""
+    from plugins.currency_data import build_rate_table, parse_conversion
+
+    table = build_rate_table({
+        "Date": "2024-01-10T11:30:00+03:00",
+        "Valute": {
+            "USD": {"Value": 90.0, "Nominal": 1, "Previous": 89.0, "Name": "Доллар США"},
+            "EUR": {"Value": 100.0, "Nominal": 1, "Previous": 100.0, "Name": "Евро"},
+            "JPY": {"Value": 60.0, "Nominal": 100, "Previous": 61.0, "Name": "Иен"}
+        }
+    })
+    assert table.date == "2024-01-10"
+    assert table.rate("JPY") == pytest.approx(0.6)
+    assert table.convert(100, "USD", "EUR") == pytest.approx(90.0)
+    assert table.convert(1000, "RUB", "USD") == pytest.approx(1000 / 90)
+    assert table.change("USD") == pytest.approx((1.0, 100 / 89))
+
+    assert parse_conversion("100 usd в eur") == (100.0, "USD", "EUR")
+    assert parse_conversion("1 000,5 рублей to $") == (1000.5, "RUB", "USD")
+    assert parse_conversion("привет, как дела") is None
+    # Свободный текст, начинающийся с числа, не считается запросом конвертации
+    for text in ["5 top ten", "100 lol kek", "3 причины уйти", "2 usd"]:
+        assert parse_conversion(text) is None
+    assert parse_conversion("50 CHF to jpy") == (50.0, "CHF", "JPY")
+
+    from plugins.currency_data import CONVERSION_RE
+    from utils.router import UpdateRouter
+
+    routes = UpdateRouter()
+    convert, fallback = AsyncMock(), AsyncMock()
+    routes.add_pattern(CONVERSION_RE, convert)
+    routes.set_fallback(fallback)
+    assert routes.resolve("100 lol kek") == (fallback, None)
+    assert routes.resolve("100 usd в eur") == (convert, None)
+
+    calls = []
+    render = lambda rates: calls.append(1) or "text"
+    assert table.view("fiat", render) == table.view("fiat", render) == "text"
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_currency_history_backfill_and_summary(tmp_path, monkeypatch):
+    """Тестирование догрузки архива курсов и исторических сводок"""
+    from datetime import date
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from plugins.currency_history import RateHistory
+
+    requested = []
+
+    async def archive(request):
+        day = date(int(request.match_info["y"]), int(request.match_info["m"]), int(request.match_info["d"]))
+        requested.append(day)
+        if day.weekday() >= 5:
+            raise web.HTTPNotFound()
+        value = 90.0 + day.day
+        return web.json_response({
+            "Date": f"{day.isoformat()}T11:30:00+03:00",
+            "Valute": {"USD": {"Value": value, "Nominal": 1, "Previous": value - 1, "Name": "Доллар США"}}
+        })
+
+    app = web.Application()
+    app.router.add_get("/archive/{y}/{m}/{d}/daily_json.js", archive)
+
+    async with TestServer(app) as server:
+        url = str(server.make_url("")).rstrip("/") + "/archive/{date:%Y/%m/%d}/daily_json.js"
+        history = RateHistory(str(tmp_path / "history.db"), archive_url=url)
+
+        # 2024-01-01..2024-01-14: 10 рабочих дней и 4 выходных
+        assert await history.backfill(14, today=date(2024, 1, 14)) == 10
+        assert len(requested) == 14
+        # Повторная догрузка не запрашивает уже известные даты, включая выходные;
+        # последние два дня не отмечены как пустые: архив за них мог еще не выйти
+        assert await history.backfill(14, today=date(2024, 1, 14)) == 0
+        assert sorted(requested[14:]) == [date(2024, 1, 13), date(2024, 1, 14)]
+        assert "2024-01-07" in history.known_days() and "2024-01-14" not in history.known_days()
+
+    assert history.version == "2024-01-12"
+    week = history.summary("USD", 7)
+    assert week["start"] == "2024-01-05" and week["end"] == "2024-01-12"
+    assert week["change"] == pytest.approx(7.0)
+    assert week["min_date"] == "2024-01-05" and week["max"] == pytest.approx(102.0)
+    # Среднее за 7 календарных дней (06.01-12.01), а не за 7 последних точек
+    assert week["average"] == pytest.approx(sum(90.0 + day for day in (8, 9, 10, 11, 12)) / 5)
+    assert history.summary("EUR", 7) is None
+
+    # Плагин открывает историю по CURRENCY_HISTORY_DB и считает сводку вне event loop
+    from plugins.currency_plugin import CurrencyPlugin
+
+    monkeypatch.setenv("CURRENCY_HISTORY_DB", str(tmp_path / "plugin.db"))
+    plugin = CurrencyPlugin()
+    assert plugin.history.path == str(tmp_path / "plugin.db")
+    plugin.history = history
+    update = Mock()
+    update.message.reply_text = AsyncMock()
+    await plugin._show_history(update)
+    assert "среднее за 7 дней: 100.00 ₽" in update.message.reply_text.await_args.args[0]
+
+@pytest.mark.asyncio
+async def test_conditional_fetch_reuses_parsed_value():
+    """Тестирование условных запросов: на 304 возвращается уже разобранный объект"""
+    import aiohttp
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from utils.conditional_fetch import ConditionalFetcher
+
+    async def daily(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({"Date": "2024-01-10"}, headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/daily_json.js", daily)
+
+    parsed, touched = [], []
+    parse = lambda data: parsed.append(data) or {"parsed": data["Date"]}
+    fetcher = ConditionalFetcher()
+
+    async with TestServer(app) as server, aiohttp.ClientSession() as session:
+        url = str(server.make_url("/daily_json.js"))
+        first = await fetcher.get(session, url, parse, touch=touched.append)
+        second = await fetcher.get(session, url, parse, touch=touched.append)
+
+    assert first is second
+    assert len(parsed) == 1
+    # Подтвержденный 304 объект получает обновленные метаданные
+    assert touched == [first]
+    assert fetcher.get_stats()["not_modified"] == 1
+
+@pytest.mark.asyncio
+async def test_router_loads_plugin_on_first_matching_message(tmp_path):
+    """Тестирование маршрутизатора и ленивой загрузки плагина по манифесту"""
+    from plugins.init import PluginManager
+    from utils.router import UpdateRouter, router
+
+    # Таблица маршрутов: кнопка -> команда -> шаблон -> ожидаемый ввод -> fallback
+    routes = UpdateRouter()
+    button, command, pattern, city, fallback = (AsyncMock() for _ in range(5))
+    routes.add_button("❓ Помощь", button)
+    routes.add_command("weather", command)
+    routes.add_pattern(r"^\d+ usd$", pattern)
+    routes.set_fallback(fallback)
+    routes.expect_input(42, city)
+    assert routes.resolve("❓ Помощь", 42) == (button, None)
+    assert routes.resolve("/weather@test_bot Москва, Казань") == (command, ["Москва,", "Казань"])
+    assert routes.resolve("/unknown") == (None, None)
+    assert routes.resolve("100 USD") == (fallback, None)
+    assert routes.resolve("100 usd", 42) == (pattern, None)
+    assert routes.resolve("Казань", 42) == (city, None)
+    assert routes.resolve("Казань", 7) == (fallback, None)
+
+    # Ленивая загрузка: те же плагины, помеченные в манифесте как "lazy": true
+    from plugins.init import DEFAULT_MANIFEST_PATH
+
+    with open(DEFAULT_MANIFEST_PATH, encoding="utf-8") as file:
+        manifest = [dict(entry, lazy=True) for entry in json.load(file)]
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+
+    application = Mock(running=False)
+    manager = PluginManager()
+    assert manager.discover(str(manifest_path)) == ["weather", "currency"]
+    manager.setup_plugins(application)
+    assert manager.get_plugin("weather") is None
+
+    update = Mock()
+    update.effective_user.id = 1
+    update.message.text = "🌤️ Погода"
+    update.message.reply_text = AsyncMock()
+    await router.dispatch(update, Mock())
+
+    # Плагин загружен первым подходящим сообщением и сразу его обработал
+    weather = manager.get_plugin("weather")
+    assert type(weather).__name__ == "WeatherPlugin"
+    assert router.buttons["🌤️ Погода"] == weather.handle_weather_messages
+    update.message.reply_text.assert_awaited_once()
+    assert manager.get_plugin("currency") is None
+
+@pytest.mark.asyncio
+async def test_plugins_with_background_work_start_eagerly(tmp_path, monkeypatch):
+    """Источники prefetcher и прогрев кеша доступны сразу после запуска, а не после первого сообщения"""
+    from plugins.init import PluginManager
+    from utils.prefetch import prefetcher
+
+    monkeypatch.setenv("CURRENCY_HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setenv("CURRENCY_HISTORY_DAYS", "0")
+    monkeypatch.setattr(prefetcher, "_sources", {})
+
+    application = Mock(running=False)
+    manager = PluginManager()
+    manager.discover()
+    manager.setup_plugins(application)
+    assert {"weather", "forecast", "cbr"} <= set(prefetcher._sources)
+
+    weather = manager.get_plugin("weather")
+    weather.use_mock_data = False
+    with patch.object(type(weather), "prewarm", AsyncMock()) as prewarm:
+        await manager.startup_plugins(application)
+        await asyncio.sleep(0)
+    prewarm.assert_awaited_once()
+    await manager.shutdown_plugins(application)
+
+@pytest.mark.asyncio
+async def test_router_drops_pending_input_on_menu_navigation():
+    """Ожидание ввода города снимается кнопкой «Назад» и командами и истекает само"""
+    from utils.router import UpdateRouter
+
+    routes = UpdateRouter(max_inputs=2)
+    back, help_command, city, fallback = (AsyncMock() for _ in range(4))
+    routes.add_button("◀️ Назад", back)
+    routes.add_command("help", help_command)
+    routes.set_fallback(fallback)
+
+    def update(text):
+        message = Mock()
+        message.effective_user.id = 42
+        message.message.text = text
+        return message
+
+    routes.expect_input(42, city)
+    await routes.dispatch(update("◀️ Назад"), Mock())
+    await routes.dispatch(update("Как дела?"), Mock())
+    city.assert_not_awaited()
+    fallback.assert_awaited_once()
+
+    routes.expect_input(42, city)
+    await routes.dispatch(update("/help"), Mock())
+    assert not routes.is_expecting_input(42)
+    assert routes.is_free_text("Как дела?", 42)
+
+    # Брошенные ожидания ограничены по числу и по времени
+    for user_id in (1, 2, 3):
+        routes.expect_input(user_id, city)
+    assert not routes.is_expecting_input(1) and routes.is_expecting_input(3)
+    routes.input_ttl = 0
+    routes.expect_input(4, city)
+    assert routes.resolve("Казань", 4) == (fallback, None)
+
+@pytest.mark.asyncio
+async def test_user_state_bounded_and_persistent(tmp_path):
+    """Тестирование ограниченного состояния пользователей плагинов"""
+    import threading
+    from utils.user_state import SQLiteStateBackend, UserStateStore
+
+    store = UserStateStore("weather", maxsize=2, ttl=100)
+    assert await store.get(1) == {} and len(store) == 0  # чтение не создает запись
+    await store.set(1, {"city": "Москва"}, now=0)
+    await store.set(2, {"city": "Казань"}, now=0)
+    await store.get(1, now=1)
+    await store.set(3, {"city": "Сочи"}, now=2)
+    # Вытеснен давно не использовавшийся пользователь 2
+    assert len(store) == 2 and await store.get(2, now=3) == {}
+    assert await store.get(1, now=150) == {}  # истек срок жизни
+
+    backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+    await UserStateStore("weather", backend=backend).set(7, {"city": "Казань"})
+    await UserStateStore("currency", backend=backend).set(7, {"base": "USD"})
+
+    # Новый экземпляр (после перезапуска) читает состояние из своего пространства имен
+    restored = UserStateStore("weather", backend=backend)
+    assert await restored.get(7) == {"city": "Казань"}
+    await restored.set(7, {})
+    assert await UserStateStore("weather", backend=backend).get(7) == {}
+    assert await UserStateStore("currency", backend=backend).get(7) == {"base": "USD"}
+
+    # Запросы к SQLite выполняются в потоке хранилища, а не в потоке event loop
+    threads = []
+    save = backend.save
+    backend.save = lambda *args: threads.append(threading.current_thread().name) or save(*args)
+    await restored.set(8, {"city": "Сочи"})
+    assert threads and threads[0].startswith("user-state")
+
+def test_prebuilt_keyboards_are_shared():
+    """Тестирование заранее собранных клавиатур и текстов"""
+    from telegram import KeyboardButton, ReplyKeyboardMarkup
+    from utils import ui
+
+    fresh = ReplyKeyboardMarkup([[KeyboardButton("📋 Пересказ"), KeyboardButton("🔑 Ключевые пункты")],
+                                 [KeyboardButton("📊 Подробный анализ"), KeyboardButton("❓ Вопросы и ответы")],
+                                 [KeyboardButton("🧩 Все виды анализа")],
+                                 [KeyboardButton("◀️ Назад")]], resize_keyboard=True)
+    assert ui.FILE_ANALYSIS_MENU.to_dict() == fresh.to_dict()
+    assert json.loads(ui.FILE_ANALYSIS_MENU.to_json()) == fresh.to_dict()
+    # Словарь не пересобирается при каждой отправке
+    assert ui.FILE_ANALYSIS_MENU.to_dict() is ui.FILE_ANALYSIS_MENU.to_dict()
+    assert ui.main_menu(True) is ui.MAIN_MENU
+
+    assert ui.help_text(True) is ui.help_text(True)
+    assert "/weather" in ui.help_text(True) and "/weather" not in ui.help_text(False)
+    assert ui.greeting("Аня", False).startswith("\nПривет, Аня! 👋\n")
+
+def test_response_cache_exact_and_similar():
+    """Кеш ответов: точное совпадение, похожий вопрос, TTL и другой системный промпт"""
+    from utils.response_cache import ResponseCache
+
+    cache = ResponseCache(maxsize=2, ttl=60, similarity=0.8)
+    cache.set("system", "Что такое Python?", "Язык программирования", now=0)
+
+    assert cache.get("system", "  что такое   PYTHON ", now=1) == "Язык программирования"
+    assert cache.get("system", "Что такое python??", now=1) == "Язык программирования"
+    assert cache.get("system", "Что такое Pyton?", now=1) == "Язык программирования"
+    assert cache.get("other system", "Что такое Python?", now=1) is None
+    assert cache.get("system", "Как приготовить борщ?", now=1) is None
+    assert cache.get("system", "Что такое Python?", now=61) is None
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 2 and stats["semantic_hits"] == 1 and stats["misses"] == 3
+    assert len(cache) == 0
+
+    for i in range(3):
+        cache.set("system", f"вопрос номер {i}", str(i), now=0)
+    assert len(cache) == 2
+    assert cache.get("system", "вопрос номер 0", now=1) != "0"
+
+    # Строки матрицы помечены id системного промпта; вытесненные строки освобождаются
+    cache.set("other system", "Что такое Python?", "Змея", now=0)
+    assert sorted(cache._slot_systems.tolist()) == [0, 1]
+    assert cache.get("other system", "Что такое Pyton?", now=1) == "Змея"
+    assert cache.get("system", "Что такое Pyton?", now=1) is None
+    cache.clear()
+    assert (cache._slot_systems == -1).all()
+
+    # Если ближайший похожий вопрос устарел, берется следующий выше порога
+    cache = ResponseCache(maxsize=2, ttl=60, similarity=0.7)
+    cache.set("system", "Что такое Python?", "старый", now=0)
+    cache.set("system", "Что такое Python 3?", "новый", now=30)
+    assert cache.get("system", "Что такое Pyton?", now=70) == "новый"
+    assert len(cache) == 1
+
+    # Кеш нулевого размера просто выключен
+    empty = ResponseCache(maxsize=0, similarity=0.8)
+    empty.set("system", "Что такое Python?", "ответ")
+    assert not empty.enabled and empty.get("system", "Что такое Python?") is None
+
+
+@pytest.mark.asyncio
+async def test_analysis_orchestrator_sends_document_once():
+    """Несколько видов анализа: документ отправляется в AI одним запросом, результаты запоминаются"""
+    from utils.document_analysis import AnalysisOrchestrator
+
+    calls = []
+
+    async def generate(messages, **options):
+        calls.append((messages, options))
+        if options.get("response_format"):
+            return json.dumps({"summary": "Кратко", "qa": "Вопросы"}, ensure_ascii=False)
+        return "Ключевые пункты"
+
+    orchestrator = AnalysisOrchestrator(generate)
+    text = "Первый абзац.\n\n\nВторой   абзац."
+
+    results = await orchestrator.analyze(text, ["summary", "qa", "key_points"])
+    assert results == {"summary": "Кратко", "qa": "Вопросы", "key_points": "Ключевые пункты"}
+    # Один объединенный запрос; key_points не разобран из JSON и выполнен отдельно
+    assert len(calls) == 2
+    assert "Первый абзац.\n\nВторой абзац." in calls[0][0][1]["content"]
+
+    # Повторный запрос не обращается к AI
+    assert await orchestrator.analyze(text, ["qa", "summary"]) == {"qa": "Вопросы", "summary": "Кратко"}
+    assert len(calls) == 2
+
+
+def test_prompt_prefixes_are_stable():
+    """Запросы к AI: одинаковое начало между ходами диалога и видами анализа"""
+    from utils.context_manager import UserContext
+    from utils.prompts import analysis_messages, chat_messages, history_window, ANALYSIS_PROMPTS
+
+    def dump(messages):
+        return json.dumps(messages, ensure_ascii=False)
+
+    context = UserContext(user_id=1)
+    requests = []
+    for turn in range(12):
+        context.add_message("user", f"вопрос {turn}")
+        requests.append(dump(chat_messages(history_window(context.messages, context.message_count))))
+        context.add_message("assistant", f"ответ {turn}")
+
+    # Соседние ходы в пределах одного блока истории продолжают предыдущий запрос
+    prefixes = sum(1 for prev, cur in zip(requests, requests[1:]) if cur.startswith(prev[:-1]))
+    assert prefixes >= len(requests) // 2
+    window = history_window(context.messages, context.message_count)
+    assert 7 <= len(window) <= 10 and window[-1]["content"] == "ответ 11"
+
+    summary = dump(analysis_messages("документ", ANALYSIS_PROMPTS["summary"]))
+    qa = dump(analysis_messages("документ", ANALYSIS_PROMPTS["qa"]))
+    common = len(dump(analysis_messages("документ", "")).rstrip('"}]'))
+    assert summary[:common] == qa[:common]
+
+
+@pytest.mark.asyncio
+async def test_message_pipeline_stages_and_timings():
+    """Конвейер сообщений: порядок этапов, остановка, ошибки и время этапов"""
+    from utils.pipeline import MessageJob, MessagePipeline
+
+    seen = []
+
+    async def ingest(job):
+        seen.append("ingest")
+        job.text = job.update
+
+    async def check(job):
+        seen.append("check")
+        if job.text == "стоп":
+            job.finish()
+        elif job.text == "ошибка":
+            raise ValueError("сбой")
+
+    async def send(job):
+        seen.append("send")
+
+    errors = []
+
+    async def on_error(job, stage, error):
+        errors.append((job.source, stage, str(error)))
+
+    pipeline = MessagePipeline([("ingest", ingest), ("check", check), ("send", send)], on_error=on_error)
+
+    job = await pipeline.run(MessageJob("привет", None, "text"))
+    assert seen == ["ingest", "check", "send"]
+    assert set(job.timings) == {"ingest", "check", "send"}
+
+    seen.clear()
+    await pipeline.run(MessageJob("стоп", None, "voice"))
+    assert seen == ["ingest", "check"]
+
+    await pipeline.run(MessageJob("ошибка", None, "photo"))
+    assert errors == [("photo", "check", "сбой")]
+
+    stats = pipeline.get_stats()
+    assert stats["check"]["count"] == 3 and stats["check"]["errors"] == 1
+    assert stats["send"]["count"] == 1
+
+
+def test_metrics_registry_prometheus_format():
+    """Метрики: формат Prometheus и отсутствие записи при выключенном реестре"""
+    from utils.metrics import MetricsRegistry
+
+    registry = MetricsRegistry(enabled=True)
+    latency = registry.histogram("test_seconds", "Test latency", ("stage",), buckets=(0.1, 1.0))
+    blocked = registry.counter("test_blocked_total", "Blocked", ("category",))
+    registry.register_callback("test_queue_depth", "Queue", lambda: [(("updates",), 7)], ("queue",))
+
+    latency.observe(0.05, "filter")
+    latency.observe(0.5, "filter")
+    blocked.inc('спам "реклама"')
+
+    text = registry.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{stage="filter",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="filter",le="+Inf"} 2' in text
+    assert 'test_seconds_count{stage="filter"} 2' in text
+    assert 'test_blocked_total{category="спам \\"реклама\\""} 1.0' in text
+    assert 'test_queue_depth{queue="updates"} 7' in text
+
+    disabled = MetricsRegistry(enabled=False)
+    histogram = disabled.histogram("off_seconds", "Off")
+    with disabled.time(histogram):
+        pass
+    assert "off_seconds_count" not in disabled.render()
+
+
+@pytest.mark.asyncio
+async def test_loop_stall_monitor_and_profiler(tmp_path):
+    """Диагностика: стек блокирующего кода, свернутые стеки профилировщика и медленные обновления"""
+    import time
+    from utils.pipeline import MessageJob, MessagePipeline
+    from utils.profiler import LoopStallMonitor, SamplingProfiler
+
+    def blocking_handler():
+        time.sleep(0.3)
+
+    monitor = LoopStallMonitor(threshold=0.1, interval=0.02)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    blocking_handler()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    assert monitor.stalls == 1
+    assert "blocking_handler" in monitor.recent[0]["stack"]
+
+    profiler = SamplingProfiler(output_dir=str(tmp_path), interval=0.005)
+    task = asyncio.create_task(profiler.profile(0.2))
+    await asyncio.sleep(0.05)
+    blocking_handler()
+    path = await task
+    lines = open(path, encoding="utf-8").read().splitlines()
+    assert any("blocking_handler" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    async def slow_stage(job):
+        await asyncio.sleep(0.02)
+
+    pipeline = MessagePipeline([("ai", slow_stage)], slo={"text": 0.01})
+    await pipeline.run(MessageJob(None, None, "text"))
+    await pipeline.run(MessageJob(None, None, "voice"))
+    assert len(pipeline.slow_updates) == 1
+    assert pipeline.slow_updates[0]["source"] == "text" and "ai" in pipeline.slow_updates[0]["stages"]
+
+
+def test_async_json_logging_with_redaction_and_sampling():
+    """Логирование: JSON в отдельном потоке, удаление персональных данных и прореживание"""
+    import io
+    import logging
+    from utils.log_setup import setup_logging, stop_logging
+
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    try:
+        setup_logging(json_output=True, sampling={"Received message from %s: %s": 0.25}, stream=stream)
+        log = logging.getLogger("test.pipeline")
+        log.info("Received message from %s: %s", 1, "пишите на user@example.com или +7 (912) 345-67-89")
+        for i in range(7):
+            log.info("Received message from %s: %s", 2, f"сообщение {i}")
+        # Поля extra копируются при постановке в очередь: поздние изменения не попадают в запись
+        timings = {"ai": 0.5}
+        log.info("Sent response to %s", 1, extra={"timings": timings})
+        timings["send"] = 0.1
+        log.warning("Text blocked: %s", "спам", extra={"user_id": 1})
+        stop_logging()
+    finally:
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    received = [entry for entry in entries if entry["msg"].startswith("Received")]
+    assert len(received) == 2 and all(entry["sampled"] == 4 for entry in received)
+    assert "user@example.com" not in received[0]["msg"] and "<email>" in received[0]["msg"]
+    assert "<phone>" in received[0]["msg"]
+    assert entries[-2]["timings"] == {"ai": 0.5}
+    assert entries[-1]["level"] == "WARNING" and entries[-1]["user_id"] == 1
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
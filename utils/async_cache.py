@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import logging
+
+from utils.lru_cache import MISSING
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTTLCache:
+    """Кеш результатов асинхронных запросов с временем жизни и объединением запросов
+
+    Пока данные по ключу загружаются, все остальные запросы того же ключа
+    ждут ту же загрузку, а не идут в API повторно.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # ключ -> (истекает, значение)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable, default: Any = None, now: Optional[float] = None) -> Any:
+        """Свежее значение из кеша без загрузки"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= (time.monotonic() if now is None else now):
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """Сохранить значение на ttl секунд"""
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def expires_in(self, key: Hashable) -> float:
+        """Сколько секунд осталось жить значению (0, если его нет)"""
+        entry = self._data.get(key)
+        return max(0.0, entry[0] - time.monotonic()) if entry else 0.0
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        """Значение из кеша, а при его отсутствии - единственная загрузка на все одновременные запросы"""
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; без них future не должен ругаться в лог
+            future.exception()
+            raise
+        else:
+            self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        """Очистить кеш"""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> dict:
+        """Получить статистику кеша"""
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0
+        }
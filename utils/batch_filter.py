@@ -0,0 +1,150 @@
+"""Пакетная проверка текстов теми же правилами, что и у бота
+
+Использование из командной строки:
+
+    python -m utils.batch_filter export.jsonl --field text --workers 4 > verdicts.jsonl
+    python -m utils.batch_filter requests.jsonl --field body --id-field request_id --blocked-only
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+import logging
+
+from utils.text_filter import CompiledRules, FilterVerdict, text_filter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Набор правил процесса-исполнителя (передается один раз при запуске пула)
+_worker_rules: Optional[CompiledRules] = None
+
+
+def _init_worker(rules: CompiledRules):
+    """Инициализация процесса пула: сохранить присланный набор правил"""
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _scan_chunk(chunk: List[Tuple[int, str]]) -> List[FilterVerdict]:
+    """Проверить пачку сообщений в процессе пула"""
+    return [text_filter.scan(text, index, _worker_rules) for index, text in chunk]
+
+
+def _chunks(texts: Iterable[str], chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    """Ленивое разбиение потока на пачки с сохранением исходных номеров"""
+    numbered = enumerate(texts)
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def scan_iter(texts: Iterable[str], workers: Optional[int] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[FilterVerdict]:
+    """Потоковая проверка: вердикты выдаются по мере готовности в исходном порядке
+
+    Вход читается пачками, и в работе одновременно держится не больше
+    двух пачек на процесс, поэтому память не растет с размером входа.
+    При workers=1 проверка идет в текущем процессе без пула.
+    """
+    workers = workers or os.cpu_count() or 1
+    rules = text_filter._rules
+
+    if workers == 1:
+        for index, text in enumerate(texts):
+            yield text_filter.scan(text, index, rules)
+        return
+
+    chunks = _chunks(texts, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules,)) as executor:
+        pending = deque(executor.submit(_scan_chunk, chunk) for chunk in itertools.islice(chunks, workers * 2))
+        while pending:
+            verdicts = pending.popleft().result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                pending.append(executor.submit(_scan_chunk, next_chunk))
+            yield from verdicts
+
+
+def filter_batch(texts: Iterable[str], workers: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[FilterVerdict]:
+    """Проверить набор текстов и вернуть вердикты списком"""
+    return list(scan_iter(texts, workers, chunk_size))
+
+
+def _read_jsonl(file, field: str, id_field: Optional[str], ids: dict) -> Iterator[str]:
+    """Тексты из JSONL: строка-объект (берется поле field) или просто строка
+
+    Идентификаторы складываются в ids по номеру текста и забираются
+    оттуда при выводе вердикта.
+    """
+    index = 0
+    for line_number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Line {line_number}: invalid JSON skipped ({e})")
+            continue
+
+        if id_field:
+            ids[index] = record.get(id_field) if isinstance(record, dict) else None
+        index += 1
+        yield str(record.get(field) or "") if isinstance(record, dict) else str(record)
+
+
+def main(argv: Optional[List[str]] = None):
+    """CLI: проверка JSONL-файла, вердикты в JSONL на stdout, сводка в stderr"""
+    parser = argparse.ArgumentParser(description="Пакетная проверка текстов фильтром бота")
+    parser.add_argument("input", help="JSONL файл ('-' для stdin)")
+    parser.add_argument("--field", default="text", help="поле с текстом (по умолчанию text)")
+    parser.add_argument("--id-field", help="поле-идентификатор, копируемое в вердикт")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="размер пачки для процесса")
+    parser.add_argument("--blocked-only", action="store_true", help="выводить только заблокированные")
+    args = parser.parse_args(argv)
+
+    ids: dict = {}
+    categories = Counter()
+    started = time.perf_counter()
+    total = 0
+
+    file = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        texts = _read_jsonl(file, args.field, args.id_field, ids)
+        for verdict in scan_iter(texts, args.workers, args.chunk_size):
+            total += 1
+            record_id = ids.pop(verdict.index, None)
+            if verdict.blocked:
+                categories[verdict.category] += 1
+            elif args.blocked_only:
+                continue
+
+            record = verdict.to_dict()
+            if args.id_field:
+                record[args.id_field] = record_id
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+    elapsed = time.perf_counter() - started
+    blocked = sum(categories.values())
+    rate = total / elapsed * 3600 if elapsed else 0
+    print(f"Проверено: {total}, заблокировано: {blocked} за {elapsed:.2f} с ({rate:,.0f} сообщений/час)", file=sys.stderr)
+    for category, count in categories.most_common():
+        print(f"  {category}: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+import logging
+
+import aiohttp
+
+from utils.lru_cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+
+class Validated(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    value: Any  # уже разобранный ответ
+
+
+class ConditionalFetcher:
+    """Условные GET-запросы (If-None-Match / If-Modified-Since) к внешним API
+
+    Для каждого запроса запоминаются валидаторы ответа вместе с разобранным
+    значением. Если источник отвечает 304, возвращается тот же разобранный
+    объект: тело не скачивается и не разбирается повторно, а вызывающий код
+    (теплое хранилище) просто продлевает срок его жизни. Метаданные объекта,
+    которые должны отражать подтверждение (время обновления и т.п.),
+    освежает необязательный обработчик touch.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._validated = LRUCache(maxsize=maxsize)
+        self.full = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def _key(url: str, params: Optional[dict]) -> Hashable:
+        return (url, tuple(sorted(params.items())) if params else ())
+
+    async def get(self, session: aiohttp.ClientSession, url: str, parse: Callable[[Any], Any] = lambda data: data,
+                  params: Optional[dict] = None, error: str = "API error",
+                  touch: Optional[Callable[[Any], None]] = None) -> Any:
+        """Разобранный ответ GET-запроса; при ошибке выбрасывает исключение
+
+        touch вызывается с сохраненным объектом, когда источник ответил 304.
+        """
+        key = self._key(url, params)
+        cached = self._validated.get(key, MISSING)
+
+        headers = {}
+        if cached is not MISSING:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        async with session.get(url, params=params, headers=headers) as response:
+            if response.status == 304 and cached is not MISSING:
+                self.not_modified += 1
+                logger.info("Not modified: %s", url)
+                if touch is not None:
+                    touch(cached.value)
+                return cached.value
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"{error}: {response.status} - {error_text}")
+            # Часть API отдает JSON с типом application/javascript
+            data = await response.json(content_type=None)
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        self.full += 1
+        value = parse(data)
+        if etag or last_modified:
+            self._validated.set(key, Validated(etag, last_modified, value))
+        return value
+
+    def get_stats(self) -> dict:
+        """Статистика условных запросов"""
+        total = self.full + self.not_modified
+        return {
+            "validated": len(self._validated),
+            "full": self.full,
+            "not_modified": self.not_modified,
+            "not_modified_rate": self.not_modified / total if total else 0.0
+        }
@@ -15,6 +15,7 @@ class UserContext:
     last_activity: float = None
     current_file_text: str = None
     current_file_type: str = None
+    message_count: int = 0  # сообщений в диалоге всего, включая вытесненные из истории
 
     def __post_init__(self):
         if self.messages is None:
@@ -32,6 +33,7 @@ class UserContext:
             "timestamp": time.time()
         })
         self.last_activity = time.time()
+        self.message_count += 1
 
         if len(self.messages) > 20:
             self.messages = self.messages[-20:]
@@ -47,6 +49,7 @@ class UserContext:
     def reset(self):
         """Сбросить контекст"""
         self.messages = []
+        self.message_count = 0
         self.current_file_text = None
         self.current_file_type = None
         self.last_activity = time.time()
@@ -0,0 +1,156 @@
+import re
+import json
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, NamedTuple, Sequence
+import logging
+
+from utils.lru_cache import LRUCache, MISSING
+from utils.prompts import ANALYSIS_PROMPTS, analysis_messages
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_TITLES = {
+    "summary": "📋 Краткий пересказ",
+    "key_points": "🔑 Ключевые пункты",
+    "analysis": "📊 Подробный анализ",
+    "qa": "❓ Вопросы и ответы"
+}
+
+MAX_DOCUMENT_CHARS = 15000  # Ограничиваем длину текста, отправляемого в AI
+MAX_TOKENS_PER_ANALYSIS = 2000
+MAX_COMBINED_TOKENS = 8000
+
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+_SPACES_RE = re.compile(r'[ \t\r\f\v]+')
+
+Generate = Callable[..., Awaitable[str]]
+
+
+class PreparedDocument(NamedTuple):
+    digest: str
+    text: str  # очищенный и обрезанный текст для AI
+    chunks: int  # количество абзацев в тексте
+
+
+def prepare_document(text: str, limit: int = MAX_DOCUMENT_CHARS) -> PreparedDocument:
+    """Очистка текста документа и обрезка по границе абзаца"""
+    paragraphs = [_SPACES_RE.sub(' ', part).strip() for part in _BLANK_LINES_RE.split(text)]
+    paragraphs = [part for part in paragraphs if part]
+
+    kept, size = [], 0
+    for paragraph in paragraphs:
+        if size + len(paragraph) > limit:
+            if not kept:
+                kept.append(paragraph[:limit])
+            break
+        kept.append(paragraph)
+        size += len(paragraph) + 2
+
+    prepared = "\n\n".join(kept)
+    return PreparedDocument(hashlib.blake2b(prepared.encode('utf-8'), digest_size=16).hexdigest(), prepared, len(kept))
+
+
+class AnalysisOrchestrator:
+    """Несколько видов анализа одного документа за раз
+
+    Подготовка документа выполняется один раз и кешируется по тексту файла.
+    Если нужно больше одного вида анализа, документ отправляется в AI один раз:
+    все задания объединяются в один запрос с ответом в формате JSON. Если
+    ответ не удалось разобрать (или объединение выключено), задания
+    выполняются отдельными запросами параллельно. Готовые результаты
+    запоминаются, поэтому повторное нажатие кнопки не оплачивается заново.
+    """
+
+    def __init__(self, generate: Generate, is_error: Callable[[str], bool] = lambda response: False,
+                 combined: bool = True, maxsize: int = 256):
+        self.generate = generate
+        self.is_error = is_error  # ответ AI - сообщение об ошибке, его нельзя запоминать
+        self.combined = combined
+        self._documents = LRUCache(maxsize=maxsize)
+        self._results = LRUCache(maxsize=maxsize * len(ANALYSIS_PROMPTS))
+        self.requests = 0
+        self.combined_requests = 0
+        self.combined_failures = 0
+
+    def prepare(self, text: str) -> PreparedDocument:
+        """Подготовленный документ (один раз на текст файла)"""
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        document = self._documents.get(key, MISSING)
+        if document is MISSING:
+            document = prepare_document(text)
+            self._documents.set(key, document)
+        return document
+
+    async def analyze(self, text: str, analysis_types: Sequence[str]) -> Dict[str, str]:
+        """Результаты анализа по видам (неизвестный вид считается пересказом)"""
+        types = list(dict.fromkeys(t if t in ANALYSIS_PROMPTS else "summary" for t in analysis_types))
+        document = self.prepare(text)
+
+        results = {}
+        for analysis_type in types:
+            cached = self._results.get((document.digest, analysis_type), MISSING)
+            if cached is not MISSING:
+                results[analysis_type] = cached
+        missing = [t for t in types if t not in results]
+
+        if len(missing) > 1 and self.combined:
+            combined = await self._run_combined(document, missing)
+            results.update(combined)
+            missing = [t for t in missing if t not in combined]
+
+        if missing:
+            responses = await asyncio.gather(*(self._run_single(document, t) for t in missing))
+            results.update(zip(missing, responses))
+
+        return {t: results[t] for t in types}
+
+    def _remember(self, document: PreparedDocument, analysis_type: str, response: str):
+        if not self.is_error(response):
+            self._results.set((document.digest, analysis_type), response)
+
+    async def _run_single(self, document: PreparedDocument, analysis_type: str) -> str:
+        self.requests += 1
+        response = await self.generate(analysis_messages(document.text, ANALYSIS_PROMPTS[analysis_type]))
+        self._remember(document, analysis_type, response)
+        return response
+
+    async def _run_combined(self, document: PreparedDocument, analysis_types: Sequence[str]) -> Dict[str, str]:
+        """Все задания одним запросом; при ошибке разбора - пустой словарь"""
+        tasks = "\n".join(f'"{t}": {ANALYSIS_PROMPTS[t]}' for t in analysis_types)
+        task = (
+            f"Выполни несколько заданий по этому тексту и верни JSON-объект, где ключ - "
+            f"название задания, а значение - строка с результатом:\n{tasks}"
+        )
+        self.requests += 1
+        self.combined_requests += 1
+        response = await self.generate(
+            analysis_messages(document.text, task),
+            response_format={"type": "json_object"},
+            max_tokens=min(MAX_TOKENS_PER_ANALYSIS * len(analysis_types), MAX_COMBINED_TOKENS)
+        )
+        if self.is_error(response):
+            return {t: response for t in analysis_types}
+
+        try:
+            data = json.loads(response)
+            results = {t: data[t].strip() for t in analysis_types if isinstance(data.get(t), str) and data[t].strip()}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Combined analysis response is not valid JSON: {e}")
+            results = {}
+
+        if len(results) < len(analysis_types):
+            self.combined_failures += 1
+        for analysis_type, result in results.items():
+            self._remember(document, analysis_type, result)
+        return results
+
+    def get_stats(self) -> dict:
+        """Статистика запросов анализа"""
+        return {
+            "requests": self.requests,
+            "combined_requests": self.combined_requests,
+            "combined_failures": self.combined_failures,
+            "documents": len(self._documents),
+            "results": len(self._results)
+        }
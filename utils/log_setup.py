@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Атрибуты LogRecord, которые не относятся к полям extra=...
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sampled"}
+
+# Типы аргументов и полей extra, которые копируются перед передачей в очередь
+_MUTABLE = (dict, list, set)
+
+# Персональные данные, которые не должны попадать в логи
+_PII_PATTERNS = [
+    (re.compile(r'\b\d{6,12}:[A-Za-z0-9_-]{30,}\b'), '<token>'),  # токен Telegram-бота
+    (re.compile(r'\bsk-[A-Za-z0-9]{16,}\b'), '<api-key>'),
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'\b(?:\d[ -]?){15}\d\b'), '<card>'),
+    (re.compile(r'(?<!\w)\+?[78][\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}\b'), '<phone>'),
+]
+
+
+def redact(text: str) -> str:
+    """Скрыть токены, e-mail, номера карт и телефонов"""
+    for pattern, replacement in _PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке
+
+    Стандартный QueueHandler.prepare() форматирует сообщение сразу, то есть
+    в event loop. Здесь запись уходит в очередь как есть, а подстановка
+    аргументов, редактирование и JSON выполняются в потоке QueueListener.
+    Изменяемые аргументы и поля extra (словари, списки) копируются: к моменту
+    форматирования вызывающий код может их уже изменить.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and isinstance(value, _MUTABLE):
+                setattr(record, key, value.copy())
+        if isinstance(record.args, tuple) and any(isinstance(arg, _MUTABLE) for arg in record.args):
+            record.args = tuple(arg.copy() if isinstance(arg, _MUTABLE) else arg for arg in record.args)
+        elif isinstance(record.args, _MUTABLE):
+            record.args = record.args.copy()
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживание частых событий: из каждых N записей с одним шаблоном проходит одна
+
+    rates - доля сохраняемых записей по шаблону сообщения (record.msg) или
+    имени логгера. Ошибки (уровень выше max_level) не прореживаются. К
+    прошедшей записи добавляется поле sampled (вес записи), чтобы по логам
+    можно было восстановить общее количество.
+    """
+
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.WARNING):
+        super().__init__()
+        self.rates = rates
+        self.max_level = max_level
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = record.msg if record.msg in self.rates else record.name
+        rate = self.rates.get(key)
+        if rate is None or rate >= 1:
+            return True
+        every = max(1, round(1 / rate)) if rate > 0 else 0
+        if not every:
+            return False
+        with self._lock:
+            count = self._counters.get(key, 0)
+            self._counters[key] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class RedactingFilter(logging.Filter):
+    """Подстановка аргументов и удаление персональных данных (в потоке записи логов)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        for key, value in list(vars(record).items()):
+            if key not in _RECORD_FIELDS and isinstance(value, str):
+                setattr(record, key, redact(value))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if getattr(record, "sampled", None):
+            entry["sampled"] = record.sampled
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """LOG_SAMPLING: «logger=доля,...», например «httpx=0.01,utils.text_filter=0.1»"""
+    rates = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        name, _, rate = part.rpartition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(level: int = logging.INFO, json_output: bool = False,
+                  sampling: Optional[Dict[str, float]] = None, stream=None) -> QueueListener:
+    """Асинхронное логирование: очередь в вызывающем потоке, форматирование и вывод в отдельном потоке"""
+    global _listener
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if json_output else
+                        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    output.addFilter(RedactingFilter())
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Дописать очередь и остановить поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging_from_env() -> QueueListener:
+    """Логирование по настройкам окружения: LOG_LEVEL, LOG_FORMAT=json|text, LOG_SAMPLING"""
+    listener = setup_logging(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        json_output=os.getenv("LOG_FORMAT", "text").lower() == "json",
+        sampling=parse_sampling(os.getenv("LOG_SAMPLING", ""))
+    )
+    atexit.register(stop_logging)
+    return listener
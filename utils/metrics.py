@@ -0,0 +1,236 @@
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки (секунды)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[str, ...]
+Collector = Callable[[], Iterable[Tuple[Labels, float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        return []
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if self.registry.enabled:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение (меняется в коде или считается при сборе метрик)"""
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if self.registry.enabled:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        if self.registry.enabled:
+            self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (задержки, размеры)"""
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, list] = {}  # метки -> [счетчики корзин..., +Inf, сумма]
+
+    def observe(self, value: float, *labels: str):
+        if not self.registry.enabled:
+            return
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Метрика, значения которой читаются из существующей статистики только при сборе"""
+
+    def __init__(self, registry, name, help, labelnames=(), collect: Collector = None, type: str = "gauge"):
+        super().__init__(registry, name, help, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def _samples(self) -> List[str]:
+        try:
+            return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in self.collect()]
+        except Exception as e:
+            logger.error(f"Metric {self.name} collection failed: {e}")
+            return []
+
+
+class _Timer:
+    """Контекстный менеджер: время блока в гистограмму"""
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """Метрики бота в текстовом формате Prometheus
+
+    Без METRICS_PORT реестр выключен: запись метрики сводится к проверке
+    одного флага, а статистика кешей и очередей читается только при запросе
+    /metrics, поэтому на обработку сообщений почти не влияет.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._runner = None
+
+    def _add(self, metric: _Metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labelnames, buckets=buckets))
+
+    def register_callback(self, name: str, help: str, collect: Collector,
+                          labelnames: Sequence[str] = (), type: str = "gauge") -> CallbackMetric:
+        """Метрика из существующей статистики (get_stats), вычисляется при сборе"""
+        return self._add(CallbackMetric(self, name, help, labelnames, collect=collect, type=type))
+
+    def time(self, histogram: Histogram, *labels: str):
+        """with metrics.time(OCR_SECONDS): ... - время блока (ничего не делает, если метрики выключены)"""
+        return _Timer(histogram, labels) if self.enabled else _NULL_TIMER
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, host: str = "127.0.0.1", port: int = 9100):
+        """Локальный HTTP-эндпоинт /metrics"""
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"✅ Metrics endpoint: http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Глобальный реестр метрик (включается переменной METRICS_PORT)
+metrics = MetricsRegistry(enabled=bool(os.getenv("METRICS_PORT")))
+
+# Время этапов конвейера сообщений (filter, context, ai, send и т.д.) по источнику
+PIPELINE_STAGE_SECONDS = metrics.histogram(
+    "bot_pipeline_stage_seconds", "Time spent in each message pipeline stage", ("source", "stage"))
+IN_FLIGHT = metrics.gauge("bot_updates_in_flight", "Messages currently in the processing pipeline", ("source",))
+BLOCKED = metrics.counter("bot_messages_blocked_total", "Messages blocked by the text filter", ("category",))
+
+DEEPSEEK_SECONDS = metrics.histogram("bot_deepseek_request_seconds", "DeepSeek API request latency", ("status",))
+EXTRACT_SECONDS = metrics.histogram("bot_document_extract_seconds", "Text extraction time per document", ("format",))
+OCR_SECONDS = metrics.histogram("bot_ocr_seconds", "Image text recognition time")
+VOICE_SECONDS = metrics.histogram("bot_voice_decode_seconds", "Voice message decoding and recognition time")
@@ -0,0 +1,148 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+
+from utils.metrics import IN_FLIGHT, PIPELINE_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+slow_log = logging.getLogger("slow_updates")
+
+
+@dataclass
+class MessageJob:
+    """Одно входящее сообщение на пути через конвейер"""
+    update: Any
+    context: Any
+    source: str  # text, voice, photo, document
+    text: str = ""
+    user_context: Any = None
+    messages: Optional[List[dict]] = None  # запрос к AI
+    response: Optional[str] = None  # ответ пользователю
+    reply_markup: Any = None
+    extra: Dict[str, Any] = field(default_factory=dict)  # данные источника (тип файла и т.п.)
+    done: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)  # этап -> секунды
+
+    @property
+    def user(self):
+        return self.update.effective_user
+
+    @property
+    def message(self):
+        return self.update.message
+
+    async def reply(self, text: str, **kwargs):
+        return await self.update.message.reply_text(text, **kwargs)
+
+    def finish(self):
+        """Остановить конвейер после текущего этапа (ответ уже отправлен или не нужен)"""
+        self.done = True
+
+
+Stage = Callable[[MessageJob], Awaitable[None]]
+ErrorHandler = Callable[[MessageJob, str, Exception], Awaitable[None]]
+
+
+class StageStats:
+    """Время выполнения одного этапа"""
+
+    __slots__ = ('count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float, failed: bool = False):
+        self.count += 1
+        self.errors += failed
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max
+        }
+
+
+class MessagePipeline:
+    """Последовательность асинхронных этапов обработки сообщения
+
+    Все виды входящих сообщений (текст, голос, фото, документ) проходят одни
+    и те же этапы; этап сам решает, что делать для своего источника, и может
+    завершить обработку через job.finish(). Время каждого этапа записывается
+    в job.timings и в общую статистику. Исключение этапа останавливает
+    конвейер и передается в on_error. Сообщения, обработка которых заняла
+    больше SLO своего источника, записываются в лог slow_updates с временем
+    всех этапов.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, Stage]], on_error: Optional[ErrorHandler] = None,
+                 slo: Optional[Dict[str, float]] = None):
+        self.stages = list(stages)
+        self.on_error = on_error
+        self.slo = slo or {}
+        self.stats: Dict[str, StageStats] = {name: StageStats() for name, _ in self.stages}
+        self.slow_updates: deque = deque(maxlen=50)
+
+    async def run(self, job: MessageJob) -> MessageJob:
+        IN_FLIGHT.inc(job.source)
+        try:
+            for name, stage in self.stages:
+                started = time.perf_counter()
+                try:
+                    await stage(job)
+                except Exception as e:
+                    self._record(job, name, time.perf_counter() - started, failed=True)
+                    logger.error("Pipeline stage %s failed (%s): %s", name, job.source, e)
+                    if self.on_error is not None:
+                        await self.on_error(job, name, e)
+                    break
+                self._record(job, name, time.perf_counter() - started)
+                if job.done:
+                    break
+        finally:
+            IN_FLIGHT.dec(job.source)
+            self._check_slo(job)
+        return job
+
+    def _check_slo(self, job: MessageJob):
+        slo = self.slo.get(job.source)
+        total = sum(job.timings.values())
+        if slo is None or total <= slo:
+            return
+        user = job.update.effective_user if job.update is not None else None
+        record = {
+            "time": time.time(),
+            "source": job.source,
+            "user_id": user.id if user else None,
+            "total": round(total, 3),
+            "slo": slo,
+            "stages": {name: round(elapsed, 3) for name, elapsed in job.timings.items()}
+        }
+        self.slow_updates.append(record)
+        slow_log.warning("Slow update (%s, %.2fs > %gs): %s", job.source, total, slo, record["stages"], extra=record)
+
+    def _record(self, job: MessageJob, stage: str, elapsed: float, failed: bool = False):
+        job.timings[stage] = elapsed
+        self.stats[stage].record(elapsed, failed)
+        PIPELINE_STAGE_SECONDS.observe(elapsed, job.source, stage)
+
+    def handler(self, source: str):
+        """Обработчик Telegram, направляющий сообщения источника в конвейер"""
+        async def handle(update, context):
+            await self.run(MessageJob(update, context, source))
+
+        handle.__name__ = f"handle_{source}"
+        return handle
+
+    def get_stats(self) -> dict:
+        """Статистика времени по этапам"""
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
@@ -0,0 +1,147 @@
+import os
+import math
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import logging
+
+from utils.async_cache import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[Hashable], Awaitable[Any]]
+
+
+class PrefetchScheduler:
+    """Теплое хранилище данных внешних API с фоновым обновлением популярных ключей
+
+    Каждое обращение увеличивает затухающий счетчик популярности ключа.
+    Периодическая задача обновляет самые популярные ключи незадолго до
+    истечения их TTL, поэтому пользователи читают уже прогретые данные.
+    При ошибках источника обновление этого источника откладывается
+    с экспоненциально растущей паузой.
+    """
+
+    def __init__(self, interval: float = 60.0, top_n: int = 30, half_life: float = 3600.0,
+                 max_backoff: float = 1800.0, maxsize: int = 1024):
+        self.interval = interval
+        self.top_n = top_n
+        self.decay_rate = math.log(2) / half_life
+        self.max_backoff = max_backoff
+        self.store = AsyncTTLCache(maxsize=maxsize)
+
+        self._sources: Dict[str, Tuple[Loader, float]] = {}  # источник -> (загрузчик, ttl)
+        self._popularity: Dict[Tuple[str, Hashable], Tuple[float, float]] = {}  # ключ -> (счет, время)
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.refresh_errors = 0
+
+    def register(self, source: str, loader: Loader, ttl: float):
+        """Зарегистрировать источник данных: loader(key) загружает значение по ключу"""
+        self._sources[source] = (loader, ttl)
+
+    async def get(self, source: str, key: Hashable) -> Any:
+        """Прочитать значение из теплого хранилища (при промахе - загрузить)"""
+        self._touch(source, key)
+        loader, ttl = self._sources[source]
+        return await self.store.get_or_fetch((source, key), lambda: loader(key), ttl)
+
+    def put(self, source: str, key: Hashable, value: Any):
+        """Положить в хранилище значение, уже загруженное другим путем (на ttl источника)"""
+        self.store.set((source, key), value, self._sources[source][1])
+
+    def _touch(self, source: str, key: Hashable, now: Optional[float] = None):
+        """Увеличить затухающий счетчик популярности"""
+        now = time.monotonic() if now is None else now
+        score, updated = self._popularity.get((source, key), (0.0, now))
+        self._popularity[(source, key)] = (score * math.exp(-self.decay_rate * (now - updated)) + 1.0, now)
+
+    def popular_keys(self, now: Optional[float] = None) -> List[Tuple[str, Hashable]]:
+        """Ключи по убыванию текущей популярности (не больше top_n)"""
+        now = time.monotonic() if now is None else now
+        scores = {
+            item: score * math.exp(-self.decay_rate * (now - updated))
+            for item, (score, updated) in self._popularity.items()
+        }
+        # Забытые ключи больше не отслеживаем
+        for item, score in scores.items():
+            if score < 0.01:
+                del self._popularity[item]
+        return sorted((item for item in scores if scores[item] >= 0.01), key=scores.get, reverse=True)[:self.top_n]
+
+    async def refresh(self):
+        """Обновить популярные ключи, срок жизни которых скоро истечет"""
+        now = time.monotonic()
+        for source, key in self.popular_keys():
+            if source not in self._sources or self._retry_at.get(source, 0) > now:
+                continue
+
+            loader, ttl = self._sources[source]
+            # Обновляем заранее: к следующему запуску задачи значение еще не должно истечь
+            if self.store.expires_in((source, key)) > max(self.interval * 1.5, ttl * 0.1):
+                continue
+
+            try:
+                value = await loader(key)
+            except Exception as e:
+                failures = self._failures.get(source, 0) + 1
+                delay = min(self.max_backoff, self.interval * 2 ** (failures - 1))
+                self._failures[source] = failures
+                self._retry_at[source] = now + delay
+                self.refresh_errors += 1
+                logger.warning(f"Prefetch of {source}:{key} failed ({e}), retry in {delay:.0f}s")
+                continue
+
+            self._failures.pop(source, None)
+            self._retry_at.pop(source, None)
+            self.store.set((source, key), value, ttl)
+            self.refreshed += 1
+
+    async def _refresh_job(self, context):
+        """Задача job_queue"""
+        await self.refresh()
+
+    async def _refresh_loop(self):
+        """Запасной цикл обновления, если job_queue недоступна"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Prefetch loop error: {e}")
+
+    def start(self, application):
+        """Запустить периодическое обновление в планировщике приложения"""
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(self._refresh_job, interval=self.interval, first=self.interval,
+                                                name="prefetch")
+        else:
+            logger.warning("❌ JobQueue недоступна (pip install \"python-telegram-bot[job-queue]\"). "
+                           "Prefetch uses asyncio task.")
+            self._task = asyncio.create_task(self._refresh_loop())
+        logger.info(f"✅ Prefetch scheduler started: every {self.interval:g}s, top {self.top_n} keys")
+
+    async def stop(self):
+        """Остановить запасной цикл обновления"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> dict:
+        """Статистика теплого хранилища"""
+        return {
+            **self.store.get_stats(),
+            "tracked_keys": len(self._popularity),
+            "refreshed": self.refreshed,
+            "refresh_errors": self.refresh_errors,
+            "backoff": {source: round(retry - time.monotonic()) for source, retry in self._retry_at.items()}
+        }
+
+
+# Глобальный планировщик предзагрузки
+prefetcher = PrefetchScheduler(
+    interval=float(os.getenv("PREFETCH_INTERVAL", "60")),
+    top_n=int(os.getenv("PREFETCH_TOP_N", "30"))
+)
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_stack(frame, limit: int = 64) -> str:
+    """Стек кадра в свернутом виде для flamegraph: внешний;...;внутренний"""
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopStallMonitor:
+    """Обнаружение блокировок event loop
+
+    Задача в цикле событий регулярно отмечает «пульс» и измеряет, на сколько
+    опоздало ее пробуждение. Отдельный поток следит за пульсом: если цикл не
+    отвечает дольше threshold, он снимает стек потока цикла, то есть код,
+    который блокирует его прямо сейчас, и пишет его в лог.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.recent: Deque[dict] = deque(maxlen=20)
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = now - expected
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        reported = 0.0  # пульс, для которого блокировка уже записана
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+            self.stalls += 1
+            self.recent.append({"time": time.time(), "blocked": blocked, "stack": stack})
+            logger.warning(f"⚠️ Event loop blocked for {blocked:.2f}s, blocking code:\n{stack}")
+
+    def start(self):
+        """Запуск из работающего event loop"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-stall-monitor", daemon=True)
+        self._watchdog.start()
+        logger.info(f"✅ Event loop stall monitor started (threshold {self.threshold}s)")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        """Статистика блокировок"""
+        return {"stalls": self.stalls, "max_lag": self.max_lag, "running": self._task is not None}
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик потока event loop
+
+    Поток раз в interval секунд снимает стек потока цикла событий и считает
+    одинаковые стеки. Результат - свернутые стеки (формат flamegraph.pl,
+    speedscope, inferno): «кадр;кадр;кадр количество» в каждой строке.
+    """
+
+    def __init__(self, output_dir: str = "logs", interval: float = 0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.running = False
+
+    def sample(self, thread_id: int, duration: float) -> Dict[str, int]:
+        """Собрать выборки стека потока за duration секунд (блокирует вызывающий поток)"""
+        samples: Counter = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples[_frame_stack(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return samples
+
+    def dump(self, samples: Dict[str, int]) -> str:
+        """Записать свернутые стеки в файл; возвращает путь"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+    async def profile(self, duration: float = 10.0) -> Optional[str]:
+        """Профилировать работающий event loop duration секунд; None, если профилирование уже идет"""
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+        try:
+            thread_id = threading.get_ident()
+            logger.info(f"Sampling profiler started for {duration:g}s")
+            samples = await asyncio.to_thread(self.sample, thread_id, duration)
+            path = await asyncio.to_thread(self.dump, samples)
+            logger.info(f"✅ Profile written: {path} ({sum(samples.values())} samples)")
+            return path
+        finally:
+            self.running = False
+
+
+# Глобальные инструменты диагностики (монитор запускается, если задан LOOP_STALL_THRESHOLD)
+stall_monitor = LoopStallMonitor(threshold=float(os.getenv("LOOP_STALL_THRESHOLD") or 0.25))
+profiler = SamplingProfiler(output_dir=os.getenv("PROFILE_DIR", "logs"))
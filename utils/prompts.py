@@ -0,0 +1,104 @@
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Все запросы к AI собираются здесь, чтобы начало запроса (системный промпт,
+# документ, ранняя история) было побайтно одинаковым между запросами: DeepSeek
+# кеширует совпадающие префиксы, и такие токены дешевле и обрабатываются быстрее.
+# Меняющаяся часть (задание, новое сообщение) всегда в конце запроса.
+
+CHAT_SYSTEM_PROMPT = (
+    "Ты полезный AI-ассистент в Telegram боте.\n"
+    "Отвечай дружелюбно и информативно.\n"
+    "Если вопрос непонятен - вежливо попроси уточнить.\n"
+    "Будь краток, но содержателен. Используй эмодзи где уместно."
+)
+
+ANALYSIS_SYSTEM_PROMPT = "Ты эксперт по анализу текстов. Ты делаешь качественные анализы, пересказы и выделяешь ключевые моменты. Будь информативным, но лаконичным."
+
+ANALYSIS_PROMPTS = {
+    "summary": "Сделай краткий пересказ этого текста, выдели основные идеи и ключевые моменты. Будь лаконичным.",
+    "key_points": "Выдели ключевые пункты и основные мысли из этого текста в виде маркированного списка.",
+    "analysis": "Проанализируй этот текст и дай развернутый анализ основных тем и идей.",
+    "qa": "Составь 3-5 самых важных вопросов по содержанию этого текста и дай на них краткие ответы."
+}
+
+CHAT_HISTORY_MESSAGES = 10
+CHAT_HISTORY_STEP = 4  # история сдвигается блоками, а не по одному сообщению
+
+_CHAT_SYSTEM_MESSAGE = {"role": "system", "content": CHAT_SYSTEM_PROMPT}
+_ANALYSIS_SYSTEM_MESSAGE = {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT}
+
+
+def history_window(messages: List[dict], total: Optional[int] = None,
+                   max_messages: int = CHAT_HISTORY_MESSAGES, step: int = CHAT_HISTORY_STEP) -> List[dict]:
+    """Последние сообщения диалога с устойчивым началом
+
+    Окно длиной от max_messages - step + 1 до max_messages сообщений
+    начинается с номера, кратного step (total - сколько сообщений было в
+    диалоге всего). Начало истории меняется раз в step сообщений, поэтому
+    префикс запроса между соседними ходами диалога совпадает.
+    """
+    total = len(messages) if total is None else total
+    if total <= max_messages:
+        return list(messages)
+    start = -(-(total - max_messages) // step) * step  # округление вверх до кратного step
+    return messages[len(messages) - (total - start):]
+
+
+def chat_messages(history: List[dict]) -> List[dict]:
+    """Запрос диалога: системный промпт, затем история (новое сообщение - последнее)"""
+    return [_CHAT_SYSTEM_MESSAGE] + [{"role": msg["role"], "content": msg["content"]} for msg in history]
+
+
+def analysis_messages(document: str, task: str) -> List[dict]:
+    """Запрос анализа: сначала документ, затем задание
+
+    Документ стоит перед заданием, поэтому разные виды анализа одного
+    файла начинаются одинаково и повторно оплачивают только задание.
+    """
+    return [
+        _ANALYSIS_SYSTEM_MESSAGE,
+        {"role": "user", "content": f"Текст для анализа:\n{document}\n\n{task}"}
+    ]
+
+
+class PromptCacheStats:
+    """Статистика кеширования префиксов запросов на стороне DeepSeek (поле usage ответа)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+
+    def record(self, usage: Optional[dict], latency: float = 0.0):
+        if not usage:
+            return
+        self.requests += 1
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.cache_hit_tokens += usage.get("prompt_cache_hit_tokens", 0)
+        self.cache_miss_tokens += usage.get("prompt_cache_miss_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+        self.latency += latency
+        logger.debug(f"DeepSeek usage: {usage} ({latency:.2f}s)")
+
+    def get_stats(self) -> dict:
+        """Доля токенов запроса, взятых из кеша префиксов, и средняя задержка"""
+        cached = self.cache_hit_tokens + self.cache_miss_tokens
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_cache_hit_tokens": self.cache_hit_tokens,
+            "prompt_cache_miss_tokens": self.cache_miss_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": self.cache_hit_tokens / cached if cached else 0.0,
+            "avg_latency": self.latency / self.requests if self.requests else 0.0
+        }
+
+
+# Глобальная статистика кеша префиксов DeepSeek
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,231 @@
+import os
+import time
+import hashlib
+from collections import deque
+from typing import Dict, Optional, Tuple
+from telegram.ext import ApplicationHandlerStop
+import logging
+
+from utils.router import router
+
+logger = logging.getLogger(__name__)
+
+# Уведомление об ограничении отправляется не чаще одного раза за этот интервал
+NOTICE_INTERVAL = 10.0
+
+_REDIS_BUCKET_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[2])
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or ARGV[3])
+tokens = math.min(tonumber(ARGV[2]), tokens + (tonumber(ARGV[3]) - updated) * tonumber(ARGV[1]))
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) / tonumber(ARGV[1])) + 1)
+return allowed
+"""
+
+_REDIS_DUPLICATE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[1] .. ':' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+local count = 0
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if string.sub(member, -string.len(ARGV[3])) == ARGV[3] then
+        count = count + 1
+    end
+end
+return count
+"""
+
+
+def message_fingerprint(text: str) -> str:
+    """Короткий отпечаток сообщения без учета регистра и пробелов"""
+    normalized = ' '.join(text.lower().split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class MemoryRateLimitBackend:
+    """Состояние ограничителя в памяти процесса"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._sweep_at = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # ключ -> (токены, время обновления)
+        self._recent: Dict[str, deque] = {}  # ключ -> [(время, отпечаток), ...]
+
+    async def take(self, key: str, rate: float, capacity: float, now: float) -> bool:
+        """Забрать токен из корзины; False, если корзина пуста"""
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+
+        if len(self._buckets) > self._sweep_at:
+            self._sweep(now, capacity / rate)
+        return allowed
+
+    async def count_duplicates(self, key: str, fingerprint: str, now: float, window: float, limit: int) -> int:
+        """Добавить сообщение в скользящее окно и вернуть число таких же сообщений в нем"""
+        recent = self._recent.get(key)
+        if recent is None:
+            recent = self._recent[key] = deque(maxlen=limit * 4)
+        while recent and now - recent[0][0] > window:
+            recent.popleft()
+        recent.append((now, fingerprint))
+        return sum(1 for _, seen in recent if seen == fingerprint)
+
+    def _sweep(self, now: float, refill_time: float):
+        """Удалить корзины, которые успели полностью наполниться"""
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > refill_time]
+        for key in stale:
+            del self._buckets[key]
+            self._recent.pop(key, None)
+        # Если активных ключей много, следующую очистку откладываем, чтобы не сканировать на каждом сообщении
+        self._sweep_at = max(self.max_keys, len(self._buckets) * 2)
+        logger.info(f"Rate limiter sweep: removed {len(stale)} idle keys")
+
+
+class RedisRateLimitBackend:
+    """Состояние ограничителя в Redis для нескольких экземпляров бота"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise Exception("redis не установлен. Установите: pip install redis")
+
+        self.prefix = prefix
+        self.client = redis.from_url(url)
+        self._bucket_script = self.client.register_script(_REDIS_BUCKET_SCRIPT)
+        self._duplicate_script = self.client.register_script(_REDIS_DUPLICATE_SCRIPT)
+
+    async def take(self, key: str, rate: float, capacity: float, now: float) -> bool:
+        return bool(await self._bucket_script(keys=[self.prefix + key], args=[rate, capacity, now]))
+
+    async def count_duplicates(self, key: str, fingerprint: str, now: float, window: float, limit: int) -> int:
+        return int(await self._duplicate_script(keys=[f"{self.prefix}dup:{key}"], args=[now, window, fingerprint]))
+
+
+class RateLimiter:
+    """Ограничение частоты сообщений: корзины токенов на пользователя и чат и детектор повторов"""
+
+    def __init__(self, backend=None,
+                 user_rate: float = 0.5, user_burst: float = 5,
+                 chat_rate: float = 2.0, chat_burst: float = 20,
+                 duplicate_window: float = 60.0, duplicate_limit: int = 3):
+        self.backend = backend or MemoryRateLimitBackend()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.duplicate_window = duplicate_window
+        self.duplicate_limit = duplicate_limit
+        self._last_notice: Dict[int, float] = {}
+        self.stats = {"passed": 0, "user": 0, "chat": 0, "duplicate": 0}
+
+    async def check(self, user_id: int, chat_id: int, text: str = "", now: Optional[float] = None) -> str:
+        """Проверить сообщение; возвращает причину отказа или пустую строку"""
+        now = time.time() if now is None else now
+
+        if not await self.backend.take(f"u:{user_id}", self.user_rate, self.user_burst, now):
+            reason = "user"
+        elif chat_id != user_id and not await self.backend.take(f"c:{chat_id}", self.chat_rate, self.chat_burst, now):
+            reason = "chat"
+        elif text and await self.backend.count_duplicates(
+                f"u:{user_id}", message_fingerprint(text), now, self.duplicate_window, self.duplicate_limit
+        ) > self.duplicate_limit:
+            reason = "duplicate"
+        else:
+            self.stats["passed"] += 1
+            return ""
+
+        self.stats[reason] += 1
+        return reason
+
+    async def check_duplicate(self, user_id: int, text: str, now: Optional[float] = None) -> str:
+        """Проверить только повторы (для текста, распознанного из голоса или изображения)"""
+        now = time.time() if now is None else now
+        if await self.backend.count_duplicates(
+                f"u:{user_id}", message_fingerprint(text), now, self.duplicate_window, self.duplicate_limit
+        ) > self.duplicate_limit:
+            self.stats["duplicate"] += 1
+            return "duplicate"
+        return ""
+
+    async def notify(self, message, user_id: int, reason: str):
+        """Сообщить пользователю об ограничении (не чаще NOTICE_INTERVAL)"""
+        logger.warning("Message THROTTLED for user %s: %s", user_id, reason)
+        now = time.time()
+        if now - self._last_notice.get(user_id, 0) <= NOTICE_INTERVAL:
+            return
+        if len(self._last_notice) > 10000:
+            self._last_notice = {uid: ts for uid, ts in self._last_notice.items() if now - ts <= NOTICE_INTERVAL}
+        self._last_notice[user_id] = now
+        if reason == "duplicate":
+            await message.reply_text("🔁 Вы отправляете одно и то же сообщение. Подождите немного.")
+        else:
+            await message.reply_text("⏳ Слишком много сообщений. Подождите немного и повторите.")
+
+    async def handle_update(self, update, context):
+        """Промежуточный обработчик: отбрасывает сообщения сверх лимита до фильтрации и AI
+
+        Считаются только новые сообщения: нажатия inline-кнопок и
+        отредактированные сообщения лимит не расходуют.
+        """
+        message = update.message
+        user = update.effective_user
+        if message is None or user is None:
+            return
+
+        # Повторы ищутся только в свободном тексте для AI: кнопки меню и команды можно нажимать сколько угодно
+        text = message.text or message.caption or ""
+        if message.text and not router.is_free_text(message.text, user.id):
+            text = ""
+
+        try:
+            reason = await self.check(user.id, message.chat_id, text)
+        except Exception as e:
+            # Недоступность хранилища не должна останавливать бота
+            logger.error(f"Rate limiter error: {e}")
+            return
+
+        if not reason:
+            return
+
+        await self.notify(message, user.id, reason)
+        raise ApplicationHandlerStop
+
+    def get_stats(self) -> dict:
+        """Статистика ограничителя"""
+        return dict(self.stats)
+
+
+def _create_rate_limiter() -> RateLimiter:
+    """Создать ограничитель по настройкам окружения"""
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    backend = None
+    if redis_url:
+        try:
+            backend = RedisRateLimitBackend(redis_url)
+            logger.info("✅ Rate limiter uses Redis backend")
+        except Exception as e:
+            logger.warning(f"❌ Redis rate limiter unavailable: {e}. Using memory backend.")
+
+    return RateLimiter(
+        backend=backend,
+        user_rate=float(os.getenv("RATE_LIMIT_USER_RATE", "0.5")),
+        user_burst=float(os.getenv("RATE_LIMIT_USER_BURST", "5")),
+        chat_rate=float(os.getenv("RATE_LIMIT_CHAT_RATE", "2")),
+        chat_burst=float(os.getenv("RATE_LIMIT_CHAT_BURST", "20")),
+        duplicate_window=float(os.getenv("RATE_LIMIT_DUPLICATE_WINDOW", "60")),
+        duplicate_limit=int(os.getenv("RATE_LIMIT_DUPLICATE_LIMIT", "3"))
+    )
+
+
+# Глобальный экземпляр ограничителя
+rate_limiter = _create_rate_limiter()
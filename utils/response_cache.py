@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SPACES_RE = re.compile(r'\s+')
+_TRAILING_PUNCT_RE = re.compile(r'[\s.!?…]+$')
+
+
+def normalize_prompt(text: str) -> str:
+    """Ключ вопроса: без регистра, ё -> е, одинарные пробелы, без завершающей пунктуации"""
+    text = _SPACES_RE.sub(' ', text.casefold().replace('ё', 'е')).strip()
+    return _TRAILING_PUNCT_RE.sub('', text)
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def hashed_ngram_embedder(dim: int = 512, n: int = 3) -> Callable[[str], "object"]:
+    """Локальный эмбеддинг без модели: хешированные символьные n-граммы, нормированный вектор"""
+    try:
+        import numpy as np
+    except ImportError:
+        raise Exception("NumPy не установлен. Установите: pip install numpy")
+
+    def embed(text: str):
+        padded = f" {text} "
+        vector = np.zeros(dim, dtype=np.float32)
+        grams = [padded[i:i + n] for i in range(max(1, len(padded) - n + 1))]
+        indexes = [int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=4).digest(), 'little') % dim
+                   for gram in grams]
+        np.add.at(vector, indexes, 1.0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    return embed
+
+
+class _Entry(NamedTuple):
+    expires: float
+    response: str
+    system: bytes
+    slot: int  # строка в матрице эмбеддингов (-1, если поиск похожих выключен)
+
+
+class ResponseCache:
+    """Кеш ответов AI на первые вопросы диалога (без истории)
+
+    Ключ - нормализованный вопрос вместе с системным промптом. Если задан
+    порог similarity, промах по точному ключу дополнительно ищет ближайший
+    сохраненный вопрос по косинусной близости эмбеддингов (одно
+    умножение матрицы на вектор в NumPy). Системные промпты хранятся
+    в параллельном массиве целых id, поэтому отбор строк с тем же промптом -
+    одно векторное сравнение. Кеш с maxsize меньше 1 выключен.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 86400, similarity: float = 0.0,
+                 embedder: Optional[Callable[[str], "object"]] = None, enabled: bool = True):
+        self.enabled = enabled and maxsize > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        self._embed = None
+        if self.enabled and similarity > 0:
+            import numpy as np
+
+            self._embed = embedder or hashed_ngram_embedder()
+            dim = len(self._embed("тест"))
+            self._vectors = np.zeros((maxsize, dim), dtype=np.float32)
+            self._slot_systems = np.full(maxsize, -1, dtype=np.int64)  # id системного промпта, -1 - пустая строка
+            self._system_ids: Dict[bytes, int] = {}
+            self._next_system_id = 0
+            self._keys: List[Optional[bytes]] = [None] * maxsize
+            self._free = list(range(maxsize - 1, -1, -1))
+
+    def _key(self, system: bytes, prompt: str) -> bytes:
+        return _digest(f"{system.hex()}\x00{prompt}")
+
+    def get(self, system_prompt: str, prompt: str, now: Optional[float] = None) -> Optional[str]:
+        """Сохраненный ответ или None"""
+        if not self.enabled:
+            return None
+        now = time.time() if now is None else now
+        system = _digest(system_prompt)
+        normalized = normalize_prompt(prompt)
+
+        key = self._key(system, normalized)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            self._drop(key)
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.response
+
+        if self._embed is not None:
+            response = self._nearest(system, normalized, now)
+            if response is not None:
+                self.semantic_hits += 1
+                return response
+
+        self.misses += 1
+        return None
+
+    def _system_id(self, system: bytes) -> int:
+        """Целый id системного промпта для массива строк"""
+        system_id = self._system_ids.get(system)
+        if system_id is None:
+            if len(self._system_ids) >= self.maxsize:
+                # Забываем промпты, которых больше нет в кеше
+                live = {entry.system for entry in self._entries.values()}
+                self._system_ids = {known: i for known, i in self._system_ids.items() if known in live}
+            system_id = self._system_ids[system] = self._next_system_id
+            self._next_system_id += 1
+        return system_id
+
+    def _nearest(self, system: bytes, normalized: str, now: float) -> Optional[str]:
+        """Ответ на ближайший похожий вопрос с тем же системным промптом"""
+        import numpy as np
+
+        system_id = self._system_ids.get(system)
+        if system_id is None:
+            return None
+        candidates = self._slot_systems == system_id
+        if not candidates.any():
+            return None
+        scores = self._vectors @ self._embed(normalized)
+        scores = np.where(candidates, scores, -1.0)
+        while True:
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.similarity:
+                return None
+            key = self._keys[slot]
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                break
+            # Устаревшая запись: убираем ее и берем следующую по близости
+            self._drop(key)
+            scores[slot] = -1.0
+
+        self._entries.move_to_end(key)
+        logger.info("AI response cache: similar question found (similarity %.2f)", scores[slot])
+        return entry.response
+
+    def set(self, system_prompt: str, prompt: str, response: str, now: Optional[float] = None):
+        """Сохранить ответ на вопрос"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        system = _digest(system_prompt)
+        normalized = normalize_prompt(prompt)
+        key = self._key(system, normalized)
+        self._drop(key)
+
+        while len(self._entries) >= self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+        slot = -1
+        if self._embed is not None:
+            slot = self._free.pop()
+            self._vectors[slot] = self._embed(normalized)
+            self._slot_systems[slot] = self._system_id(system)
+            self._keys[slot] = key
+        self._entries[key] = _Entry(now + self.ttl, response, system, slot)
+
+    def _drop(self, key: Optional[bytes]):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.slot >= 0:
+            self._slot_systems[entry.slot] = -1
+            self._keys[entry.slot] = None
+            self._free.append(entry.slot)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._drop(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> dict:
+        """Статистика кеша ответов"""
+        total = self.hits + self.semantic_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / total if total else 0.0
+        }
+
+
+def _create_response_cache() -> ResponseCache:
+    """Кеш ответов по настройкам окружения (по умолчанию выключен)"""
+    enabled = os.getenv("AI_RESPONSE_CACHE", "0").lower() in ("1", "true", "yes")
+    try:
+        return ResponseCache(
+            maxsize=int(os.getenv("AI_RESPONSE_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("AI_RESPONSE_CACHE_TTL", "86400")),
+            similarity=float(os.getenv("AI_RESPONSE_CACHE_SIMILARITY", "0")),
+            enabled=enabled
+        )
+    except Exception as e:
+        logger.error(f"❌ AI response cache unavailable: {e}")
+        return ResponseCache(enabled=False)
+
+
+# Глобальный кеш ответов AI
+response_cache = _create_response_cache()
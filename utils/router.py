@@ -0,0 +1,141 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Pattern, Tuple, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[..., Awaitable]
+
+
+class UpdateRouter:
+    """Центральная таблица маршрутизации текстовых сообщений
+
+    Кнопки и команды ищутся в хеш-таблицах, все шаблоны плагинов собраны
+    в одно регулярное выражение с именованными группами. Порядок проверки:
+    кнопка -> команда -> шаблон -> ожидаемый ввод пользователя -> fallback.
+    Ожидание ввода снимается любой сработавшей кнопкой или командой, а
+    брошенные ожидания истекают через input_ttl секунд.
+    """
+
+    def __init__(self, input_ttl: float = 600, max_inputs: int = 10000):
+        self.buttons: Dict[str, Callback] = {}
+        self.commands: Dict[str, Callback] = {}
+        self._patterns: List[Tuple[Pattern, Callback]] = []
+        self._combined: Optional[Pattern] = None
+        self.input_ttl = input_ttl
+        self.max_inputs = max_inputs
+        # пользователь -> (истекает, обработчик ожидаемого текста)
+        self._inputs: "OrderedDict[int, Tuple[float, Callback]]" = OrderedDict()
+        self.fallback: Optional[Callback] = None
+
+    def add_button(self, text: str, callback: Callback):
+        self.buttons[text] = callback
+
+    def add_buttons(self, texts, callback: Callback):
+        for text in texts:
+            self.buttons[text] = callback
+
+    def add_command(self, command: str, callback: Callback):
+        self.commands[command.lower()] = callback
+
+    def add_pattern(self, pattern: Union[str, Pattern], callback: Callback):
+        """Шаблон сообщения; проверяются в порядке добавления"""
+        self._patterns.append((re.compile(pattern), callback))
+        self._combined = None
+
+    def set_fallback(self, callback: Callback):
+        self.fallback = callback
+
+    def remove_callback(self, callback: Callback):
+        """Удалить все маршруты, ведущие в callback"""
+        self.buttons = {text: cb for text, cb in self.buttons.items() if cb is not callback}
+        self.commands = {command: cb for command, cb in self.commands.items() if cb is not callback}
+        self._patterns = [(pattern, cb) for pattern, cb in self._patterns if cb is not callback]
+        self._combined = None
+
+    def expect_input(self, user_id: int, callback: Callback):
+        """Следующее текстовое сообщение пользователя (не кнопка и не команда) передать callback"""
+        self._inputs.pop(user_id, None)
+        self._inputs[user_id] = (time.monotonic() + self.input_ttl, callback)
+        while len(self._inputs) > self.max_inputs:
+            self._inputs.popitem(last=False)
+
+    def cancel_input(self, user_id: int):
+        self._inputs.pop(user_id, None)
+
+    def _pending_input(self, user_id: Optional[int]) -> Optional[Callback]:
+        entry = self._inputs.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._inputs[user_id]
+            return None
+        return entry[1]
+
+    def is_expecting_input(self, user_id: int) -> bool:
+        return self._pending_input(user_id) is not None
+
+    def _compile(self) -> Optional[Pattern]:
+        if self._combined is None and self._patterns:
+            parts = []
+            for i, (pattern, _) in enumerate(self._patterns):
+                # Флаги шаблона (например, IGNORECASE) действуют только внутри его группы
+                flags = ''.join(flag for flag, value in (('i', re.IGNORECASE), ('s', re.DOTALL), ('m', re.MULTILINE))
+                                if pattern.flags & value)
+                body = f'(?{flags}:{pattern.pattern})' if flags else pattern.pattern
+                parts.append(f'(?P<_r{i}>{body})')
+            self._combined = re.compile('|'.join(parts))
+        return self._combined
+
+    def _route(self, text: str, user_id: Optional[int]) -> Tuple[str, Optional[Callback], Optional[List[str]]]:
+        """Вид маршрута (button, command, pattern, input, fallback), обработчик и аргументы команды"""
+        callback = self.buttons.get(text)
+        if callback is not None:
+            return "button", callback, None
+
+        if text.startswith('/'):
+            command, *args = text.split()
+            callback = self.commands.get(command[1:].split('@', 1)[0].lower())
+            if callback is not None:
+                return "command", callback, args
+            return "command", None, None
+
+        combined = self._compile()
+        if combined is not None:
+            match = combined.match(text)
+            if match:
+                return "pattern", self._patterns[int(match.lastgroup[2:])][1], None
+
+        callback = self._pending_input(user_id)
+        if callback is not None:
+            return "input", callback, None
+        return "fallback", self.fallback, None
+
+    def resolve(self, text: str, user_id: Optional[int] = None) -> Tuple[Optional[Callback], Optional[List[str]]]:
+        """Обработчик для текста: (callback, аргументы команды или None)"""
+        _, callback, args = self._route(text, user_id)
+        return callback, args
+
+    def is_free_text(self, text: str, user_id: Optional[int] = None) -> bool:
+        """Текст уйдет в fallback (AI), а не в кнопку, команду, шаблон или ожидаемый ввод"""
+        return self._route(text, user_id)[0] == "fallback"
+
+    async def dispatch(self, update, context):
+        """Единственный обработчик текстовых сообщений приложения"""
+        user = update.effective_user
+        user_id = user.id if user else None
+        kind, callback, args = self._route(update.message.text, user_id)
+        if kind in ("button", "command"):
+            # Пользователь ушел из диалога ввода через меню или команду
+            self.cancel_input(user_id)
+        if callback is None:
+            return
+        if args is not None:
+            context.args = args
+        return await callback(update, context)
+
+
+# Глобальный маршрутизатор текстовых сообщений
+router = UpdateRouter()
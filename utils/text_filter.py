@@ -1,86 +1,420 @@
+import os
 import re
-import string
-from typing import Tuple, List, Dict
+import json
+import codecs
+import pickle
+import hashlib
+import stat
+import threading
+from typing import Tuple, List, Dict, Iterable, Iterator, NamedTuple, Optional, Sequence
+from dataclasses import dataclass
 import logging
 from collections import Counter
+from encodings import cp1251
+from utils.lru_cache import LRUCache, MISSING
 
 logger = logging.getLogger(__name__)
 
-
-class UltraTextFilter:
-    def __init__(self):
-        # ОСНОВНЫЕ МАТЕРНЫЕ СЛОВА (только явные матерные слова)
-        self.base_profanity = [
-            # Русские матерные слова (только самые явные)
-            'хуй', 'хуё', 'хуя', 'пизд', 'ебан', 'ебать', 'ёбан', 'ёбать',
-            'блядь', 'бляд', 'гандон', 'мудак', 'пидор', 'педик',
-            'шлюха', 'проститутка', 'ебал', 'залупа', 'манда',
-            'долбоёб', 'уебан', 'выебан', 'выеб',
-
-            # Английские матерные слова
-            'fuck', 'shit', 'asshole', 'bitch', 'cunt', 'dick', 'pussy',
-            'whore', 'slut', 'bastard', 'motherfucker', 'cock', 'nigger',
-            'faggot', 'prick'
-        ]
-
-        # СЛОВА-МАСКИ (замена букв) - только для явных замен
-        self.leet_replacements = {
-            'a': ['4', '@'], 'e': ['3'], 'i': ['1', '!'],
-            'o': ['0'], 's': ['5', '$'], 't': ['7'],
-            'b': ['8'], 'g': ['9'], 'l': ['1', '|'],
-            'z': ['2']
+_CP1251_ENCODING = cp1251.encoding_table
+_CP1251_DECODING = cp1251.decoding_table
+_charmap_encode = codecs.charmap_encode
+_charmap_decode = codecs.charmap_decode
+
+# Кириллические буквы, совпадающие по начертанию с латинскими
+HOMOGLYPHS = {'х': 'x', 'у': 'y', 'е': 'e', 'ё': 'e', 'о': 'o', 'а': 'a', 'р': 'p'}
+
+# Символы, которыми маскируют кириллические буквы в корнях (пи3д, е6ать, хуj, pi3da).
+# Для проверки корней они заменяются буквами до leet-нормализации, иначе '3'
+# превратился бы в 'e' и корень «пи3д» совпал бы с «пиед» (пиедестал).
+# Латинские x, y, e, a, o совпадают с кириллицей уже через HOMOGLYPHS
+STEM_LOOKALIKES = {'з': '3', 'б': '6', 'й': 'j', 'п': 'p', 'и': 'i', 'д': 'd'}
+
+# Набор правил по умолчанию и обязательные поля набора
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter_rules.json")
+RULES_CACHE_FORMAT = 3
+RULE_FIELDS = (
+    'base_profanity', 'leet_replacements', 'profanity_stems', 'hidden_profanity_roots',
+    'english_profanity', 'patterns', 'spam_triggers', 'context_triggers',
+    'context_category_names', 'whitelist', 'short_unclear'
+)
+
+# Ключ конца слова в префиксном дереве
+TRIE_END = None
+
+_WORD_RE = re.compile(r'\w+')
+_NON_LETTER_RE = re.compile(r'[^a-zа-я]')
+_SPECIAL_CHARS_RE = re.compile(r'[!@#$%^&*()_+\-=\[\]{};\':"\\|,.<>/?]')
+_UNCLEAR_RE = re.compile(r'\s*(?:[чкп]|[?¿]|\.+|[нт]ет)\s*')
+
+
+def build_normalize_table(leet_replacements: Dict[str, str]) -> Tuple[bytes, bytes]:
+    """Собрать байтовую таблицу нормализации в кодировке cp1251.
+
+    За один проход bytes.translate текст приводится к нижнему регистру,
+    leet-символы заменяются буквами, кириллические омоглифы сворачиваются
+    в латиницу, а пунктуация удаляется.
+    """
+    table = bytearray(range(256))
+    delete = bytearray()
+    for byte, char in enumerate(_CP1251_DECODING):
+        mapped = leet_replacements.get(char)
+        if mapped is None:
+            if not (char.isalnum() or char == '_' or char.isspace()):
+                delete.append(byte)
+                continue
+            mapped = char.lower()
+            mapped = HOMOGLYPHS.get(mapped, mapped)
+        encoded = mapped.encode('cp1251', 'ignore')
+        if len(encoded) == 1:
+            table[byte] = encoded[0]
+    return bytes(table), bytes(delete)
+
+
+def build_trie(sequences: Iterable[Sequence]) -> Dict:
+    """Построить префиксное дерево по строкам (символы) или кортежам (слова)"""
+    trie: Dict = {}
+    for sequence in sequences:
+        node = trie
+        for item in sequence:
+            node = node.setdefault(item, {})
+        node[TRIE_END] = sequence
+    return trie
+
+
+def find_in_trie(trie: Dict, sequence: Sequence, start: int = 0) -> Iterator[Tuple[int, Sequence]]:
+    """Все элементы дерева, начинающиеся в sequence с позиции start и дальше"""
+    for i in range(start, len(sequence)):
+        node = trie
+        for j in range(i, len(sequence)):
+            node = node.get(sequence[j])
+            if node is None:
+                break
+            if TRIE_END in node:
+                yield i, node[TRIE_END]
+
+
+def trie_to_regex(trie: Dict, shortest: bool = False) -> str:
+    """Свернуть символьное дерево в регулярное выражение с общими префиксами
+
+    Поиск по такому выражению выполняется движком re, без цикла на Python.
+    При shortest=True ветка обрывается на первом же слове: для поиска
+    вхождений более длинные продолжения не нужны.
+    """
+    if TRIE_END in trie and shortest:
+        return ''
+    branches = [
+        re.escape(char) + trie_to_regex(child, shortest)
+        for char, child in sorted(trie.items(), key=lambda item: item[0] or '')
+        if char is not TRIE_END
+    ]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if TRIE_END in trie:
+        return '(?:' + body + ')?'
+    return body
+
+
+class Token(NamedTuple):
+    start: int
+    end: int
+    word: str  # слово в нижнем регистре
+
+
+class FilterVerdict(NamedTuple):
+    """Структурированный результат проверки одного сообщения"""
+    index: int
+    blocked: bool
+    category: str  # группа правил: profanity, links, spam, ...
+    rule_id: str  # конкретное правило: profanity.stem, links.urls, ...
+    reason: str  # описание нарушения, как в filter_text
+    offsets: List[Tuple[int, int]]  # фрагменты исходного текста [start, end)
+
+    def to_dict(self) -> Dict:
+        return self._asdict()
+
+
+def load_rule_pack(path: str) -> Dict:
+    """Загрузить набор правил фильтра из JSON или YAML файла"""
+    with open(path, encoding='utf-8') as file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise Exception("PyYAML не установлен. Установите: pip install pyyaml")
+            pack = yaml.safe_load(file)
+        else:
+            pack = json.load(file)
+
+    missing = [field for field in RULE_FIELDS if field not in pack]
+    if missing:
+        raise ValueError(f"Rule pack {path} is missing fields: {', '.join(missing)}")
+    return pack
+
+
+class CompiledRules:
+    """Скомпилированный набор правил фильтра
+
+    Объект неизменяем после сборки: при перезагрузке правил собирается новый
+    экземпляр и подменяется в фильтре одним присваиванием ссылки. Кеши
+    вердиктов принадлежат набору правил и уходят вместе с ним.
+    """
+
+    def __init__(self, pack: Dict, cache_size: int = 4096):
+        self.name = pack.get('name', 'custom')
+        self.version = str(pack.get('version', '0'))
+        self.normalize_table, self.normalize_delete = build_normalize_table(pack['leet_replacements'])
+        self.patterns = {name: re.compile(pattern) for name, pattern in pack['patterns'].items()}
+
+        # Все словари переводятся в пространство символов нормализованного текста
+        # Слово с запрещенным словом внутри, длиннее его не более чем на 2 символа
+        profanity = trie_to_regex(build_trie(frozenset(map(self.normalize, pack['base_profanity']))))
+        self.profanity_regex = re.compile(rf'\b(?:{profanity}\w{{0,2}}|\w{profanity}\w?|\w\w{profanity})\b')
+        self.stem_fold = str.maketrans({mask: letter for letter, mask in STEM_LOOKALIKES.items()})
+        self.stem_masks = tuple(STEM_LOOKALIKES.values())
+        stems = frozenset(map(self.normalize, pack['profanity_stems']))
+        self.stem_regex = re.compile(trie_to_regex(build_trie(stems), shortest=True))
+        self.english_profanity = frozenset(map(self.normalize, pack['english_profanity']))
+        self.hidden_roots = tuple(pack['hidden_profanity_roots'])
+        self.hidden_max_length = max(map(len, self.hidden_roots)) + 2
+
+        self.spam_sets = {
+            category: frozenset(map(self.normalize, words))
+            for category, words in pack['spam_triggers'].items()
         }
-
-        # РЕГУЛЯРНЫЕ ВЫРАЖЕНИЯ ДЛЯ СЛОЖНЫХ ПАТТЕРНОВ
-        self.patterns = {
-            # Основные матерные паттерны (более точные)
-            'russian_profanity': r'(?i)([хx][уy][йj]|[пp][иi][з3][дd]|[еe][б6][аa])',
-            'english_profanity': r'(?i)\b(fuck|shit|asshole|bitch|cunt|dick|pussy|whore)\b',
-
-            # Ссылки и контакты
-            'urls': r'(https?://|www\.|t\.me/|@[\w]+|vk\.com/|instagram\.com/)[^\s]*',
-            'emails': r'\b[\w\.-]+@[\w\.-]+\.\w+\b',
-            'phones': r'[\+]?[0-9\s\-\(\)]{10,}',  # минимум 10 цифр
-
-            # Спам и реклама (более точные паттерны)
-            'spam_keywords': r'(?i)\b(купите|покупайте|заказывайте|акция|скидка|распродажа|бесплатно|заработок)\b',
-            'crypto': r'(?i)\b(криптовалют[ауы]|биткоин|блокчейн|nft|эфириум)\b',
-            'casino': r'(?i)\b(казино|ставк[иа]|покер|лотере[яи]|выигрыш)\b',
-
-            # Капс и повторения
-            'caps': r'\b[A-ZА-Я]{4,}\b',  # только целые слова в капсе
-            'repetitive': r'(.)\1{5,}',   # 6+ повторений символа
-            'excessive_punct': r'[!?]{4,}', # 4+ восклицательных знаков
-
-            # Личные данные
-            'personal_info': r'\b(?:\d{16}|\d{3}-\d{2}-\d{4}|\b[A-Z][a-z]+ [A-Z][a-z]+\b)\b'
+        self.trigger_categories = {
+            tuple(self.normalize(trigger).split()): category
+            for category, triggers in pack['context_triggers'].items()
+            for trigger in triggers
         }
+        self.trigger_first_words = frozenset(trigger[0] for trigger in self.trigger_categories)
+        self.trigger_trie = build_trie(self.trigger_categories)
+        self.context_categories = tuple(pack['context_triggers'])
+        self.category_names = dict(pack['context_category_names'])
+
+        self.whitelist = frozenset(pack['whitelist'])
+        self.short_unclear = frozenset(pack['short_unclear'])
+        self.reset_caches(cache_size)
+
+    def reset_caches(self, cache_size: int):
+        """Создать пустые кеши вердиктов"""
+        self.cache_size = cache_size
+        self.verdict_cache = LRUCache(cache_size)
+        self.unclear_cache = LRUCache(cache_size)
+
+    def __getstate__(self):
+        # Кеши вердиктов на диск не сохраняются
+        state = self.__dict__.copy()
+        state.pop('verdict_cache', None)
+        state.pop('unclear_cache', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset_caches(self.cache_size)
+
+    def normalize(self, text: str) -> str:
+        """Нормализация текста для поиска скрытых нарушений
+
+        Текст кодируется в cp1251 (символы вне кодировки, например эмодзи,
+        отбрасываются), после чего регистр, leet-замены, омоглифы и удаление
+        пунктуации выполняются одним bytes.translate.
+        """
+        if text.isascii():
+            return text.encode().translate(self.normalize_table, self.normalize_delete).decode()
+        encoded = _charmap_encode(text, 'ignore', _CP1251_ENCODING)[0]
+        translated = encoded.translate(self.normalize_table, self.normalize_delete)
+        return _charmap_decode(translated, 'strict', _CP1251_DECODING)[0]
+
+    def stem_normalize(self, lower: str, normalized: Optional[str] = None) -> str:
+        """Нормализация для проверки корней: маски букв (3, 6, j, p, i, d) заменяются буквами до leet-замен"""
+        if normalized is not None and not any(mask in lower for mask in self.stem_masks):
+            return normalized
+        return self.normalize(lower.translate(self.stem_fold))
+
+
+def is_private_dir(path: str) -> bool:
+    """Каталог принадлежит пользователю процесса и недоступен остальным (0700)"""
+    info = os.stat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+
+
+def compile_rules(pack: Dict, cache_size: int = 4096, cache_dir: Optional[str] = None) -> CompiledRules:
+    """Скомпилировать набор правил, используя дисковый кеш, если он задан
+
+    Ключ кеша - хеш содержимого набора, поэтому любое изменение правил
+    приводит к новой компиляции, а холодный старт с теми же правилами - нет.
+    Кеш загружается через pickle, поэтому используется только в приватном
+    каталоге (0700, владелец - пользователь процесса); иначе правила
+    компилируются заново.
+    """
+    if not cache_dir:
+        return CompiledRules(pack, cache_size)
+
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        private = is_private_dir(cache_dir)
+    except OSError as e:
+        logger.warning(f"Filter rules cache directory unavailable: {e}")
+        private = False
+    if not private:
+        logger.warning(f"Filter rules cache disabled: {cache_dir} must be owned by the bot user with mode 0700")
+        return CompiledRules(pack, cache_size)
+
+    digest = hashlib.sha256(
+        f"{RULES_CACHE_FORMAT}:{json.dumps(pack, sort_keys=True, ensure_ascii=False, default=sorted)}".encode()
+    ).hexdigest()
+    cache_path = os.path.join(cache_dir, f"rules-{digest[:32]}.pickle")
+
+    try:
+        with open(cache_path, 'rb') as file:
+            rules = pickle.load(file)
+        rules.reset_caches(cache_size)
+        logger.info(f"Filter rules loaded from cache: {cache_path}")
+        return rules
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Filter rules cache is unreadable, recompiling: {e}")
+
+    rules = CompiledRules(pack, cache_size)
+    try:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(rules, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to write filter rules cache: {e}")
+    return rules
+
+
+@dataclass
+class TokenizedText:
+    """Результат единственной токенизации сообщения, общий для всех проверок"""
+    text: str
+    lower: str
+    words: List[str]
+    normalized: str
+    normalized_words: List[str]
+    rules: CompiledRules
+    _tokens: Optional[List[Token]] = None
+    _stem_normalized: Optional[str] = None
+
+    @property
+    def stem_normalized(self) -> str:
+        """Нормализованный текст для проверки корней (совпадает с normalized, если масок нет)"""
+        if self._stem_normalized is None:
+            self._stem_normalized = self.rules.stem_normalize(self.lower, self.normalized)
+        return self._stem_normalized
+
+    @property
+    def tokens(self) -> List[Token]:
+        """Слова со смещениями в исходном тексте (вычисляются по требованию)"""
+        if self._tokens is None:
+            self._tokens = [
+                Token(match.start(), match.end(), match.group().lower())
+                for match in _WORD_RE.finditer(self.text)
+            ]
+        return self._tokens
 
-        # КОНТЕКСТНЫЕ ТРИГГЕРЫ (только явно опасные)
-        self.context_triggers = {
-            'scam': ['гарантирован', 'быстрый доход', 'легкие деньги', 'прибыль'],
-            'adult': ['порно', 'интим', 'голый', 'обнаженный', 'xxx'],
-            'violence': ['убийство', 'оружие', 'насилие', 'избиение'],
-            'drugs': ['наркотик', 'марихуана', 'героин', 'кокаин', 'лсд'],
-            'hate_speech': ['ненависть', 'убивай', 'смерть', 'терроризм']
-        }
 
-        # БЕЛЫЙ СПИСОК - слова, которые могут быть ошибочно заблокированы
-        self.whitelist = [
-            'хер', 'хрен', 'сука', 'суки', 'блять',  # смягченные варианты
-            'секс', 'интимный', 'обнаженка',         # контекстные слова
-            'биткоин', 'блокчейн', 'нфт',           # крипто термины
-            'казин', 'покер',                      # игровые термины
-            'купить', 'покупать', 'заказ', 'бизнес', # коммерческие термины
-            'очистка', 'таймер', 'контекст', 'память', # технические термины
-            'бот', 'промпт', 'python', 'код', 'шаблон',
-            'клавиатуры', 'replykeyboardmarkup', 'inlinekeyboardmarkup',
-            'кнопка', 'меню', 'сбросить', 'диалог',
-            'автоперезагрузка', 'watchdog', 'разработка', 'дебаг',
-            'openai', 'hf', 'модель', 'диалог', 'настройки',
-            'redis', 'memory', 'context', 'пользователь',
-            'rate', 'limiting', 'спам', 'ddos', 'нагрузка', 'api'
-        ]
+class UltraTextFilter:
+    def __init__(self, cache_size: int = 4096, rules_path: str = DEFAULT_RULES_PATH,
+                 cache_dir: Optional[str] = None):
+        self.cache_size = cache_size
+        self.rules_path = rules_path
+        self.cache_dir = cache_dir
+        self._reload_lock = threading.Lock()
+        self._watch_stop = threading.Event()
+        self._watch_thread: Optional[threading.Thread] = None
+
+        # Правила читаются из версионируемого файла, а не задаются в коде
+        self._rules_mtime = os.path.getmtime(rules_path)
+        self.rule_pack = load_rule_pack(rules_path)
+        self._rules = compile_rules(self.rule_pack, cache_size, cache_dir)
+
+    @property
+    def rules_version(self) -> str:
+        """Версия активного набора правил"""
+        return f"{self._rules.name} v{self._rules.version}"
+
+    def update_rules(self, **rules):
+        """Обновить словари и паттерны фильтра и пересобрать матчеры"""
+        unknown = [name for name in rules if name not in RULE_FIELDS]
+        if unknown:
+            raise AttributeError(f"Unknown filter rule: {', '.join(unknown)}")
+        pack = {**self.rule_pack, **rules}
+        compiled = compile_rules(pack, self.cache_size, self.cache_dir)
+        self.rule_pack = pack
+        self._rules = compiled
+
+    def reload_rules(self, path: Optional[str] = None, background: bool = True) -> Optional[threading.Thread]:
+        """Перечитать набор правил и подменить матчер, не останавливая обработку сообщений
+
+        В фоновом режиме компиляция идет в отдельном потоке, а сообщения
+        продолжают проверяться старым набором до момента подмены.
+        """
+        path = path or self.rules_path
+        if not background:
+            self._reload_rules(path)
+            return None
+
+        thread = threading.Thread(target=self._reload_rules, args=(path,), name="filter-rules-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_rules(self, path: str) -> bool:
+        """Загрузка, компиляция и атомарная подмена набора правил"""
+        with self._reload_lock:
+            try:
+                mtime = os.path.getmtime(path)
+                pack = load_rule_pack(path)
+                compiled = compile_rules(pack, self.cache_size, self.cache_dir)
+            except Exception as e:
+                logger.error(f"❌ Failed to reload filter rules from {path}: {e}")
+                return False
+
+            self.rule_pack = pack
+            self.rules_path = path
+            self._rules_mtime = mtime
+            # Единственное присваивание ссылки: проверки читают self._rules один раз на сообщение
+            self._rules = compiled
+            logger.info(f"✅ Filter rules reloaded: {self.rules_version}")
+            return True
+
+    def watch_rules(self, interval: float = 30.0):
+        """Следить за файлом правил и перезагружать его при изменении"""
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+
+        def watch():
+            while not self._watch_stop.wait(interval):
+                try:
+                    mtime = os.path.getmtime(self.rules_path)
+                except OSError:
+                    continue
+                if mtime != self._rules_mtime:
+                    self._reload_rules(self.rules_path)
+
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(target=watch, name="filter-rules-watch", daemon=True)
+        self._watch_thread.start()
+        logger.info(f"Watching filter rules: {self.rules_path} (every {interval}s)")
+
+    def stop_watching(self):
+        """Остановить слежение за файлом правил"""
+        self._watch_stop.set()
+
+    def tokenize(self, text: str, rules: Optional[CompiledRules] = None) -> TokenizedText:
+        """Единственная токенизация сообщения: слова со смещениями и нормализованные слова"""
+        rules = rules or self._rules
+        lower = text.lower()
+        normalized = rules.normalize(text)
+        return TokenizedText(text, lower, _WORD_RE.findall(lower), normalized, normalized.split(), rules)
 
     def filter_text(self, text: str) -> Tuple[str, str]:
         """УЛЬТРА-фильтрация текста"""
@@ -90,224 +424,275 @@ class UltraTextFilter:
         if len(text) > 2000:
             return "", "сообщение слишком длинное"
 
+        # Один снимок правил на сообщение: перезагрузка не смешивает наборы
+        rules = self._rules
+
+        # Повторяющиеся сообщения (кнопки, приветствия, волны спама) берем из кеша
+        verdict = rules.verdict_cache.get(text)
+        if verdict is MISSING:
+            verdict = self._filter_uncached(text, rules)
+            rules.verdict_cache.set(text, verdict)
+            if verdict:
+                logger.warning("Text blocked: %s - Text: %s", verdict, text)
+
+        return ("", verdict) if verdict else (text, "")
+
+    def _filter_uncached(self, text: str, rules: CompiledRules) -> str:
+        """Полная проверка текста; возвращает описание нарушения или пустую строку"""
+        error_type, error_msg, _ = self._run_checks(self.tokenize(text, rules))
+        return f"{error_type}: {error_msg}" if error_type else ""
+
+    def _run_checks(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
+        """Проверки до первого нарушения: (тип, описание, идентификатор правила)"""
         # Проверяем белый список ПЕРВЫМ делом
-        if self._check_whitelist(text):
-            return text, ""
-
-        # Нормализуем текст для анализа
-        normalized_text = self._normalize_text(text.lower())
-
-        # МНОГОУРОВНЕВАЯ ПРОВЕРКА
-        checks = [
-            self._check_profanity(normalized_text, text),
-            self._check_links(text),
-            self._check_spam(normalized_text),
-            self._check_suspicious_patterns(text),
-            self._check_context(normalized_text),
-            self._check_behavior(text)
-        ]
-
-        for error_type, error_msg in checks:
-            if error_type:
-                logger.warning(f"Text blocked: {error_type} - {error_msg} - Text: {text}")
-                return "", f"{error_type}: {error_msg}"
-
-        return text, ""
-
-    def _check_whitelist(self, text: str) -> bool:
+        if self._check_whitelist(tokenized):
+            return "", "", ""
+
+        # МНОГОУРОВНЕВАЯ ПРОВЕРКА (до первого нарушения)
+        checks = (
+            self._check_profanity,
+            self._check_links,
+            self._check_spam,
+            self._check_suspicious_patterns,
+            self._check_context,
+            self._check_behavior
+        )
+
+        for check in checks:
+            result = check(tokenized)
+            if result[0]:
+                return result
+
+        return "", "", ""
+
+    def scan(self, text: str, index: int = 0, rules: Optional[CompiledRules] = None) -> FilterVerdict:
+        """Структурированный вердикт для пакетной проверки: категория, правило и смещения
+
+        В отличие от filter_text не использует кеш вердиктов и не пишет в лог:
+        пакетная перепроверка архивов не должна вытеснять горячие сообщения бота.
+        """
+        if not text or len(text.strip()) < 2:
+            return FilterVerdict(index, True, "length", "length.short", "сообщение слишком короткое", [])
+
+        if len(text) > 2000:
+            return FilterVerdict(index, True, "length", "length.long", "сообщение слишком длинное", [])
+
+        tokenized = self.tokenize(text, rules)
+        error_type, error_msg, rule_id = self._run_checks(tokenized)
+        if not error_type:
+            return FilterVerdict(index, False, "", "", "", [])
+
+        return FilterVerdict(
+            index, True, rule_id.split('.', 1)[0], rule_id,
+            f"{error_type}: {error_msg}", self._locate(tokenized, rule_id)
+        )
+
+    def _locate(self, tokenized: TokenizedText, rule_id: str) -> List[Tuple[int, int]]:
+        """Смещения фрагментов исходного текста, на которых сработало правило"""
+        rules = tokenized.rules
+        group, name = rule_id.split('.', 1)
+        text = tokenized.text
+
+        # Правила по регулярным выражениям работают с исходным текстом напрямую
+        if group == 'links' or (group == 'suspicious' and name in rules.patterns):
+            return [
+                match.span() for match in rules.patterns[name].finditer(text)
+                if not (name == 'urls' and match.group().startswith('@') and '/' not in match.group())
+            ]
+
+        # Словарные правила проверяют нормализованный текст: сопоставляем по словам
+        if group in ('profanity', 'spam', 'context') and name != 'hidden':
+            tokens = tokenized.tokens
+            normalize = rules.stem_normalize if name == 'stem' else rules.normalize
+            words = [normalize(token.word) for token in tokens]
+
+            if group == 'context':
+                return [
+                    (tokens[i].start, tokens[i + len(trigger) - 1].end)
+                    for i, trigger in find_in_trie(rules.trigger_trie, words)
+                    if rules.trigger_categories[trigger] == name
+                ]
+
+            if name == 'base':
+                matches = lambda word: rules.profanity_regex.search(word)
+            elif name == 'stem':
+                matches = lambda word: rules.stem_regex.search(word)
+            elif name == 'english':
+                matches = lambda word: word in rules.english_profanity
+            else:
+                matches = lambda word: any(word in spam_set for spam_set in rules.spam_sets.values())
+            return [(token.start, token.end) for token, word in zip(tokens, words) if word and matches(word)]
+
+        # Скрытый мат и поведенческие правила относятся ко всему сообщению
+        return [(0, len(text))]
+
+    def _check_whitelist(self, tokenized: TokenizedText) -> bool:
         """Проверка белого списка"""
-        text_lower = text.lower()
-        # Разбиваем на слова и проверяем каждое слово отдельно
-        words = re.findall(r'\b\w+\b', text_lower)
-        for word in words:
-            if word in self.whitelist:
-                return True
-        return False
+        return not tokenized.rules.whitelist.isdisjoint(tokenized.words)
 
     def _normalize_text(self, text: str) -> str:
         """Нормализация текста для поиска скрытых нарушений"""
-        # Заменяем leet-speak на нормальные буквы (только для английских букв)
-        normalized = text
-        for normal_char, replacements in self.leet_replacements.items():
-            for replacement in replacements:
-                normalized = normalized.replace(replacement, normal_char)
-
-        # Удаляем лишние символы для поиска скрытых слов
-        cleaned = re.sub(r'[^\w\s]', '', normalized)
-        return cleaned
+        return self._rules.normalize(text)
 
-    def _check_profanity(self, normalized_text: str, original_text: str) -> Tuple[str, str]:
+    def _check_profanity(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Проверка нецензурной лексики (включая скрытую)"""
-        # Проверка базовых слов (только полные слова)
-        words = normalized_text.split()
-        for word in words:
-            for profanity in self.base_profanity:
-                # Проверяем точное совпадение или вхождение в слово
-                if profanity == word or (profanity in word and len(word) <= len(profanity) + 2):
-                    # Дополнительная проверка на случайные совпадения
-                    if len(word) >= 3:  # только слова длиной от 3 символов
-                        return "нецензурная лексика", f"обнаружено запрещенное слово"
-
-        # Проверка по регулярным выражениям
-        for pattern_name, pattern in self.patterns.items():
-            if 'profanity' in pattern_name and re.search(pattern, original_text.lower()):
-                # Проверяем, что это не часть другого слова
-                matches = re.finditer(pattern, original_text.lower())
-                for match in matches:
-                    matched_text = match.group()
-                    # Проверяем, что это отдельное слово или явный мат
-                    if len(matched_text) >= 3:
-                        return "нецензурная лексика", "обнаружены запрещенные выражения"
+        # Проверка базовых слов: точное совпадение или вхождение в слово
+        if tokenized.rules.profanity_regex.search(tokenized.normalized):
+            return "нецензурная лексика", f"обнаружено запрещенное слово", "profanity.base"
+
+        # Проверка корней (внутри любого слова) и английских слов (целиком)
+        if tokenized.rules.stem_regex.search(tokenized.stem_normalized):
+            return "нецензурная лексика", "обнаружены запрещенные выражения", "profanity.stem"
+
+        if not tokenized.rules.english_profanity.isdisjoint(tokenized.normalized_words):
+            return "нецензурная лексика", "обнаружены запрещенные выражения", "profanity.english"
 
         # Проверка замаскированных слов (с символами между буквами)
-        if self._check_hidden_profanity(original_text):
-            return "нецензурная лексика", "обнаружены скрытые запрещенные слова"
+        if self._check_hidden_profanity(tokenized):
+            return "нецензурная лексика", "обнаружены скрытые запрещенные слова", "profanity.hidden"
 
-        return "", ""
+        return "", "", ""
 
-    def _check_hidden_profanity(self, text: str) -> bool:
+    def _check_hidden_profanity(self, tokenized: TokenizedText) -> bool:
         """Проверка скрытой нецензурной лексики"""
-        # Удаляем все не-буквенные символы и проверяем
-        letters_only = re.sub(r'[^a-zA-Zа-яА-Я]', '', text.lower())
-
-        # Проверяем наличие матерных корней (только в отдельных словах)
-        profanity_roots = ['хуй', 'пизд', 'еба', 'бляд']  # только явные корни
-        words = re.findall(r'\w+', letters_only)
-        
-        for word in words:
-            for root in profanity_roots:
-                if root in word and len(word) <= len(root) + 2:  # допускаем небольшие вариации
-                    return True
+        # Склеиваем только буквы всех слов: срабатывает на коротких сообщениях вида "х.у.й"
+        letters_only = _NON_LETTER_RE.sub('', ''.join(tokenized.words))
+        if len(letters_only) > tokenized.rules.hidden_max_length:
+            return False
 
-        return False
+        # допускаем небольшие вариации
+        return any(root in letters_only and len(letters_only) <= len(root) + 2 for root in tokenized.rules.hidden_roots)
 
-    def _check_links(self, text: str) -> Tuple[str, str]:
+    def _check_links(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Проверка ссылок и контактов"""
-        for pattern_name, pattern in self.patterns.items():
-            if pattern_name in ['urls', 'emails', 'phones']:
-                matches = re.findall(pattern, text)
-                if matches:
-                    # Игнорируем простые @упоминания без доменов
-                    if pattern_name == 'urls':
-                        filtered_matches = [m for m in matches if not (m.startswith('@') and '/' not in m)]
-                        if filtered_matches:
-                            return "ссылки/контакты", "обнаружены ссылки или контактные данные"
-                    else:
-                        return "ссылки/контакты", "обнаружены ссылки или контактные данные"
-
-        return "", ""
-
-    def _check_spam(self, normalized_text: str) -> Tuple[str, str]:
+        for pattern_name in ('urls', 'emails', 'phones'):
+            matches = tokenized.rules.patterns[pattern_name].findall(tokenized.text)
+            if matches:
+                # Игнорируем простые @упоминания без доменов
+                if pattern_name == 'urls':
+                    filtered_matches = [m for m in matches if not (m.startswith('@') and '/' not in m)]
+                    if filtered_matches:
+                        return "ссылки/контакты", "обнаружены ссылки или контактные данные", "links.urls"
+                else:
+                    return "ссылки/контакты", "обнаружены ссылки или контактные данные", f"links.{pattern_name}"
+
+        return "", "", ""
+
+    def _check_spam(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Проверка спама и рекламы"""
-        spam_indicators = 0
+        words = set(tokenized.normalized_words)
 
         # Проверка ключевых слов спама (только в контексте)
-        for pattern_name, pattern in self.patterns.items():
-            if pattern_name in ['spam_keywords', 'crypto', 'casino']:
-                if re.search(pattern, normalized_text):
-                    spam_indicators += 1
+        spam_indicators = sum(1 for spam_set in tokenized.rules.spam_sets.values() if not spam_set.isdisjoint(words))
 
         # Требуем больше индикаторов для блокировки
         if spam_indicators >= 3:
-            return "рекламный спам", "обнаружены признаки рекламы или спама"
+            return "рекламный спам", "обнаружены признаки рекламы или спама", "spam.keywords"
 
-        return "", ""
+        return "", "", ""
 
-    def _check_suspicious_patterns(self, text: str) -> Tuple[str, str]:
+    def _check_suspicious_patterns(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Проверка подозрительных паттернов"""
-        # Капслок - только если много слов в капсе
-        caps_words = re.findall(self.patterns['caps'], text)
+        text = tokenized.text
+
+        # Капслок - только если много слов в капсе (в тексте без заглавных букв проверка не нужна)
+        caps_words = tokenized.rules.patterns['caps'].findall(text) if text != tokenized.lower else ()
         if len(caps_words) >= 3:  # минимум 3 слова в капсе
-            return "капслок", "сообщение написано капсом"
+            return "капслок", "сообщение написано капсом", "suspicious.caps"
 
         # Повторения символов
-        if re.search(self.patterns['repetitive'], text):
-            return "повторения", "слишком много повторяющихся символов"
+        if tokenized.rules.patterns['repetitive'].search(text):
+            return "повторения", "слишком много повторяющихся символов", "suspicious.repetitive"
 
         # Избыточная пунктуация
-        if re.search(self.patterns['excessive_punct'], text):
-            return "пунктуация", "слишком много восклицательных/вопросительных знаков"
+        if tokenized.rules.patterns['excessive_punct'].search(text):
+            return "пунктуация", "слишком много восклицательных/вопросительных знаков", "suspicious.excessive_punct"
 
         # Личные данные
-        if re.search(self.patterns['personal_info'], text):
-            return "личные данные", "обнаружены личные данные"
+        if tokenized.rules.patterns['personal_info'].search(text):
+            return "личные данные", "обнаружены личные данные", "suspicious.personal_info"
 
-        return "", ""
+        return "", "", ""
 
-    def _check_context(self, normalized_text: str) -> Tuple[str, str]:
+    def _check_context(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Контекстная проверка"""
-        for category, triggers in self.context_triggers.items():
-            found_triggers = []
-            for trigger in triggers:
-                # Ищем целые слова, а не части слов
-                if re.search(r'\b' + re.escape(trigger) + r'\b', normalized_text):
-                    found_triggers.append(trigger)
+        if tokenized.rules.trigger_first_words.isdisjoint(tokenized.normalized_words):
+            return "", "", ""
+
+        # Ищем целые слова и фразы, а не части слов
+        found_triggers: Dict[str, set] = {}
+        for _, trigger in find_in_trie(tokenized.rules.trigger_trie, tokenized.normalized_words):
+            category = tokenized.rules.trigger_categories[trigger]
+            found_triggers.setdefault(category, set()).add(trigger)
 
+        for category in tokenized.rules.context_categories:
             # Требуем больше триггеров для блокировки
-            if len(found_triggers) >= 3:
-                category_names = {
-                    'scam': 'мошенничество',
-                    'adult': 'взрослый контент',
-                    'violence': 'контент о насилии',
-                    'drugs': 'наркотики',
-                    'hate_speech': 'разжигание ненависти'
-                }
-                return category_names.get(category, 'неподходящий контент'), f"обнаружены признаки {category}"
-
-        return "", ""
-
-    def _check_behavior(self, text: str) -> Tuple[str, str]:
+            if len(found_triggers.get(category, ())) >= 3:
+                category_name = tokenized.rules.category_names.get(category, 'неподходящий контент')
+                return category_name, f"обнаружены признаки {category}", f"context.{category}"
+
+        return "", "", ""
+
+    def _check_behavior(self, tokenized: TokenizedText) -> Tuple[str, str, str]:
         """Поведенческий анализ"""
-        words = text.split()
+        words = tokenized.words
 
         # Проверка на флуд (много повторяющихся слов)
         if len(words) > 15:  # увеличил минимальную длину
             word_freq = Counter(words)
             most_common = word_freq.most_common(1)[0]
             if most_common[1] > len(words) * 0.4:  # 40% повторений (было 30%)
-                return "флуд", "слишком много повторяющихся слов"
+                return "флуд", "слишком много повторяющихся слов", "behavior.flood"
 
         # Проверка на специальные символы
-        special_chars = len(re.findall(r'[!@#$%^&*()_+\-=\[\]{};\':"\\|,.<>/?]', text))
+        text = tokenized.text
+        special_chars = len(_SPECIAL_CHARS_RE.findall(text))
         if special_chars > len(text) * 0.5:  # 50% спецсимволов (было 40%)
-            return "спецсимволы", "слишком много специальных символов"
+            return "спецсимволы", "слишком много специальных символов", "behavior.special_chars"
 
-        return "", ""
+        return "", "", ""
 
     def is_unclear_message(self, text: str) -> bool:
         """Проверка неясных запросов"""
-        unclear_patterns = [
-            r'^\s*[чкп]\s*$',
-            r'^\s*[?¿]\s*$',
-            r'^\s*\.+\s*$',
-            r'^\s*[нт]ет\s*$'
-        ]
-
-        for pattern in unclear_patterns:
-            if re.match(pattern, text.lower()):
-                return True
-
-        short_unclear = ['что', 'как', 'почему', 'зачем', 'кто', 'где']
-        words = text.lower().split()
-        return len(words) <= 2 and any(word in short_unclear for word in words)
+        rules = self._rules
+        unclear = rules.unclear_cache.get(text)
+        if unclear is MISSING:
+            text_lower = text.lower()
+            words = text_lower.split()
+            unclear = bool(_UNCLEAR_RE.fullmatch(text_lower)) or (
+                len(words) <= 2 and any(word in rules.short_unclear for word in words)
+            )
+            rules.unclear_cache.set(text, unclear)
+        return unclear
+
+    def get_cache_stats(self) -> Dict[str, dict]:
+        """Статистика кешей вердиктов"""
+        return {
+            'filter': self._rules.verdict_cache.get_stats(),
+            'unclear': self._rules.unclear_cache.get_stats()
+        }
 
     def get_detailed_report(self, text: str) -> Dict:
         """Детальный отчет о проверке (для отладки)"""
-        normalized = self._normalize_text(text.lower())
+        tokenized = self.tokenize(text)
 
         return {
             'original_length': len(text),
-            'normalized_text': normalized,
-            'profanity_check': self._check_profanity(normalized, text),
-            'links_check': self._check_links(text),
-            'spam_check': self._check_spam(normalized),
-            'suspicious_check': self._check_suspicious_patterns(text),
-            'context_check': self._check_context(normalized),
-            'behavior_check': self._check_behavior(text),
+            'normalized_text': tokenized.normalized,
+            'profanity_check': self._check_profanity(tokenized),
+            'links_check': self._check_links(tokenized),
+            'spam_check': self._check_spam(tokenized),
+            'suspicious_check': self._check_suspicious_patterns(tokenized),
+            'context_check': self._check_context(tokenized),
+            'behavior_check': self._check_behavior(tokenized),
             'is_unclear': self.is_unclear_message(text),
-            'whitelist_check': self._check_whitelist(text)
+            'whitelist_check': self._check_whitelist(tokenized)
         }
 
 
-# Глобальный экземпляр фильтра
-text_filter = UltraTextFilter()
\ No newline at end of file
+# Глобальный экземпляр фильтра (дисковый кеш правил - только в заданном FILTER_RULES_CACHE_DIR)
+text_filter = UltraTextFilter(
+    cache_size=int(os.getenv("FILTER_CACHE_SIZE", "4096")),
+    rules_path=os.getenv("FILTER_RULES_PATH", DEFAULT_RULES_PATH),
+    cache_dir=os.getenv("FILTER_RULES_CACHE_DIR")
+)
@@ -0,0 +1,178 @@
+from functools import lru_cache
+from typing import Sequence
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+
+
+class PrebuiltKeyboard(ReplyKeyboardMarkup):
+    """Клавиатура, собранная один раз при запуске
+
+    Кнопки и словарь клавиатуры создаются при построении, поэтому при
+    каждой отправке (PTB сериализует reply_markup через to_dict) не
+    создаются новые KeyboardButton и их словари.
+    Объекты Telegram неизменяемы, одну клавиатуру можно отправлять всем.
+    """
+
+    __slots__ = ('_dict',)
+
+    def __init__(self, rows: Sequence[Sequence[str]]):
+        super().__init__([[KeyboardButton(text) for text in row] for row in rows], resize_keyboard=True)
+        with self._unfrozen():
+            self._dict = super().to_dict()
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        # Общий словарь для всех отправок: изменять его нельзя
+        return self._dict
+
+
+def keyboard(*rows: Sequence[str]) -> PrebuiltKeyboard:
+    """Неизменяемая клавиатура из строк с текстами кнопок"""
+    return PrebuiltKeyboard(rows)
+
+
+# Главное меню (с плагинами и без)
+MAIN_MENU = keyboard(
+    ["❓ Помощь", "ℹ️ О боте"],
+    ["🔄 Сбросить диалог", "💡 Примеры запросов"],
+    ["📊 Анализ файлов", "🌤️ Погода", "💱 Курсы валют"]
+)
+MAIN_MENU_NO_PLUGINS = keyboard(
+    ["❓ Помощь", "ℹ️ О боте"],
+    ["🔄 Сбросить диалог", "💡 Примеры запросов"],
+    ["📊 Анализ файлов"]
+)
+
+# Варианты анализа загруженного файла
+FILE_ANALYSIS_MENU = keyboard(
+    ["📋 Пересказ", "🔑 Ключевые пункты"],
+    ["📊 Подробный анализ", "❓ Вопросы и ответы"],
+    ["🧩 Все виды анализа"],
+    ["◀️ Назад"]
+)
+
+
+def main_menu(plugins: bool) -> PrebuiltKeyboard:
+    """Главное меню"""
+    return MAIN_MENU if plugins else MAIN_MENU_NO_PLUGINS
+
+
+# Статические тексты: собираются один раз, по запросу подставляется только имя пользователя
+
+ABOUT_TEXT = """
+🤖 AI Telegram Bot с АКТИВНОЙ цензурой
+
+Технологии защиты:
+• Многоуровневый анализ текста
+• Распознавание скрытых нарушений
+• Контекстная оценка содержания
+• Поведенческий анализ
+
+Новые возможности:
+• Retry-логика для надежности API
+• Обработка голосовых сообщений
+
+Гарантируем безопасное общение!
+    """
+
+FILE_ANALYSIS_TEXT = """
+📊 Анализ документов
+
+Отправьте файл в одном из форматов:
+• 📄 PDF документы
+• 📝 DOCX документы  
+• 📃 TXT текстовые файлы
+
+🛡️ ВСЕ файлы проверяются на нарушения!
+    """
+
+_WELCOME_TEMPLATE = """
+🤖 Я AI-ассистент с ПРОДВИНУТОЙ системой модерации:
+
+🛡️ АКТИВНАЯ ЗАЩИТА:
+• Детекция нецензурной лексики
+• Блокировка ссылок и контактов  
+• Анти-спам фильтр
+• Защита от мошенничества
+• Контент-фильтрация
+
+📝 Анализ документов:
+• 📄 PDF файлы
+• 📝 DOCX документы  
+• 📃 TXT текстовые файлы
+
+🎤 Новые возможности:
+• Голосовые сообщения
+{plugins}
+
+💬 Безопасное общение гарантировано!
+    """
+
+_HELP_TEMPLATE = """
+🤖 Помощь по боту
+
+🛡️ Система безопасности РАБОТАЕТ:
+• Автоматическая блокировка нарушений
+• Умное распознавание контента
+• Мгновенная реакция на спам
+• Защита данных пользователей
+
+Основные функции:
+• 📄 Анализ PDF/DOCX/TXT файлов
+• 🎤 Обработка голосовых сообщений
+{plugins}
+• 💬 Умный диалог с AI
+
+Нарушения блокируются автоматически!
+    """
+
+_EXAMPLES_TEMPLATE = """
+💡 Примеры РАЗРЕШЕННЫХ запросов:
+
+Для файлов:
+Отправьте PDF/DOCX/TXT файл для анализа
+
+Голосовые сообщения:
+Отправьте голосовое сообщение - я распознаю текст!
+
+{plugins}
+Вопросы к AI:
+• "Напиши план обучения Python"
+• "Объясни теорию относительности" 
+• "Помоги с кодом для сортировки"
+
+🚫 АВТОМАТИЧЕСКИ БЛОКИРУЕТСЯ:
+• Любая нецензурная лексика
+• Ссылки и контактные данные
+• Рекламный и спам-контент
+• Мошеннические схемы
+    """
+
+
+@lru_cache(maxsize=None)
+def welcome_text(plugins: bool) -> str:
+    """Приветствие /start без первой строки с именем"""
+    return _WELCOME_TEMPLATE.replace("{plugins}", "• Прогноз погоды\n• Курсы валют" if plugins else "")
+
+
+def greeting(first_name: str, plugins: bool) -> str:
+    """Приветствие /start для пользователя"""
+    return f"\nПривет, {first_name}! 👋\n" + welcome_text(plugins)
+
+
+@lru_cache(maxsize=None)
+def help_text(plugins: bool) -> str:
+    """Текст /help"""
+    return _HELP_TEMPLATE.replace("{plugins}", """• 🌤️ Прогноз погоды (/weather)
+• 💱 Курсы валют (/currency)
+""" if plugins else "")
+
+
+@lru_cache(maxsize=None)
+def examples_text(plugins: bool) -> str:
+    """Текст примеров запросов"""
+    return _EXAMPLES_TEMPLATE.replace("{plugins}", """Команды:
+• /weather - прогноз погоды
+• /weather Москва, Казань, Сочи - сравнить погоду в городах
+• /currency - Курсы валют
+• /help - помощь
+""" if plugins else "")
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_state (
+    namespace TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (namespace, user_id)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStateBackend:
+    """Постоянное хранилище состояния пользователей в SQLite
+
+    Одна таблица на все пространства имен (плагины, диалоги), поэтому
+    файл может использоваться несколькими хранилищами одновременно.
+    Из event loop запросы выполняются через run() в отдельном потоке
+    хранилища: запись с фиксацией на диск не блокирует обработку
+    сообщений, а запросы выполняются в порядке вызова.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-state")
+
+    async def run(self, func, *args):
+        """Выполнить метод хранилища в его потоке"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def load(self, namespace: str, user_id: int, now: float) -> Optional[Tuple[dict, float]]:
+        """Состояние пользователя и срок его жизни (None, если нет или истекло)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, expires FROM user_state WHERE namespace = ? AND user_id = ? AND expires > ?",
+                (namespace, user_id, now)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def save(self, namespace: str, user_id: int, data: dict, expires: float):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO user_state (namespace, user_id, data, expires) VALUES (?, ?, ?, ?)",
+                (namespace, user_id, json.dumps(data, ensure_ascii=False), expires)
+            )
+
+    def delete(self, namespace: str, user_id: int):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM user_state WHERE namespace = ? AND user_id = ?", (namespace, user_id))
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Удалить истекшие записи всех пространств имен"""
+        with self._lock, self._db:
+            cursor = self._db.execute("DELETE FROM user_state WHERE expires <= ?", (time.time() if now is None else now,))
+        return cursor.rowcount
+
+
+class UserStateStore:
+    """Ограниченное по размеру и времени жизни состояние пользователей одного плагина
+
+    В памяти хранятся не больше maxsize последних пользователей (LRU), запись
+    без обращений дольше ttl секунд считается удаленной. Если задан backend,
+    состояние записывается в него и переживает перезапуск и вытеснение из памяти.
+    """
+
+    def __init__(self, namespace: str, maxsize: int = 10000, ttl: float = 30 * 86400,
+                 backend: Optional[SQLiteStateBackend] = None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data: "OrderedDict[int, Tuple[float, dict]]" = OrderedDict()  # пользователь -> (истекает, данные)
+        self._sweep_at = 0.0
+        self.evicted = 0
+        self.expired = 0
+
+    async def get(self, user_id: int, now: Optional[float] = None) -> dict:
+        """Состояние пользователя; для нового пользователя - пустой словарь, который не сохраняется до set"""
+        now = time.time() if now is None else now
+        entry = self._data.get(user_id)
+        if entry is not None:
+            if entry[0] > now:
+                self._data.move_to_end(user_id)
+                return entry[1]
+            del self._data[user_id]
+            self.expired += 1
+
+        if self.backend is not None:
+            try:
+                stored = await self.backend.run(self.backend.load, self.namespace, user_id, now)
+            except Exception as e:
+                logger.error(f"User state load failed ({self.namespace}): {e}")
+                stored = None
+            if stored is not None:
+                data, expires = stored
+                self._remember(user_id, data, expires, now)
+                return data
+        return {}
+
+    async def set(self, user_id: int, data: dict, now: Optional[float] = None):
+        """Сохранить состояние пользователя (пустое состояние удаляется)"""
+        if not data:
+            await self.delete(user_id)
+            return
+
+        now = time.time() if now is None else now
+        expires = now + self.ttl
+        self._remember(user_id, data, expires, now)
+        if self.backend is not None:
+            try:
+                await self.backend.run(self.backend.save, self.namespace, user_id, dict(data), expires)
+            except Exception as e:
+                logger.error(f"User state save failed ({self.namespace}): {e}")
+
+    async def delete(self, user_id: int):
+        self._data.pop(user_id, None)
+        if self.backend is not None:
+            try:
+                await self.backend.run(self.backend.delete, self.namespace, user_id)
+            except Exception as e:
+                logger.error(f"User state delete failed ({self.namespace}): {e}")
+
+    def _remember(self, user_id: int, data: dict, expires: float, now: float):
+        self._data[user_id] = (expires, data)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evicted += 1
+        self._sweep(now)
+
+    def _sweep(self, now: float):
+        """Периодически удалять истекшие записи из памяти"""
+        if now < self._sweep_at:
+            return
+        self._sweep_at = now + min(self.ttl, 300)
+        expired = [user_id for user_id, (expires, _) in self._data.items() if expires <= now]
+        for user_id in expired:
+            del self._data[user_id]
+        self.expired += len(expired)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, user_id: int) -> bool:
+        entry = self._data.get(user_id)
+        return entry is not None and entry[0] > time.time()
+
+    def get_stats(self) -> Dict[str, object]:
+        """Статистика хранилища"""
+        return {
+            "namespace": self.namespace,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "persistent": self.backend is not None
+        }
+
+
+def _create_state_backend() -> Optional[SQLiteStateBackend]:
+    """Постоянное хранилище по настройкам окружения (USER_STATE_DB); без него состояние только в памяти"""
+    path = os.getenv("USER_STATE_DB")
+    if not path:
+        return None
+    try:
+        backend = SQLiteStateBackend(path)
+        removed = backend.purge()
+        logger.info(f"✅ User state store: {path} ({removed} expired entries removed)")
+        return backend
+    except Exception as e:
+        logger.error(f"❌ User state store unavailable, using memory only: {e}")
+        return None
+
+
+# Общее постоянное хранилище состояния пользователей (пространства имен - по плагинам)
+state_backend = _create_state_backend()